@@ -0,0 +1,263 @@
+"""
+Fake adb and aapt binaries for offline benchmarks.
+
+CreateFakeEnvironment puts 'adb' and 'aapt' shell scripts into a folder which is put first in PATH. Fake adb lists
+FAKE_ADB_DEVICES simulated devices and serves canned getprop, dumpsys (SurfaceFlinger, battery, package),
+/proc/cpuinfo, pm and am outputs for them, both for 'adb shell <command>' and for shell sessions. Every command
+(adb itself and every device side command) waits FAKE_ADB_LATENCY seconds first, which stands for the USB round
+trip and work on the device. Every adb and aapt start is logged to FAKE_ADB_LOG, so process spawns can be counted.
+
+Devices cycle through a few models, so market name, GPU and CPU lookups hit different entries. SeedResFolder
+writes matching supported_devices.csv and CPU database into a res folder (see ADBEPY_RES_DIR), so nothing is
+downloaded while benchmarking.
+
+Fake binaries are POSIX shell scripts, so benchmarks using them run on Linux and macOS only.
+
+Usage: python benchmarks/fakeadb.py FOLDER [--devices N] [--latency SECONDS]
+prints environment variables which make adbe use the fake devices from a regular shell.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+import zipfile
+
+# (manufacturer, model, product name, device, market name, board, GLES line)
+fakeModels = [
+    ("Google", "Pixel 3", "blueline", "blueline", "Pixel 3", "sdm845", "Qualcomm, Adreno (TM) 630, OpenGL ES 3.2"),
+    ("samsung", "SM-G950F", "dreamltexx", "dreamlte", "Galaxy S8", "universal8895", "ARM, Mali-G71, OpenGL ES 3.2"),
+    ("Xiaomi", "Redmi Note 8", "ginkgo", "ginkgo", "Redmi Note 8", "trinket", "Qualcomm, Adreno (TM) 610, OpenGL ES 3.2")
+]
+# serial's last digit picks the model, so device scripts do not have to start anything to find it
+modelPatterns = ["*[0369]", "*[147]", "*[258]"]
+
+fakeBundleID = "com.adbepy.benchmark"
+# third party apps every fake device has, one of them is whitelisted by 'purge'
+fakeInstalledApps = ["com.adbepy.bench.app%d" % (index) for index in range(1, 6)] + ["com.google.android.gms"]
+
+latencyFunction = """wait_latency() {
+    [ "${FAKE_ADB_LATENCY:-0}" = "0" ] || sleep "$FAKE_ADB_LATENCY"
+}
+"""
+
+fakeAdbScript = """#!/bin/sh
+echo "adb $*" >> "${FAKE_ADB_LOG:-/dev/null}"
+%(latencyFunction)s
+if [ "$1" = "-s" ]; then FAKE_SERIAL=$2; export FAKE_SERIAL; shift 2; fi
+case "$1" in
+version)
+    echo "Android Debug Bridge version 1.0.41 (fake)";;
+devices)
+    wait_latency
+    echo "List of devices attached"
+    i=1
+    while [ $i -le "${FAKE_ADB_DEVICES:-1}" ]; do
+        printf 'BENCH%%04d\\tdevice\\n' $i
+        i=$((i + 1))
+    done
+    echo;;
+shell)
+    shift
+    PATH="%(deviceFolder)s:$PATH"; export PATH
+    # without command adb opens interactive shell (used by shell sessions)
+    if [ $# -eq 0 ]; then exec sh; fi
+    exec sh -c "$*";;
+push)
+    wait_latency
+    echo "$2: 1 file pushed, 0 skipped.";;
+install|uninstall)
+    wait_latency
+    echo "Success";;
+*)
+    wait_latency;;
+esac
+exit 0
+"""
+
+fakeAaptScript = """#!/bin/sh
+echo "aapt $*" >> "${FAKE_ADB_LOG:-/dev/null}"
+%(latencyFunction)s
+wait_latency
+echo "package: name='%(bundleID)s' versionCode='5' versionName='1.0'"
+echo "sdkVersion:'21'"
+echo "targetSdkVersion:'28'"
+echo "launchable-activity: name='%(bundleID)s.MainActivity'  label='Benchmark' icon=''"
+echo "native-code: 'arm64-v8a' 'armeabi-v7a'"
+"""
+
+# device side commands, they run inside device's shell with FAKE_SERIAL set
+deviceScripts = {
+    "getprop": """#!/bin/sh
+%(latencyFunction)s
+wait_latency
+case "$FAKE_SERIAL" in
+%(modelCases)s
+esac
+if [ $# -gt 0 ]; then
+    printf '%%s\\n' "$props" | sed -n "s/^\\[$1\\]: \\[\\(.*\\)\\]$/\\1/p"
+else
+    printf '%%s\\n' "$props"
+fi
+""",
+    "dumpsys": """#!/bin/sh
+%(latencyFunction)s
+wait_latency
+case "$FAKE_SERIAL" in
+%(glesCases)s
+esac
+case "$1" in
+SurfaceFlinger)
+    echo "Display 0 HWC layers:"
+    echo "GLES: $gles";;
+battery)
+    printf 'Current Battery Service state:\\n  AC powered: false\\n  USB powered: true\\n  status: 2\\n  level: 87\\n  voltage: 4200\\n  temperature: 301\\n';;
+package)
+    echo "    versionCode=4 minSdk=21 targetSdk=28";;
+esac
+""",
+    "cat": """#!/bin/sh
+if [ "$1" != "/proc/cpuinfo" ]; then exec /bin/cat "$@"; fi
+%(latencyFunction)s
+wait_latency
+printf 'processor\\t: 0\\nBogoMIPS\\t: 38.40\\nHardware\\t: Qualcomm Technologies, Inc SDM845\\n'
+""",
+    "pm": """#!/bin/sh
+%(latencyFunction)s
+wait_latency
+case "$1" in
+list)
+    for app in %(installedApps)s; do echo "package:$app"; done;;
+path)
+    echo "package:/data/app/$2-1/base.apk";;
+*)
+    echo "Success";;
+esac
+""",
+    "am": """#!/bin/sh
+%(latencyFunction)s
+wait_latency
+echo "Starting: Intent { cmp=$3 }"
+""",
+    "sha256sum": """#!/bin/sh
+%(latencyFunction)s
+echo "0000000000000000000000000000000000000000000000000000000000000000  $1"
+""",
+    "rm": """#!/bin/sh
+%(latencyFunction)s
+wait_latency
+""",
+    "reboot": """#!/bin/sh
+%(latencyFunction)s
+wait_latency
+"""
+}
+
+
+def GetFakeProperties(model):
+    manufacturer, modelCode, productName, productDevice, marketName, board, gles = model
+    properties = {
+        "ro.product.manufacturer": manufacturer,
+        "ro.product.model": modelCode,
+        "ro.product.name": productName,
+        "ro.product.device": productDevice,
+        "ro.product.board": board,
+        "ro.product.cpu.abi": "arm64-v8a",
+        "ro.build.version.release": "10",
+        "ro.build.fingerprint": "%s/%s/%s:10/QQ3A.200805.001/6578210:user/release-keys" % (manufacturer, productName, productDevice)
+    }
+    return "\n".join("[%s]: [%s]" % (key, value) for key, value in properties.items())
+
+
+def WriteScript(filePath, content):
+    with open(filePath, mode="w") as scriptFile:
+        scriptFile.write(content)
+    os.chmod(filePath, 0o755)
+
+
+def CreateFakeEnvironment(folder):
+    """
+    Creates fake adb and aapt in 'folder/bin' and device commands in 'folder/device'.
+    Returns folder which has to be put first in PATH
+    """
+    binFolder = os.path.join(folder, "bin")
+    deviceFolder = os.path.join(folder, "device")
+    for directory in [binFolder, deviceFolder]:
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+    modelCases = "\n".join("%s) props='%s';;" % (pattern, GetFakeProperties(model)) for pattern, model in zip(modelPatterns, fakeModels))
+    glesCases = "\n".join("%s) gles='%s';;" % (pattern, model[6]) for pattern, model in zip(modelPatterns, fakeModels))
+    values = {
+        "latencyFunction": latencyFunction,
+        "deviceFolder": deviceFolder,
+        "bundleID": fakeBundleID,
+        "modelCases": modelCases,
+        "glesCases": glesCases,
+        "installedApps": " ".join(fakeInstalledApps)
+    }
+    WriteScript(os.path.join(binFolder, "adb"), fakeAdbScript % values)
+    WriteScript(os.path.join(binFolder, "aapt"), fakeAaptScript % values)
+    for name, script in deviceScripts.items():
+        WriteScript(os.path.join(deviceFolder, name), script % values)
+    return binFolder
+
+
+def SeedResFolder(resFolder):
+    """
+    Writes supported_devices.csv and fresh CPU database cache for the fake models into res folder,
+    so market names and CPU info are found without network
+    """
+    if not os.path.exists(resFolder):
+        os.makedirs(resFolder)
+    csvText = io.StringIO()
+    writer = csv.writer(csvText, lineterminator="\n")
+    writer.writerow(["Retail Branding", "Marketing Name", "Device", "Model"])
+    for manufacturer, modelCode, productName, productDevice, marketName, board, gles in fakeModels:
+        writer.writerow([manufacturer, marketName, productDevice, modelCode])
+    with open(os.path.join(resFolder, "supported_devices.csv"), mode="w", encoding="UTF-16", newline="") as csvFile:
+        csvFile.write(csvText.getvalue())
+    boards = {model[5]: {"SoC": "Fake %s" % (model[5]), "CPU": "8x 2.0 GHz"} for model in fakeModels}
+    with open(os.path.join(resFolder, "cpu_database.json"), mode="w", encoding="utf-8") as cacheFile:
+        json.dump({"fetched": time.time(), "boards": boards}, cacheFile)
+
+
+def CreateFakeApk(apkPath):
+    """
+    Creates apk which can't be read by adbe's own apk reader, so aapt is used for it
+    """
+    with zipfile.ZipFile(apkPath, mode="w") as apkFile:
+        apkFile.writestr("AndroidManifest.xml", b"not a binary manifest")
+        apkFile.writestr("classes.dex", b"dex\n035\0" + bytes(1024))
+    return apkPath
+
+
+def GetFakeEnvironmentVariables(binFolder, devicesCount, latency, logPath):
+    env = dict(os.environ)
+    env["PATH"] = binFolder + os.pathsep + env.get("PATH", "")
+    env["FAKE_ADB_DEVICES"] = str(devicesCount)
+    env["FAKE_ADB_LATENCY"] = "%g" % (latency)
+    env["FAKE_ADB_LOG"] = logPath
+    return env
+
+
+def Main():
+    parser = argparse.ArgumentParser(description="Creates fake adb and aapt for running adbe without devices")
+    parser.add_argument("folder", help="Folder where fake binaries and res folder are created")
+    parser.add_argument("--devices", type=int, default=10, help="How many devices fake adb lists (default: 10)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds every command takes (default: 0.02)")
+    args = parser.parse_args()
+
+    folder = os.path.abspath(args.folder)
+    binFolder = CreateFakeEnvironment(folder)
+    resFolder = os.path.join(folder, "res")
+    SeedResFolder(resFolder)
+    print("export PATH=\"%s:$PATH\"" % (binFolder))
+    print("export FAKE_ADB_DEVICES=%d FAKE_ADB_LATENCY=%g FAKE_ADB_LOG=\"%s\"" % (args.devices, args.latency, os.path.join(folder, "adb.log")))
+    print("export ADBEPY_RES_DIR=\"%s\" ADBEPY_DAEMON_SOCKET=\"%s\"" % (resFolder, os.path.join(folder, "adbepy.sock")))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(Main())
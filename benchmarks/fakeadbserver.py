@@ -0,0 +1,162 @@
+"""
+Fake adb server for testing the native adb client (src/modules/adbclient.py) without adb and devices.
+
+FakeAdbServer listens on localhost and answers adb smart-socket requests: host:version, host:devices,
+host:transport:<serial> followed by shell:, exec: or sync: (STAT, RECV, SEND and QUIT). Shell and exec
+commands are answered from a {command: output} dictionary, sync service keeps pushed files in memory per device,
+so pushed file can be pulled back. Devices which are not listed are answered with FAIL, like the real server does.
+
+Usage: python benchmarks/fakeadbserver.py [--port 15037]
+runs the server until CTRL+C. Point adbe at it with ANDROID_ADB_SERVER_PORT and NATIVE_ADB=true in adbepy.config.
+"""
+import argparse
+import socketserver
+import struct
+import sys
+import threading
+
+fakeServerVersion = 41
+
+
+class FakeAdbHandler(socketserver.BaseRequestHandler):
+
+    def ReadExactly(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise EOFError("client closed the connection")
+            data += chunk
+        return data
+
+    def ReadRequest(self):
+        return self.ReadExactly(int(self.ReadExactly(4), 16)).decode("utf-8")
+
+    def SendOkay(self, payload=None):
+        self.request.sendall(b"OKAY")
+        if payload is not None:
+            self.request.sendall(b"%04x" % len(payload) + payload)
+
+    def SendFail(self, message):
+        message = message.encode("utf-8")
+        self.request.sendall(b"FAIL" + b"%04x" % len(message) + message)
+
+    def handle(self):
+        server = self.server
+        try:
+            request = self.ReadRequest()
+            if request == "host:version":
+                self.SendOkay(b"%04x" % fakeServerVersion)
+            elif request == "host:devices":
+                self.SendOkay("".join("%s\t%s\n" % (serial, state) for serial, state in server.devices).encode("utf-8"))
+            elif request.startswith("host:transport:"):
+                serial = request[len("host:transport:"):]
+                if (serial, "device") not in server.devices:
+                    self.SendFail("device '%s' not found" % (serial))
+                    return
+                self.SendOkay()
+                self.HandleService(serial, self.ReadRequest())
+            else:
+                self.SendFail("unknown host service")
+        except EOFError:
+            pass
+
+    def HandleService(self, serial, service):
+        server = self.server
+        if service.startswith("shell:") or service.startswith("exec:"):
+            command = service.split(":", 1)[1]
+            self.SendOkay()
+            self.request.sendall(server.commandOutputs.get(command, b""))
+        elif service == "sync:":
+            self.SendOkay()
+            self.HandleSync(server.GetDeviceFiles(serial))
+        else:
+            self.SendFail("unknown device service")
+
+    def HandleSync(self, files):
+        while True:
+            header = self.ReadExactly(8)
+            requestID = header[:4]
+            data = self.ReadExactly(struct.unpack("<I", header[4:])[0])
+            if requestID == b"QUIT":
+                return
+            path = data.decode("utf-8")
+            if requestID == b"STAT":
+                content = files.get(path)
+                mode, size = (0o100644, len(content)) if content is not None else (0, 0)
+                self.request.sendall(b"STAT" + struct.pack("<III", mode, size, 0))
+            elif requestID == b"RECV":
+                if path not in files:
+                    message = b"No such file or directory"
+                    self.request.sendall(b"FAIL" + struct.pack("<I", len(message)) + message)
+                    continue
+                content = files[path]
+                # real server splits files into chunks of up to 64K as well
+                for offset in range(0, len(content), 64 * 1024):
+                    chunk = content[offset:offset + 64 * 1024]
+                    self.request.sendall(b"DATA" + struct.pack("<I", len(chunk)) + chunk)
+                self.request.sendall(b"DONE" + struct.pack("<I", 0))
+            elif requestID == b"SEND":
+                remotePath = path.rsplit(",", 1)[0]
+                chunks = []
+                while True:
+                    header = self.ReadExactly(8)
+                    if header[:4] == b"DONE":
+                        break
+                    chunks.append(self.ReadExactly(struct.unpack("<I", header[4:])[0]))
+                files[remotePath] = b"".join(chunks)
+                self.request.sendall(b"OKAY" + struct.pack("<I", 0))
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    """
+    devices - list of (serial, state) tuples, commandOutputs - {shell or exec command: output bytes}.
+    Port 0 picks a free port, see GetPort
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, devices, commandOutputs=None, port=0):
+        super().__init__(("127.0.0.1", port), FakeAdbHandler)
+        self.devices = devices
+        self.commandOutputs = commandOutputs or {}
+        self.__deviceFiles = {}
+        self.__lock = threading.Lock()
+
+    def GetPort(self):
+        return self.server_address[1]
+
+    def GetDeviceFiles(self, serial):
+        with self.__lock:
+            return self.__deviceFiles.setdefault(serial, {})
+
+    def Start(self):
+        """
+        Serves requests on a background thread until Stop is called
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def Stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def Main():
+    parser = argparse.ArgumentParser(description="Runs fake adb server for the native adb client")
+    parser.add_argument("--port", type=int, default=15037, help="Port to listen on (default: 15037)")
+    args = parser.parse_args()
+
+    server = FakeAdbServer([("FAKE0001", "device"), ("FAKE0002", "unauthorized")],
+                           {"getprop ro.product.model": b"Fake Model\n"}, args.port)
+    print("Fake adb server is listening on port %d, press CTRL+C to stop" % (server.GetPort()))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(Main())
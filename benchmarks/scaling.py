@@ -0,0 +1,143 @@
+"""
+Measures how adbe subcommands scale with the amount of connected devices.
+
+Devices are simulated by fake adb and aapt (see benchmarks/fakeadb.py), so no real devices, adb server or
+network are needed. Every command is run for every device count and wall time, process spawns (adb and aapt
+starts) and peak memory (max RSS of adbe process and it's children) are reported. Each measurement starts with
+a fresh res folder (see ADBEPY_RES_DIR), so device cache is empty and devices are probed. With --warm command is
+run once before it is measured, so cached device info is used like in everyday use.
+
+Measured commands:
+print-devices - GetConnectedDevices with full device info (DeviceData probing, market names, CPU and GPU)
+list          - GetConnectedDevices with minimal info and 'pm list packages' on every device
+install       - Install with apk info read by aapt, push, 'pm install' and app launch on every device
+purge         - PurgeApps, listing and uninstalling third party apps on every device
+
+Usage: python benchmarks/scaling.py [--devices 1 10 50 200] [--latency SECONDS] [--commands ...] [--warm] [--json results.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from fakeadb import CreateFakeEnvironment, SeedResFolder, CreateFakeApk, GetFakeEnvironmentVariables
+
+adbePath = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src", "adbe.py"))
+
+# {apk} is replaced with path of the fake apk
+benchmarkCommands = {
+    "print-devices": ["print-devices", "--battery"],
+    "list": ["list"],
+    "install": ["install", "{apk}", "--force"],
+    "purge": ["purge"]
+}
+
+defaultDeviceCounts = [1, 10, 50, 200]
+
+
+def CountSpawns(logPath):
+    """
+    Returns (adb starts, aapt starts) logged by fake binaries
+    """
+    adbStarts = 0
+    aaptStarts = 0
+    with open(logPath, mode="r") as logFile:
+        for line in logFile:
+            if line.startswith("adb "):
+                adbStarts += 1
+            elif line.startswith("aapt "):
+                aaptStarts += 1
+    return adbStarts, aaptStarts
+
+
+def RunCommand(arguments, env):
+    """
+    Runs adbe and returns (exit code, wall time in seconds, peak memory in MB). Peak memory is max RSS of
+    adbe and all it's waited children
+    """
+    startTime = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, adbePath] + arguments, env=env, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # wait4 is used instead of proc.wait, because it also returns resource usage of the process
+    pid, status, usage = os.wait4(proc.pid, 0)
+    wallTime = time.perf_counter() - startTime
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peakMemory = usage.ru_maxrss / 1024 / 1024 if sys.platform == "darwin" else usage.ru_maxrss / 1024
+    return proc.returncode, wallTime, peakMemory
+
+
+def MeasureCommand(name, devicesCount, args, binFolder, seedFolder, apkPath, workFolder):
+    resFolder = os.path.join(workFolder, "res")
+    logPath = os.path.join(workFolder, "spawns.log")
+    if os.path.exists(resFolder):
+        shutil.rmtree(resFolder)
+    shutil.copytree(seedFolder, resFolder)
+    env = GetFakeEnvironmentVariables(binFolder, devicesCount, args.latency, logPath)
+    env["ADBEPY_RES_DIR"] = resFolder
+    # commands have to run in this process, not in a running daemon
+    env["ADBEPY_DAEMON_SOCKET"] = os.path.join(workFolder, "no-daemon.sock")
+    arguments = [argument.replace("{apk}", apkPath) for argument in benchmarkCommands[name]]
+    if args.warm:
+        RunCommand(arguments, env)
+    open(logPath, mode="w").close()
+
+    exitCode, wallTime, peakMemory = RunCommand(arguments, env)
+    adbStarts, aaptStarts = CountSpawns(logPath)
+    return {
+        "command": name,
+        "devices": devicesCount,
+        "exit_code": exitCode,
+        "wall_s": round(wallTime, 3),
+        "adb_starts": adbStarts,
+        "aapt_starts": aaptStarts,
+        "peak_mb": round(peakMemory, 1)
+    }
+
+
+def PrintResult(result):
+    status = "" if result["exit_code"] == 0 else "  FAILED (%s)" % (result["exit_code"])
+    print("%-16s %8d %10.3f %11d %12d %9.1f%s" % (result["command"], result["devices"], result["wall_s"],
+                                                 result["adb_starts"], result["aapt_starts"], result["peak_mb"], status))
+    sys.stdout.flush()
+
+
+def Main():
+    parser = argparse.ArgumentParser(description="Measures how adbe subcommands scale with the amount of devices")
+    parser.add_argument("--devices", type=int, nargs="+", default=defaultDeviceCounts, help="Simulated device counts (default: 1 10 50 200)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds every adb and device command takes (default: 0.02)")
+    parser.add_argument("--commands", nargs="+", choices=list(benchmarkCommands), default=list(benchmarkCommands), help="Commands to measure (default: all)")
+    parser.add_argument("--warm", action="store_true", help="Runs every command once before measuring it, so device cache is filled")
+    parser.add_argument("--json", dest="jsonPath", help="Saves results to the given json file")
+    args = parser.parse_args()
+
+    if os.name != "posix":
+        print("Fake adb is a shell script, benchmarks can be run only on Linux and macOS")
+        return 1
+
+    results = []
+    with tempfile.TemporaryDirectory() as workFolder:
+        binFolder = CreateFakeEnvironment(workFolder)
+        seedFolder = os.path.join(workFolder, "seed")
+        SeedResFolder(seedFolder)
+        apkPath = CreateFakeApk(os.path.join(workFolder, "benchmark.apk"))
+
+        print("%-16s %8s %10s %11s %12s %9s" % ("Command", "Devices", "Wall s", "adb starts", "aapt starts", "Peak MB"))
+        for name in args.commands:
+            for devicesCount in args.devices:
+                result = MeasureCommand(name, devicesCount, args, binFolder, seedFolder, apkPath, workFolder)
+                PrintResult(result)
+                results.append(result)
+
+    if args.jsonPath:
+        with open(args.jsonPath, mode="w") as jsonFile:
+            json.dump({"python": sys.version, "latency": args.latency, "warm": args.warm, "results": results}, jsonFile, indent=2)
+    return 0 if all(result["exit_code"] == 0 for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(Main())
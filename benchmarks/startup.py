@@ -0,0 +1,117 @@
+"""
+Measures cold start time of adbe.py per subcommand.
+
+Every command is started as a new process several times and median/min wall time is reported together
+with the amount of imported modules and how many times adb binary was started. Fake adb which only counts
+it's starts is put first in PATH, so no real devices or adb server are touched. Commands measured here
+only build the parser (or print version), so they must never start adb.
+
+Usage: python benchmarks/startup.py [--runs N] [--json results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+adbePath = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src", "adbe.py"))
+
+startupCommands = [
+    ["version"],
+    ["--help"],
+    ["install", "--help"],
+    ["purge", "--help"],
+    ["copy-devices", "--help"],
+    ["print-devices", "--help"],
+    ["take-screenshot", "--help"],
+    ["record-video", "--help"],
+    ["list", "--help"],
+    ["watch", "--help"],
+    ["daemon", "--help"]
+]
+
+fakeAdbScript = """#!/bin/sh
+echo "$@" >> "%s"
+exit 0
+"""
+
+
+def CreateFakeAdb(directory):
+    """
+    Creates adb which only logs it's arguments. Returns path of the log
+    """
+    logPath = os.path.join(directory, "adb.log")
+    adbPath = os.path.join(directory, "adb")
+    with open(adbPath, mode="w") as adbFile:
+        adbFile.write(fakeAdbScript % (logPath))
+    os.chmod(adbPath, 0o755)
+    open(logPath, mode="w").close()
+    return logPath
+
+
+def CountLines(filePath):
+    with open(filePath, mode="r") as f:
+        return sum(1 for line in f)
+
+
+def MeasureCommand(command, runs, env, logPath):
+    """
+    Returns dictionary with wall times (ms), imported modules count and adb starts per run
+    """
+    times = []
+    adbStartsBefore = CountLines(logPath)
+    for _ in range(runs):
+        startTime = time.perf_counter()
+        subprocess.run([sys.executable, adbePath] + command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - startTime) * 1000)
+    adbStarts = CountLines(logPath) - adbStartsBefore
+    importOutput = subprocess.run([sys.executable, "-X", "importtime", adbePath] + command, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.PIPE).stderr.decode("utf-8", "replace")
+    modulesCount = sum(1 for line in importOutput.splitlines() if line.startswith("import time:") and "|" in line) - 1
+    return {
+        "command": " ".join(command),
+        "median_ms": round(statistics.median(times), 1),
+        "min_ms": round(min(times), 1),
+        "modules": modulesCount,
+        "adb_starts": adbStarts // runs
+    }
+
+
+def PrintResults(results):
+    print("%-24s %10s %10s %8s %10s" % ("Command", "Median ms", "Min ms", "Modules", "adb starts"))
+    for result in results:
+        print("%-24s %10.1f %10.1f %8d %10d" % (result["command"], result["median_ms"], result["min_ms"], result["modules"], result["adb_starts"]))
+
+
+def Main():
+    parser = argparse.ArgumentParser(description="Measures cold start time of adbe.py subcommands")
+    parser.add_argument("--runs", type=int, default=10, help="How many times each command is started (default: 10)")
+    parser.add_argument("--json", dest="jsonPath", help="Saves results to the given json file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        logPath = CreateFakeAdb(directory)
+        env = dict(os.environ)
+        env["PATH"] = directory + os.pathsep + env.get("PATH", "")
+        # commands have to run in this process, not in a running daemon
+        env["ADBEPY_DAEMON_SOCKET"] = os.path.join(directory, "no-daemon.sock")
+        results = []
+        for command in startupCommands:
+            results.append(MeasureCommand(command, args.runs, env, logPath))
+
+    PrintResults(results)
+    if args.jsonPath:
+        with open(args.jsonPath, mode="w") as jsonFile:
+            json.dump({"python": sys.version, "runs": args.runs, "results": results}, jsonFile, indent=2)
+    startingAdb = [result["command"] for result in results if result["adb_starts"] > 0]
+    if startingAdb:
+        print("\nadb was started by: %s" % (", ".join(startingAdb)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(Main())
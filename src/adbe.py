@@ -1,23 +1,92 @@
 import sys
 import argparse
 
-from modules.commands import *
-from modules.webrequests import UpdateSupportedDevices
-from modules.configs import GenerateConfigFile
+from modules.daemon import ForwardToDaemon, GetCommandName, IsDaemonSupported, RunDaemon, StartDaemon, StopDaemon, PrintDaemonStatus
 
 version = "1.0.0"
 
 def PrintVersion(args):
     print("ADBEpy version: %s" % version)
 
+def ControlDaemon(args):
+    if not IsDaemonSupported():
+        print("ADBEpy daemon needs Unix sockets, which are not supported on this system")
+    elif args.action == 'start':
+        StartDaemon(__file__)
+    elif args.action == 'stop':
+        StopDaemon()
+    elif args.action == 'status':
+        PrintDaemonStatus()
+    else:
+        RunDaemon(CreateParser, RunCommand)
+
+def RunCommand(args):
+    """
+    Runs parsed command. With --profile (or --trace-file) adb calls, cache and web requests of the command
+    are traced and their summary is printed after the command
+    """
+    if not args.profile and not args.trace_file:
+        args.func(args)
+        return
+    from modules.tracing import StartTracing, StopTracing, PrintProfile, SaveChromeTrace
+    StartTracing()
+    try:
+        args.func(args)
+    finally:
+        tracer = StopTracing()
+        PrintProfile(tracer)
+        if args.trace_file:
+            SaveChromeTrace(tracer, args.trace_file)
+
 
 helpList = 'Prints package names (bundle identifiers) of all Unity apps installed on a device.'
 helpPurge = 'Removes all third party apps from the device.'
 helpUpdate = '''As new devices are comming out quite often, supported devices file is changing a lot as well.
 If you can not find your brand new device name when you have connected it to pc, please run update-supported-devices command and it will update the list for you.'''
 
-# Main function.
-if __name__ == '__main__':
+def LazyCommand(moduleName, functionName):
+    """
+    Returns command function which imports it's module only when it is called
+    """
+    def Run(args):
+        import importlib
+        return getattr(importlib.import_module(moduleName), functionName)(args)
+    return Run
+
+def PositiveInt(value):
+    """
+    argparse type for counts which must be greater than 0
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid int value: '%s'" % value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError("must be greater than 0, got %s" % value)
+    return number
+
+def CreateParser(argv):
+    """
+    Creates arguments parser. argv (arguments without script name) is needed for aliases which change default values
+    """
+    # modules of the commands are imported only when the selected command is executed
+    Install = LazyCommand("modules.commands", "Install")
+    PurgeApps = LazyCommand("modules.commands", "PurgeApps")
+    CopyDeviceInfo = LazyCommand("modules.commands", "CopyDeviceInfo")
+    PrintDevices = LazyCommand("modules.commands", "PrintDevices")
+    PrintDevicesInExcelFormat = LazyCommand("modules.commands", "PrintDevicesInExcelFormat")
+    TakeScreenshot = LazyCommand("modules.commands", "TakeScreenshot")
+    RecordVideo = LazyCommand("modules.commands", "RecordVideo")
+    OpenRootFolder = LazyCommand("modules.commands", "OpenRootFolder")
+    ClearDeviceCache = LazyCommand("modules.commands", "ClearDeviceCache")
+    ListApps = LazyCommand("modules.commands", "ListApps")
+    TurnOff = LazyCommand("modules.commands", "TurnOff")
+    Watch = LazyCommand("modules.commands", "Watch")
+    Monitor = LazyCommand("modules.commands", "Monitor")
+    Perf = LazyCommand("modules.commands", "Perf")
+    Logcat = LazyCommand("modules.commands", "Logcat")
+    UpdateSupportedDevices = LazyCommand("modules.webrequests", "UpdateSupportedDevices")
+    GenerateConfigFile = LazyCommand("modules.configs", "GenerateConfigFile")
 
     # Common parser to get device list
     parserDeviceList = argparse.ArgumentParser(add_help=False)
@@ -26,16 +95,21 @@ if __name__ == '__main__':
 
     # Main arguments parser
     parserMain = argparse.ArgumentParser()
+    parserMain.add_argument('--profile', action='store_true', help='Prints where the command spent its time (adb calls, cache, web requests) per phase and per device')
+    parserMain.add_argument('--trace-file', dest='trace_file', help='Saves profile as Chrome trace event file (open with chrome://tracing or ui.perfetto.dev). Implies --profile')
     subCommands = parserMain.add_subparsers(title='subcommands')
 
     parserInstall = subCommands.add_parser('install', aliases=['ins'], parents=[parserDeviceList], help='Install application (given via path to .apk file) to device(s)')
     parserInstall.set_defaults(func=Install)
     parserInstall.add_argument('apkPath', help='Path to .APK package')
     parserInstall.add_argument('-nl', '--no-launch', action='store_true', help='Doesnt launch application after installing it on a device')
+    parserInstall.add_argument('-f', '--force', action='store_true', help='Installs application even if the same build is already installed')
+    parserInstall.add_argument('-inc', '--incremental', action='store_true', help='Streams apk with incremental install instead of pushing it to the device first')
 
     parserPurge = subCommands.add_parser('purge', parents=[parserDeviceList], help=helpPurge)
     parserPurge.set_defaults(func=PurgeApps)
     parserPurge.add_argument('-w', '--whitelist', nargs='+', help='White listed apps identifiers')
+    parserPurge.add_argument('-n', '--dry-run', action='store_true', help='Only prints apps which would be removed')
 
     parserCopyDevices = subCommands.add_parser('copy-devices', aliases=['dc', 'dce'], parents=[parserDeviceList], help='Copy connected device information to clipboard. Available modes: minimal (or min or m) prints only copies minimal info (name, android version);' + 
         ' standard (or std or s) copies standard device info (what minimal does + CPU and GPU); full (or f) copies full info (same as standard + ABI, Hardware and fingerprint)')
@@ -43,7 +117,7 @@ if __name__ == '__main__':
     parserCopyDevices.add_argument('-m', '--mode', help='Copying mode. Available modes: minimal, standard and full. For more info check help', default='std')
     parserCopyDevices.add_argument('-ut', '--use-tabs', action='store_true',  help='replaces separator with tabs and ommits field labels. Good for pasting in spreadsheets')
     # if "dce" alias was used lets set -ut flag
-    if len(sys.argv) > 1 and sys.argv[1] == "dce":
+    if GetCommandName(argv) == "dce":
         parserCopyDevices.set_defaults(use_tabs=True)
 
     printDevices = subCommands.add_parser('print-devices', aliases=['d'], help='Prints general information about connected devices in a table form')
@@ -56,14 +130,17 @@ if __name__ == '__main__':
 
     parserScreenshot = subCommands.add_parser('take-screenshot', aliases=['screen'], parents=[parserDeviceList], help='Take a screenshot')
     parserScreenshot.set_defaults(func=TakeScreenshot)
-    parserScreenshot.add_argument('-o', '--output', nargs=1, default=GetFieldData(ConfigDataFields.screenshot_location) , dest='saveLocation', help="Path where the image is going to be saved. Can be left empty in order to save to default location") 
+    parserScreenshot.add_argument('-o', '--output', nargs=1, default=None, dest='saveLocation', help="Path where the image is going to be saved. Can be left empty in order to save to default location") 
     parserScreenshot.add_argument('imageName', help="Name of the screenshot. It will be saved as 'name_deviceSerial'")
+    parserScreenshot.add_argument('-b', '--burst', type=PositiveInt, metavar='FRAMES', help="Captures a sequence of FRAMES screenshots instead of a single one. Frames are saved as 'name_deviceSerial_frameNumber'")
+    parserScreenshot.add_argument('-r', '--rate', type=float, default=5.0, help="Target frames per second for --burst mode (default: 5)")
 
-    parserVideo = subCommands.add_parser('record-video', aliases=['record'], parents=[parserDeviceList], help='Record a video (only on a single device)')
+    parserVideo = subCommands.add_parser('record-video', aliases=['record'], parents=[parserDeviceList], help='Record a video on all selected devices')
     parserVideo.set_defaults(func=RecordVideo)
-    parserVideo.add_argument('-o', '--output', nargs=1, default=GetFieldData(ConfigDataFields.recorded_video_location), dest='saveLocation', help="Path where the video is going to be saved. Can be left empty in order to save to default location")
+    parserVideo.add_argument('-o', '--output', nargs=1, default=None, dest='saveLocation', help="Path where the video is going to be saved. Can be left empty in order to save to default location")
     parserVideo.add_argument('videoName', help="Name of the video. It will be saved as 'name_deviceSerial'")
     parserVideo.add_argument('-r', '--orientation', nargs=1, choices={'land', 'port'}, default='port', dest='orientation', help='Recording orientation. Landscape (1280x720) or Portrait (720x1280)')
+    parserVideo.add_argument('--device-file', action='store_true', dest='device_file', help="Record mp4 file on the device and pull it after recording (for devices which can't stream h264)")
 
     openDir = subCommands.add_parser('open-dir', aliases=['opendir'], help='Opens ADBEpy directory')
     openDir.set_defaults(func=OpenRootFolder)
@@ -71,18 +148,59 @@ if __name__ == '__main__':
 
     clearCache = subCommands.add_parser('clear-device-cache', aliases=['clear-cache', 'clear', 'cc'], help="Clears cached devices")
     clearCache.set_defaults(func=ClearDeviceCache)
-    clearCache.add_argument('-s', '--serial', nargs='?', default='newest', dest='serial', help="Device serial number (can be truncated)")
+    clearCache.add_argument('-s', '--serial', nargs='+', dest='serial', help="Device serial number(s) (can be truncated). Without it all cached devices are deleted")
 
     subCommands.add_parser('update-supported-devices', aliases=['usd'], help=helpUpdate).set_defaults(func=UpdateSupportedDevices)
     subCommands.add_parser('generate-new-config', aliases=['config'], help="Generates new adbepy.config file. If it already exists - overrides all it's saved data").set_defaults(func=GenerateConfigFile)
     subCommands.add_parser('list', parents=[parserDeviceList], help=helpList).set_defaults(func=ListApps)
     subCommands.add_parser('shutdown', aliases=['off'], parents=[parserDeviceList], help='Power off devices').set_defaults(func=TurnOff)
+    parserMonitor = subCommands.add_parser('monitor', parents=[parserDeviceList], help='Samples battery level, temperature, charging and thermal status of devices until stopped with CTRL+C')
+    parserMonitor.set_defaults(func=Monitor)
+    parserMonitor.add_argument('-i', '--interval', type=float, default=5.0, help='Seconds between samples (default: 5)')
+    parserMonitor.add_argument('-d', '--duration', type=float, help='Stops after given amount of seconds')
+    parserMonitor.add_argument('-o', '--output', help='Writes samples to the file as they are taken. Format is CSV for .csv files and JSON lines otherwise')
+    parserMonitor.add_argument('--buffer', type=int, default=720, help='How many latest samples per device are kept for the summary (default: 720)')
+
+    parserPerf = subCommands.add_parser('perf', parents=[parserDeviceList], help='Collects frame timing (jank, frame time percentiles) and memory (PSS) of the app until stopped with CTRL+C')
+    parserPerf.set_defaults(func=Perf)
+    parserPerf.add_argument('bundleID', help='Bundle identifier of the app')
+    parserPerf.add_argument('-i', '--interval', type=float, default=2.0, help='Seconds between samples (default: 2)')
+    parserPerf.add_argument('-d', '--duration', type=float, help='Stops after given amount of seconds')
+    parserPerf.add_argument('-o', '--output', help="Folder where 'bundleID_deviceSerial.perf.json' files are saved (default: current folder)")
+
+    parserLogcat = subCommands.add_parser('logcat', parents=[parserDeviceList], help='Streams logcat of all devices at the same time until stopped with CTRL+C')
+    parserLogcat.set_defaults(func=Logcat)
+    parserLogcat.add_argument('filters', nargs='*', help="logcat filterspecs 'tag:priority' (ex. 'Unity:D *:S'), applied on the device")
+    parserLogcat.add_argument('-b', '--buffer', action='append', dest='buffers', help='Log buffer to read (main, system, crash, events...). Can be repeated')
+    parserLogcat.add_argument('-c', '--clear', action='store_true', help='Clears log buffers of devices before streaming')
+    parserLogcat.add_argument('-d', '--duration', type=float, help='Stops after given amount of seconds')
+    parserLogcat.add_argument('-o', '--output', help="Folder where logs are written to rotating 'deviceSerial.log' files. If not given, logs of all devices are printed")
+    parserLogcat.add_argument('--max-size', type=float, default=10.0, dest='max_size', help='Size of a log file in MB after which it is rotated (default: 10)')
+    parserLogcat.add_argument('--rotate', type=int, default=5, help='How many rotated log files are kept per device (default: 5)')
+
+    subCommands.add_parser('watch', help='Prints devices as they are attached and detached, until stopped with CTRL+C').set_defaults(func=Watch)
     subCommands.add_parser('version', aliases=['v'], help='Displays ADBEpy version').set_defaults(func=PrintVersion)
 
+    parserDaemon = subCommands.add_parser('daemon', help='Controls background daemon which keeps devices and caches loaded, so other commands return faster')
+    parserDaemon.set_defaults(func=ControlDaemon)
+    parserDaemon.add_argument('action', choices=['start', 'stop', 'status', 'run'], help="'run' runs the daemon in this terminal")
+    return parserMain
 
+
+# Main function.
+if __name__ == '__main__':
+    # if daemon is running, command is executed there and nothing else has to be loaded here
+    exitCode = ForwardToDaemon(sys.argv[1:])
+    if exitCode is not None:
+        sys.exit(exitCode)
+
+    parserMain = CreateParser(sys.argv[1:])
     if len(sys.argv) > 1:
         args = parserMain.parse_args()
-        args.func(args)
+        try:
+            RunCommand(args)
+        except KeyboardInterrupt:
+            print("\nInterrupted, started commands were stopped.")
     else:
         PrintVersion(None)
         parserMain.print_help()
@@ -0,0 +1,330 @@
+import os
+import socket
+import struct
+import threading
+import time
+
+from modules.configs import ConfigDataFields, config
+from modules.deadlines import CommandTimeoutError, GetCommandTimeout
+
+defaultServerHost = "127.0.0.1"
+defaultServerPort = 5037
+syncDataChunkSize = 64 * 1024
+
+
+class AdbError(Exception):
+    """
+    Raised when adb server replies with FAIL or breaks the protocol
+    """
+    pass
+
+
+class AdbConnection:
+    """
+    Single socket connection to the adb server. Requests are sent in adb smart-socket
+    format (4 hex digits with payload length followed by the payload) and every request
+    is answered with OKAY or FAIL. After a service is opened the socket becomes a raw stream
+    """
+
+    def __init__(self, host, port, timeout=None):
+        self.__socket = socket.create_connection((host, port), timeout=timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.Close()
+
+    def SendRequest(self, request):
+        """
+        Sends a request and waits for the OKAY status. Raises AdbError with server message otherwise
+        """
+        payload = request.encode("utf-8")
+        self.__socket.sendall(b"%04x" % len(payload) + payload)
+        self.ReadStatus()
+
+    def ReadStatus(self):
+        status = self.ReadExactly(4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            raise AdbError(self.ReadLengthPrefixed().decode("utf-8", "replace"))
+        raise AdbError("Unexpected adb server reply: %s" % (status))
+
+    def ReadExactly(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.__socket.recv(size - len(data))
+            if not chunk:
+                raise AdbError("Connection to adb server was closed")
+            data += chunk
+        return data
+
+    def ReadLengthPrefixed(self):
+        length = int(self.ReadExactly(4), 16)
+        return self.ReadExactly(length)
+
+    def Read(self, size=syncDataChunkSize):
+        """
+        Reads up to `size` bytes from the stream. Returns empty bytes when stream is closed
+        """
+        return self.__socket.recv(size)
+
+    def ReadAll(self):
+        chunks = []
+        while True:
+            chunk = self.__socket.recv(syncDataChunkSize)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+    def Write(self, data):
+        self.__socket.sendall(data)
+
+    def Close(self):
+        try:
+            self.__socket.close()
+        except OSError:
+            pass
+
+
+class AdbClient:
+    """
+    Python client for the adb server (the one 'adb start-server' runs on localhost:5037).
+    It talks to the server directly, so commands do not need to start the adb binary.
+    Every request opens a new connection, because server turns the connection into the service's stream.
+    timeout (seconds) limits every socket operation of short requests, file transfers and streams have no limit
+    """
+
+    def __init__(self, host=defaultServerHost, port=defaultServerPort, timeout=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def Connect(self, hasDeadline=True):
+        return AdbConnection(self.host, self.port, self.timeout if hasDeadline else None)
+
+    def HostRequest(self, request):
+        """
+        Sends host service request (ex. host:version) and returns it's length prefixed reply
+        """
+        with self.Connect() as connection:
+            connection.SendRequest(request)
+            return connection.ReadLengthPrefixed()
+
+    def GetVersion(self):
+        return int(self.HostRequest("host:version"), 16)
+
+    def GetDevicesListing(self):
+        """
+        Returns host:devices reply as text. Each line is 'serial<TAB>state', same as 'adb devices' prints
+        """
+        return self.HostRequest("host:devices").decode("utf-8")
+
+    def GetDevices(self):
+        """
+        Returns list of (serial, state) tuples
+        """
+        return ParseDevicesListing(self.GetDevicesListing())
+
+    def TrackDevices(self):
+        """
+        Opens host:track-devices stream. Server sends length prefixed devices listing (same as host:devices)
+        right away and then every time the set of devices or their states change.
+        Returned connection must be closed by the caller
+        """
+        connection = self.Connect(hasDeadline=False)
+        try:
+            connection.SendRequest("host:track-devices")
+        except BaseException:
+            connection.Close()
+            raise
+        return connection
+
+    def OpenService(self, serial, service, hasDeadline=True):
+        """
+        Switches new connection to the device transport and opens a service on it (shell:, exec:, sync: etc.).
+        Returned connection is a raw stream which must be closed by the caller.
+        hasDeadline has to be False for services which can run long on a healthy device (transfers, recordings)
+        """
+        connection = self.Connect(hasDeadline)
+        try:
+            connection.SendRequest("host:transport:" + serial)
+            connection.SendRequest(service)
+        except BaseException:
+            connection.Close()
+            raise
+        return connection
+
+    def Shell(self, serial, command, hasDeadline=True):
+        """
+        Runs shell command on a device and returns it's output (stdout and stderr are merged)
+        """
+        with self.OpenService(serial, "shell:" + command, hasDeadline) as connection:
+            return connection.ReadAll()
+
+    def ExecOut(self, serial, command, hasDeadline=True):
+        """
+        Runs command on a device and returns raw (binary safe) stdout
+        """
+        with self.OpenService(serial, "exec:" + command, hasDeadline) as connection:
+            return connection.ReadAll()
+
+    def __SyncRequest(self, connection, requestID, data):
+        connection.Write(requestID + struct.pack("<I", len(data)) + data)
+
+    def __ReadSyncFail(self, connection, length):
+        return AdbError(connection.ReadExactly(length).decode("utf-8", "replace"))
+
+    def Stat(self, serial, remotePath):
+        """
+        Returns (mode, size, mtime) of a file on the device. Mode is 0 if file does not exist
+        """
+        with self.OpenService(serial, "sync:") as connection:
+            self.__SyncRequest(connection, b"STAT", remotePath.encode("utf-8"))
+            reply = connection.ReadExactly(16)
+            if reply[:4] != b"STAT":
+                raise AdbError("Unexpected sync reply: %s" % (reply[:4]))
+            self.__SyncRequest(connection, b"QUIT", b"")
+            return struct.unpack("<III", reply[4:])
+
+    def Pull(self, serial, remotePath, localPath):
+        """
+        Copies file from the device to localPath using sync service.
+        Partially written (or empty) localPath is removed if the transfer fails
+        """
+        with self.OpenService(serial, "sync:", hasDeadline=False) as connection:
+            self.__SyncRequest(connection, b"RECV", remotePath.encode("utf-8"))
+            isWritten = False
+            try:
+                with open(localPath, mode="wb") as localFile:
+                    while True:
+                        header = connection.ReadExactly(8)
+                        chunkID = header[:4]
+                        length = struct.unpack("<I", header[4:])[0]
+                        if chunkID == b"DATA":
+                            localFile.write(connection.ReadExactly(length))
+                        elif chunkID == b"DONE":
+                            break
+                        elif chunkID == b"FAIL":
+                            raise self.__ReadSyncFail(connection, length)
+                        else:
+                            raise AdbError("Unexpected sync reply: %s" % (chunkID))
+                isWritten = True
+            finally:
+                if not isWritten and os.path.exists(localPath):
+                    os.remove(localPath)
+            self.__SyncRequest(connection, b"QUIT", b"")
+
+    def Push(self, serial, localPath, remotePath, mode=0o644):
+        """
+        Copies local file to remotePath on the device using sync service
+        """
+        with self.OpenService(serial, "sync:", hasDeadline=False) as connection:
+            self.__SyncRequest(connection, b"SEND", ("%s,%d" % (remotePath, mode)).encode("utf-8"))
+            with open(localPath, mode="rb") as localFile:
+                while True:
+                    chunk = localFile.read(syncDataChunkSize)
+                    if not chunk:
+                        break
+                    self.__SyncRequest(connection, b"DATA", chunk)
+            connection.Write(b"DONE" + struct.pack("<I", int(time.time())))
+            header = connection.ReadExactly(8)
+            length = struct.unpack("<I", header[4:])[0]
+            if header[:4] == b"FAIL":
+                raise self.__ReadSyncFail(connection, length)
+            if header[:4] != b"OKAY":
+                raise AdbError("Unexpected sync reply: %s" % (header[:4]))
+            self.__SyncRequest(connection, b"QUIT", b"")
+
+    def ExecuteCommand(self, command, hasDeadline=True):
+        """
+        Executes adb command given in the same form as it is passed to Popen
+        (["adb", "-s", serial, "shell", ...]) and returns (output, err) bytes.
+        Returns None if the command is not supported by this client, so the caller can run adb binary instead.
+        Raises CommandTimeoutError if server or device does not answer in time (unless hasDeadline is False)
+        """
+        if len(command) < 4 or command[0] != "adb" or command[1] != "-s":
+            return None
+        serial = command[2]
+        service = command[3]
+        arguments = command[4:]
+        try:
+            if service == "shell" and len(arguments) > 0:
+                return self.Shell(serial, " ".join(arguments), hasDeadline), b""
+            if service == "exec-out" and len(arguments) > 0:
+                return self.ExecOut(serial, " ".join(arguments), hasDeadline), b""
+            if service == "pull" and len(arguments) == 2:
+                self.Pull(serial, arguments[0], arguments[1])
+                return b"", b""
+            if service == "push" and len(arguments) == 2:
+                self.Push(serial, arguments[0], arguments[1])
+                return b"", b""
+        except AdbError as e:
+            return b"", ("error: %s" % (e)).encode("utf-8")
+        except socket.timeout:
+            raise CommandTimeoutError("'%s' did not finish in %s seconds" % (" ".join(command[3:]), self.timeout))
+        except OSError:
+            # adb server went away, let the adb binary handle (and restart) it
+            return None
+        return None
+
+
+def ParseDevicesListing(listing):
+    """
+    Parses host:devices reply (or a single host:track-devices update) into list of (serial, state) tuples
+    """
+    output = []
+    for line in listing.splitlines():
+        if "\t" in line:
+            output.append(tuple(line.split("\t", 1)))
+    return output
+
+
+def GetServerAddress():
+    """
+    Returns (host, port) of the adb server. Respects the same environment variables adb binary does
+    """
+    host = defaultServerHost
+    port = defaultServerPort
+    serverSocket = os.environ.get("ADB_SERVER_SOCKET", "")
+    if serverSocket.startswith("tcp:"):
+        address = serverSocket[4:].rsplit(":", 1)
+        if len(address) == 2:
+            host = address[0] or defaultServerHost
+            port = int(address[1])
+        else:
+            port = int(address[0])
+    elif os.environ.get("ANDROID_ADB_SERVER_PORT"):
+        port = int(os.environ["ANDROID_ADB_SERVER_PORT"])
+    return host, port
+
+
+nativeClient = None
+nativeClientChecked = False
+nativeClientLock = threading.Lock()
+
+
+def IsNativeClientEnabled():
+    return config.GetBool(ConfigDataFields.native_adb)
+
+
+def GetNativeClient():
+    """
+    Returns AdbClient if native client is enabled in adbepy.config and adb server is running.
+    Otherwise returns None and commands should be executed with the adb binary
+    """
+    global nativeClient, nativeClientChecked
+    with nativeClientLock:
+        if not nativeClientChecked:
+            nativeClientChecked = True
+            if IsNativeClientEnabled():
+                host, port = GetServerAddress()
+                client = AdbClient(host, port, GetCommandTimeout())
+                try:
+                    client.GetVersion()
+                    nativeClient = client
+                except (OSError, AdbError, ValueError):
+                    # server is not started yet, adb binary will start it
+                    nativeClient = None
+        return nativeClient
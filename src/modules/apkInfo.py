@@ -0,0 +1,229 @@
+from subprocess import Popen, PIPE
+from os import path, listdir
+from platform import system
+import hashlib
+import json
+import os
+import re
+import shutil
+
+from modules.configs import ConfigDataFields, GetFieldData, resFolder
+from modules.apkReader import ReadAPKInfo, ApkReaderError
+from modules.tracing import Span
+from modules.deadlines import CommunicateWithDeadline, CommandTimeoutError, GetCommandTimeout
+
+apkCachePath = path.join(resFolder, "apkcache.json")
+
+apkCache = None
+
+
+def LoadApkCache():
+    """
+    Loads apk cache (res/apkcache.json) once per process. Cache contains:
+    aaptPath - resolved path to aapt binary
+    files    - absolute apk path -> size, mtime and digest of the file when it was hashed
+    apks     - apk digest -> parsed badging info (see GetAPKInfo)
+    """
+    global apkCache
+    if apkCache is None:
+        with Span("cache", "read apk cache"):
+            try:
+                with open(apkCachePath, mode="r", encoding="utf-8") as cacheFile:
+                    apkCache = json.load(cacheFile)
+            except (IOError, ValueError):
+                apkCache = {}
+        apkCache.setdefault("aaptPath", "")
+        apkCache.setdefault("files", {})
+        apkCache.setdefault("apks", {})
+    return apkCache
+
+
+def SaveApkCache():
+    with Span("cache", "write apk cache"):
+        try:
+            directory = path.dirname(apkCachePath)
+            if not path.exists(directory):
+                os.makedirs(directory)
+            tempPath = apkCachePath + ".tmp"
+            with open(tempPath, mode="w", encoding="utf-8") as cacheFile:
+                json.dump(LoadApkCache(), cacheFile)
+            os.replace(tempPath, apkCachePath)
+        except OSError:
+            pass
+
+
+def FindAaptPath():
+    """
+    Looks for aapt in PATH and then in the newest Android SDK build-tools folder.
+    Prints what user can do and returns None if aapt is not found
+    """
+    aaptPath = shutil.which("aapt")
+    if aaptPath:
+        return aaptPath
+    sdkLocation = GetFieldData(ConfigDataFields.sdk_location)
+    if not sdkLocation:
+        print("'aapt' is not recognized command by your system. Here are solutions for this issue:")
+        print(" * Add 'aapt' path (usually located in AndroidSDK/build-tools/version/) to environmental PATH variable")
+        print(" * Add Android SDK path inside adbepy.config file (write it in '%s' line after equals sign)" % (ConfigDataFields.sdk_location))
+        return None
+    buildToolsFolder = path.join(sdkLocation, "build-tools")
+    if not path.exists(buildToolsFolder):
+        print("Can't find build-tools folder")
+        return None
+    directories = listdir(buildToolsFolder)
+    directories.sort(reverse=True)
+    for btoolsVersion in directories:
+        aaptPath = path.join(buildToolsFolder, btoolsVersion + "/aapt")
+        if system() == "Windows":
+            # if user is on Windows OS
+            aaptPath = aaptPath + ".exe"
+        if path.isfile(aaptPath):
+            return aaptPath
+    print("Can't find 'aapt'. Make sure you have Android build-tools installed.")
+    return None
+
+
+def GetAaptPath():
+    """
+    Returns path to aapt. Found path is remembered in apk cache, so SDK folder is scanned only
+    when aapt is used for the first time or remembered aapt was removed
+    """
+    cache = LoadApkCache()
+    if cache["aaptPath"] and path.isfile(cache["aaptPath"]):
+        return cache["aaptPath"]
+    aaptPath = FindAaptPath()
+    if aaptPath is not None:
+        cache["aaptPath"] = aaptPath
+        SaveApkCache()
+    return aaptPath
+
+
+def GetAPKDumpBadging(apkPath):
+    """
+    Returns dump from .apk file. This dump contains apk badging information - min/recommented OS versions,
+    main activity name, bundle id etc.
+    """
+    aaptPath = GetAaptPath()
+    if aaptPath is None:
+        return None
+    with Span("aapt", "dump badging " + path.basename(apkPath)) as span:
+        proc = Popen([aaptPath, "dump", "badging", apkPath], stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        try:
+            output, err = CommunicateWithDeadline(proc, GetCommandTimeout(), "aapt dump badging")
+        except CommandTimeoutError as e:
+            print("Error occured: %s" % (e))
+            return None
+        span.AddBytes(output)
+    if err and not output:
+        print("Error occured: %s" % (err.decode("utf-8").rstrip()))
+        return None
+    return output.decode("utf-8")
+
+
+def GetBundleIDFromDump(dump):
+    matchObj = re.search(r"package: name='([\w.]*)'", dump, flags=0)
+    return matchObj.group(1)
+
+
+def GetLaunchableActivityFromDump(dump):
+    matchObj = re.search(r"launchable-activity: name='([\w.]*)'", dump, flags=0)
+    return matchObj.group(1)
+
+
+def GetVersionCodeFromDump(dump):
+    matchObj = re.search(r"versionCode='(\d+)'", dump, flags=0)
+    if matchObj is None:
+        return ""
+    return matchObj.group(1)
+
+
+def GetMinSdkFromDump(dump):
+    matchObj = re.search(r"sdkVersion:'(\d+)'", dump, flags=0)
+    if matchObj is None:
+        return ""
+    return matchObj.group(1)
+
+
+def GetNativeAbisFromDump(dump):
+    matchObj = re.search(r"native-code: (.+)", dump, flags=0)
+    if matchObj is None:
+        return []
+    return re.findall(r"'([^']+)'", matchObj.group(1))
+
+
+def GetFileDigest(filePath):
+    """
+    Returns SHA-256 digest of the file as a hex string
+    """
+    digest = hashlib.sha256()
+    with open(filePath, mode="rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def GetCachedFileDigest(apkPath):
+    """
+    Returns digest of the apk. File is hashed again only if it's size or modification time changed
+    """
+    cache = LoadApkCache()
+    fileStat = os.stat(apkPath)
+    fileKey = path.abspath(apkPath)
+    fileEntry = cache["files"].get(fileKey)
+    if fileEntry is not None and fileEntry["size"] == fileStat.st_size and fileEntry["mtime"] == fileStat.st_mtime_ns:
+        return fileEntry["digest"]
+    digest = GetFileDigest(apkPath)
+    cache["files"][fileKey] = {"size": fileStat.st_size, "mtime": fileStat.st_mtime_ns, "digest": digest}
+    return digest
+
+
+def ParseAPKDumpBadging(dump):
+    info = {
+        "package": "",
+        "versionCode": GetVersionCodeFromDump(dump),
+        "launchableActivity": "",
+        "nativeAbis": GetNativeAbisFromDump(dump),
+        "minSdk": GetMinSdkFromDump(dump)
+    }
+    if re.search(r"package: name='", dump):
+        info["package"] = GetBundleIDFromDump(dump)
+    if re.search(r"launchable-activity: name='", dump):
+        info["launchableActivity"] = GetLaunchableActivityFromDump(dump)
+    return info
+
+
+def GetAPKInfo(apkPath):
+    """
+    Returns dictionary with apk info:
+    package            - bundle id
+    versionCode        - version code (string)
+    launchableActivity - main activity name
+    nativeAbis         - list of ABIs apk has native libraries for
+    minSdk             - minimal SDK version
+    digest             - SHA-256 of the apk file
+    Info is read from the apk itself (see modules.apkReader) and aapt is used only if that fails.
+    Info is cached by apk digest, so each build is read only once. If aapt fails too,
+    all fields except digest are empty
+    """
+    cache = LoadApkCache()
+    digest = GetCachedFileDigest(apkPath)
+    cacheKey = "%s:%d" % (digest, os.stat(apkPath).st_size)
+    info = cache["apks"].get(cacheKey)
+    if info is None:
+        try:
+            info = ReadAPKInfo(apkPath)
+            cache["apks"][cacheKey] = info
+        except ApkReaderError:
+            # unusual manifest, let aapt try it
+            info = None
+    if info is None:
+        dump = GetAPKDumpBadging(apkPath)
+        if not dump:
+            info = ParseAPKDumpBadging("")
+        else:
+            info = ParseAPKDumpBadging(dump)
+            cache["apks"][cacheKey] = info
+    SaveApkCache()
+    output = dict(info)
+    output["digest"] = digest
+    return output
@@ -0,0 +1,262 @@
+import re
+import struct
+import zipfile
+
+# Chunk types from Android's ResourceTypes.h
+RES_STRING_POOL_TYPE = 0x0001
+RES_TABLE_TYPE = 0x0002
+RES_XML_TYPE = 0x0003
+RES_XML_START_ELEMENT_TYPE = 0x0102
+RES_XML_END_ELEMENT_TYPE = 0x0103
+RES_XML_RESOURCE_MAP_TYPE = 0x0180
+RES_TABLE_PACKAGE_TYPE = 0x0200
+RES_TABLE_TYPE_TYPE = 0x0201
+
+# Res_value data types
+TYPE_REFERENCE = 0x01
+TYPE_STRING = 0x03
+TYPE_INT_DEC = 0x10
+TYPE_INT_HEX = 0x11
+TYPE_INT_BOOLEAN = 0x12
+
+# android: attribute resource ids. Attribute names can be stripped from the string pool, ids can not
+attributeIDs = {
+    0x01010003: "name",
+    0x0101020c: "minSdkVersion",
+    0x0101021b: "versionCode",
+    0x0101021c: "versionName",
+    0x01010202: "targetActivity"
+}
+
+noIndex = 0xffffffff
+
+
+class ApkReaderError(Exception):
+    """
+    Raised when apk or it's binary xml can not be parsed
+    """
+    pass
+
+
+def ReadStringPool(data, offset):
+    """
+    Reads ResStringPool chunk starting at offset and returns list of strings
+    """
+    chunkType, headerSize, chunkSize, stringCount, styleCount, flags, stringsStart = \
+        struct.unpack_from("<HHIIIII", data, offset)
+    if chunkType != RES_STRING_POOL_TYPE:
+        raise ApkReaderError("Expected string pool at %d" % (offset))
+    isUTF8 = flags & (1 << 8)
+    offsets = struct.unpack_from("<%dI" % (stringCount), data, offset + headerSize)
+    strings = []
+    for stringOffset in offsets:
+        position = offset + stringsStart + stringOffset
+        if isUTF8:
+            # utf-16 length first (skipped), then utf-8 length, each 1 or 2 bytes long
+            for _ in range(2):
+                length = data[position]
+                position += 1
+                if length & 0x80:
+                    length = ((length & 0x7f) << 8) | data[position]
+                    position += 1
+            strings.append(data[position:position + length].decode("utf-8", "replace"))
+        else:
+            length = struct.unpack_from("<H", data, position)[0]
+            position += 2
+            if length & 0x8000:
+                length = ((length & 0x7fff) << 16) | struct.unpack_from("<H", data, position)[0]
+                position += 2
+            strings.append(data[position:position + length * 2].decode("utf-16-le", "replace"))
+    return strings
+
+
+def IterateChunks(data, start, end):
+    """
+    Yields (offset, type, headerSize, size) of every chunk between start and end
+    """
+    offset = start
+    while offset + 8 <= end:
+        chunkType, headerSize, chunkSize = struct.unpack_from("<HHI", data, offset)
+        if chunkSize < 8:
+            raise ApkReaderError("Broken chunk at %d" % (offset))
+        yield offset, chunkType, headerSize, chunkSize
+        offset += chunkSize
+
+
+def ParseBinaryXml(data):
+    """
+    Parses Android binary xml (AXML) and yields ("start", tag, attributes) and ("end", tag, None) events.
+    attributes is a dictionary of attribute name -> (dataType, value). value is string for string
+    attributes and integer for everything else (references are resource ids)
+    """
+    chunkType, headerSize, fileSize = struct.unpack_from("<HHI", data, 0)
+    if chunkType != RES_XML_TYPE:
+        raise ApkReaderError("Not a binary xml file")
+    strings = []
+    resourceIDs = []
+    for offset, chunkType, chunkHeaderSize, chunkSize in IterateChunks(data, headerSize, min(fileSize, len(data))):
+        if chunkType == RES_STRING_POOL_TYPE:
+            strings = ReadStringPool(data, offset)
+        elif chunkType == RES_XML_RESOURCE_MAP_TYPE:
+            resourceIDs = struct.unpack_from("<%dI" % ((chunkSize - chunkHeaderSize) // 4), data, offset + chunkHeaderSize)
+        elif chunkType == RES_XML_START_ELEMENT_TYPE:
+            extension = offset + chunkHeaderSize
+            namespace, nameIndex, attributeStart, attributeSize, attributeCount = struct.unpack_from("<IIHHH", data, extension)
+            attributes = {}
+            for i in range(attributeCount):
+                attrOffset = extension + attributeStart + i * attributeSize
+                attrNamespace, attrName, rawValue, valueSize, res0, dataType, value = \
+                    struct.unpack_from("<IIIHBBI", data, attrOffset)
+                name = ""
+                if attrName < len(resourceIDs) and resourceIDs[attrName] in attributeIDs:
+                    name = attributeIDs[resourceIDs[attrName]]
+                elif attrName < len(strings):
+                    name = strings[attrName]
+                if dataType == TYPE_STRING:
+                    value = strings[value]
+                elif rawValue != noIndex and dataType not in [TYPE_REFERENCE, TYPE_INT_DEC, TYPE_INT_HEX, TYPE_INT_BOOLEAN]:
+                    dataType = TYPE_STRING
+                    value = strings[rawValue]
+                attributes[name] = (dataType, value)
+            yield "start", strings[nameIndex], attributes
+        elif chunkType == RES_XML_END_ELEMENT_TYPE:
+            namespace, nameIndex = struct.unpack_from("<II", data, offset + chunkHeaderSize)
+            yield "end", strings[nameIndex], None
+
+
+def ResolveResource(tableData, resourceID):
+    """
+    Returns (dataType, value) of a resource (ex. @string/app_version or @integer/version_code) from resources.arsc.
+    value is string for string resources and integer for everything else.
+    First configuration which has the entry is used. Returns None if resource is not found or it is not a plain value
+    """
+    packageID = resourceID >> 24
+    typeID = (resourceID >> 16) & 0xff
+    entryID = resourceID & 0xffff
+    chunkType, headerSize, tableSize = struct.unpack_from("<HHI", tableData, 0)
+    if chunkType != RES_TABLE_TYPE:
+        raise ApkReaderError("Not a resource table")
+    globalStrings = None
+    for offset, chunkType, chunkHeaderSize, chunkSize in IterateChunks(tableData, headerSize, min(tableSize, len(tableData))):
+        if chunkType == RES_STRING_POOL_TYPE:
+            globalStrings = ReadStringPool(tableData, offset)
+        elif chunkType == RES_TABLE_PACKAGE_TYPE:
+            if struct.unpack_from("<I", tableData, offset + 8)[0] != packageID:
+                continue
+            for typeOffset, typeChunk, typeHeaderSize, typeSize in IterateChunks(tableData, offset + chunkHeaderSize, offset + chunkSize):
+                if typeChunk != RES_TABLE_TYPE_TYPE:
+                    continue
+                chunkTypeID, typeFlags, reserved, entryCount, entriesStart = struct.unpack_from("<BBHII", tableData, typeOffset + 8)
+                if chunkTypeID != typeID:
+                    continue
+                entryOffset = None
+                if typeFlags & 0x01:
+                    # sparse type: pairs of (entry index, offset / 4)
+                    for i in range(entryCount):
+                        index, shortOffset = struct.unpack_from("<HH", tableData, typeOffset + typeHeaderSize + i * 4)
+                        if index == entryID:
+                            entryOffset = shortOffset * 4
+                            break
+                elif entryID < entryCount:
+                    entryOffset = struct.unpack_from("<I", tableData, typeOffset + typeHeaderSize + entryID * 4)[0]
+                    if entryOffset == noIndex:
+                        entryOffset = None
+                if entryOffset is None:
+                    continue
+                entryPosition = typeOffset + entriesStart + entryOffset
+                entrySize, entryFlags = struct.unpack_from("<HH", tableData, entryPosition)
+                if entryFlags & 0x01:
+                    # complex (map) entries are not plain values
+                    return None
+                valueSize, res0, dataType, value = struct.unpack_from("<HBBI", tableData, entryPosition + entrySize)
+                if dataType == TYPE_STRING:
+                    if globalStrings is None:
+                        return None
+                    value = globalStrings[value]
+                return dataType, value
+    return None
+
+
+def ResolveStringResource(tableData, resourceID):
+    """
+    Returns string value of a resource from resources.arsc, None if resource is not found or it is not a string
+    """
+    resource = ResolveResource(tableData, resourceID)
+    if resource is None or resource[0] != TYPE_STRING:
+        return None
+    return resource[1]
+
+
+def GetFullClassName(packageName, className):
+    if className.startswith("."):
+        return packageName + className
+    if "." not in className:
+        return packageName + "." + className
+    return className
+
+
+def ReadAPKInfo(apkPath):
+    """
+    Reads apk info directly from the apk (only AndroidManifest.xml, and resources.arsc if manifest
+    references resources, are read; apk is not extracted). Returns dictionary with:
+    package, versionCode, versionName, launchableActivity, nativeAbis and minSdk
+    (same fields as modules.apkInfo.ParseAPKDumpBadging returns).
+    Raises ApkReaderError if apk can not be read
+    """
+    try:
+        with zipfile.ZipFile(apkPath) as apk:
+            try:
+                manifest = apk.read("AndroidManifest.xml")
+            except KeyError:
+                raise ApkReaderError("AndroidManifest.xml is missing")
+            tableData = None
+            info = {
+                "package": "",
+                "versionCode": "",
+                "versionName": "",
+                "launchableActivity": "",
+                "nativeAbis": [],
+                "minSdk": ""
+            }
+            activity = None
+            isMainAction = False
+            isLauncherCategory = False
+            for event, tag, attributes in ParseBinaryXml(manifest):
+                if event == "start":
+                    if tag == "manifest":
+                        info["package"] = str(attributes.get("package", (TYPE_STRING, ""))[1])
+                        for field in ["versionCode", "versionName"]:
+                            if field not in attributes:
+                                continue
+                            dataType, value = attributes[field]
+                            if dataType == TYPE_REFERENCE:
+                                if tableData is None:
+                                    tableData = apk.read("resources.arsc")
+                                dataType, value = ResolveResource(tableData, value) or (TYPE_STRING, "")
+                            info[field] = str(value)
+                    elif tag == "uses-sdk" and "minSdkVersion" in attributes:
+                        info["minSdk"] = str(attributes["minSdkVersion"][1])
+                    elif tag in ["activity", "activity-alias"]:
+                        activity = str(attributes.get("name", (TYPE_STRING, ""))[1])
+                    elif tag == "intent-filter":
+                        isMainAction = False
+                        isLauncherCategory = False
+                    elif tag == "action" and attributes.get("name", (0, ""))[1] == "android.intent.action.MAIN":
+                        isMainAction = True
+                    elif tag == "category" and attributes.get("name", (0, ""))[1] == "android.intent.category.LAUNCHER":
+                        isLauncherCategory = True
+                else:
+                    if tag == "intent-filter" and isMainAction and isLauncherCategory \
+                            and activity and not info["launchableActivity"]:
+                        info["launchableActivity"] = GetFullClassName(info["package"], activity)
+                    elif tag in ["activity", "activity-alias"]:
+                        activity = None
+            abis = set()
+            for memberName in apk.namelist():
+                matchObj = re.match(r"lib/([^/]+)/[^/]+\.so$", memberName)
+                if matchObj is not None:
+                    abis.add(matchObj.group(1))
+            info["nativeAbis"] = sorted(abis)
+            return info
+    except (zipfile.BadZipFile, struct.error, IndexError, UnicodeDecodeError, KeyError, OSError) as e:
+        raise ApkReaderError("Can't read %s: %s" % (apkPath, e))
@@ -0,0 +1,232 @@
+import asyncio
+import json
+import math
+import os
+import re
+import time
+
+from modules.device import DecodeOutput
+from modules.executionEngine import RunOnDevices, GetLimitFromConfig
+from modules.configs import ConfigDataFields
+from modules.deviceInfoFormat import PrintInfoTable, PrintError
+
+# Frame stats and memory of the app are read with one shell round trip
+profileCommand = "dumpsys gfxinfo %s framestats; echo ADBE_MEMINFO; dumpsys meminfo %s"
+
+profileColumns = ["timestamp", "frames", "janky_frames", "jank_percent", "p50_ms", "p90_ms", "p95_ms", "p99_ms", "pss_kb"]
+
+
+def ParseFrameStats(gfxinfo):
+    """
+    Parses PROFILEDATA sections of 'dumpsys gfxinfo <pkg> framestats'.
+    Returns list of (intendedVsync, frameDurationNs) of valid frames (flags 0)
+    """
+    frames = []
+    columns = None
+    isProfileData = False
+    for line in gfxinfo.splitlines():
+        line = line.strip()
+        if line == "---PROFILEDATA---":
+            isProfileData = not isProfileData
+            columns = None
+            continue
+        if not isProfileData or not line:
+            continue
+        values = line.rstrip(",").split(",")
+        if columns is None:
+            columns = {name: index for index, name in enumerate(values)}
+            continue
+        try:
+            if int(values[columns["Flags"]]) != 0:
+                continue
+            intendedVsync = int(values[columns["IntendedVsync"]])
+            frameCompleted = int(values[columns["FrameCompleted"]])
+        except (KeyError, IndexError, ValueError):
+            continue
+        if frameCompleted > intendedVsync > 0:
+            frames.append((intendedVsync, frameCompleted - intendedVsync))
+    return frames
+
+
+def ParseFrameCounters(gfxinfo):
+    """
+    Returns (total frames rendered, janky frames) counters of gfxinfo summary. Counters grow since app start.
+    Returns None if app is not running
+    """
+    totalMatch = re.search(r"Total frames rendered: (\d+)", gfxinfo)
+    jankyMatch = re.search(r"Janky frames: (\d+)", gfxinfo)
+    if totalMatch is None or jankyMatch is None:
+        return None
+    return int(totalMatch.group(1)), int(jankyMatch.group(1))
+
+
+def ParseTotalPss(meminfo):
+    """
+    Returns total PSS of the app in KB from 'dumpsys meminfo <pkg>' or None if app is not running
+    """
+    matchObj = re.search(r"TOTAL PSS:\s+(\d+)", meminfo)
+    if matchObj is None:
+        # older Android versions only have the table, first TOTAL column is PSS
+        matchObj = re.search(r"^\s*TOTAL\s+(\d+)", meminfo, flags=re.MULTILINE)
+    if matchObj is None:
+        return None
+    return int(matchObj.group(1))
+
+
+def GetPercentile(sortedValues, percentile):
+    """
+    Nearest rank percentile of already sorted values
+    """
+    if not sortedValues:
+        return None
+    rank = max(1, math.ceil(percentile / 100.0 * len(sortedValues)))
+    return sortedValues[min(rank, len(sortedValues)) - 1]
+
+
+def RoundMs(durationNs):
+    if durationNs is None:
+        return None
+    return round(durationNs / 1000000.0, 2)
+
+
+class AppProfile:
+    """
+    Time series of one device. Values are kept by column (one list per profileColumns entry),
+    so the file is compact and easy to load for plotting
+    """
+
+    def __init__(self):
+        self.columns = {column: [] for column in profileColumns}
+        self.frameDurations = []
+        self.__lastVsync = 0
+        self.__lastCounters = None
+
+    def AddSample(self, timestamp, gfxinfo, meminfo):
+        # framestats keeps only the latest frames, already seen ones are skipped by their vsync time.
+        # Frames rendered before the first sample are not counted
+        allFrames = ParseFrameStats(gfxinfo)
+        newFrames = []
+        if self.__lastVsync > 0:
+            newFrames = [duration for vsync, duration in allFrames if vsync > self.__lastVsync]
+        for vsync, duration in allFrames:
+            self.__lastVsync = max(self.__lastVsync, vsync)
+        self.frameDurations.extend(newFrames)
+        sortedFrames = sorted(newFrames)
+
+        frames = len(newFrames)
+        jankyFrames = None
+        counters = ParseFrameCounters(gfxinfo)
+        if counters is not None and self.__lastCounters is not None and counters[0] >= self.__lastCounters[0]:
+            # jank as Android counts it, for frames rendered since the previous sample
+            frames = counters[0] - self.__lastCounters[0]
+            jankyFrames = counters[1] - self.__lastCounters[1]
+        self.__lastCounters = counters
+
+        values = {
+            "timestamp": round(timestamp, 3),
+            "frames": frames,
+            "janky_frames": jankyFrames,
+            "jank_percent": round(jankyFrames * 100.0 / frames, 2) if jankyFrames is not None and frames > 0 else None,
+            "p50_ms": RoundMs(GetPercentile(sortedFrames, 50)),
+            "p90_ms": RoundMs(GetPercentile(sortedFrames, 90)),
+            "p95_ms": RoundMs(GetPercentile(sortedFrames, 95)),
+            "p99_ms": RoundMs(GetPercentile(sortedFrames, 99)),
+            "pss_kb": ParseTotalPss(meminfo)
+        }
+        for column in profileColumns:
+            self.columns[column].append(values[column])
+
+    def Save(self, filePath, device, bundleID):
+        with open(filePath, mode="w", encoding="utf-8") as profileFile:
+            json.dump({
+                "device": device.GetPrintableDeviceName(),
+                "serial": device.GetDeviceID(),
+                "package": bundleID,
+                "columns": self.columns
+            }, profileFile, separators=(",", ":"))
+
+    def Summarize(self, device):
+        """
+        Returns summary row for PrintInfoTable
+        """
+        frames = sum(self.columns["frames"])
+        # only samples which have counters of the previous sample tell how many frames were janky
+        countedFrames = 0
+        jankyFrames = 0
+        for sampleFrames, sampleJankyFrames in zip(self.columns["frames"], self.columns["janky_frames"]):
+            if sampleJankyFrames is not None:
+                countedFrames += sampleFrames
+                jankyFrames += sampleJankyFrames
+        jankPercent = "-"
+        if countedFrames > 0:
+            jankPercent = "%.2f" % (jankyFrames * 100.0 / countedFrames)
+        sortedFrames = sorted(self.frameDurations)
+        pssValues = [value for value in self.columns["pss_kb"] if value is not None]
+
+        def FormatMs(percentile):
+            value = RoundMs(GetPercentile(sortedFrames, percentile))
+            return "-" if value is None else str(value)
+        return [
+            device.GetPrintableDeviceName(),
+            device.GetDeviceID(),
+            str(len(self.columns["timestamp"])),
+            str(frames),
+            jankPercent,
+            FormatMs(50),
+            FormatMs(90),
+            FormatMs(99),
+            "%.1f" % (sum(pssValues) / len(pssValues) / 1024) if pssValues else "-",
+            "%.1f" % (max(pssValues) / 1024) if pssValues else "-"
+        ]
+
+
+def ProfileApp(devices, bundleID, interval, duration, outputFolder):
+    """
+    Collects frame timing and memory of the app on all devices every `interval` seconds until CTRL+C
+    is pressed or `duration` seconds pass. Every device gets 'bundleID_serial.perf.json' file in outputFolder
+    and summary of all devices is printed at the end
+    """
+    if not os.path.exists(outputFolder):
+        os.makedirs(outputFolder)
+    profiles = {device.GetDeviceID(): AppProfile() for device in devices}
+    command = profileCommand % (bundleID, bundleID)
+    startTime = time.time()
+
+    async def Profile(engine, device):
+        serial = device.GetDeviceID()
+        sampleNumber = 0
+        while not engine.IsStopRequested():
+            nextSampleTime = startTime + sampleNumber * interval
+            if duration is not None and nextSampleTime - startTime >= duration:
+                return
+            delay = nextSampleTime - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(engine.WaitForStop(), delay)
+                    return
+                except asyncio.TimeoutError:
+                    pass
+            sampleNumber += 1
+            timestamp = time.time()
+            try:
+                exitCode, output = await engine.RunShell(serial, command)
+            except Exception as e:
+                if not engine.IsStopRequested():
+                    PrintError("%s: sample was not taken: %s" % (device.GetPrintableDeviceName(), e))
+                continue
+            gfxinfo, separator, meminfo = DecodeOutput(output).partition("ADBE_MEMINFO")
+            profiles[serial].AddSample(timestamp, gfxinfo, meminfo)
+
+    print("Profiling %s on %s devices every %s seconds. Press CTRL+C to stop.\n" % (bundleID, len(devices), interval))
+    maxParallel = max(GetLimitFromConfig(ConfigDataFields.max_parallel_commands), len(devices))
+    try:
+        RunOnDevices(devices, Profile, maxParallel=maxParallel, catchInterrupt=True)
+    finally:
+        for device in devices:
+            profilePath = os.path.join(outputFolder, "%s_%s.perf.json" % (bundleID, device.GetDeviceID()))
+            profiles[device.GetDeviceID()].Save(profilePath, device, bundleID)
+            print("Profile of %s saved as: %s" % (device.GetPrintableDeviceName(), os.path.abspath(profilePath)))
+
+    rows = [profiles[device.GetDeviceID()].Summarize(device) for device in devices]
+    print()
+    PrintInfoTable(rows, ["Device name", "Serial number", "Samples", "Frames", "Jank %", "P50 ms", "P90 ms", "P99 ms", "Avg PSS MB", "Max PSS MB"])
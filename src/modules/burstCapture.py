@@ -0,0 +1,146 @@
+import asyncio
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from modules.executionEngine import RunOnDevices
+from modules.deviceInfoFormat import PrintError
+
+# How many captured frames can wait for encoding per device. Capturing pauses when queue is full
+framesQueueSize = 4
+
+# PixelFormat values screencap writes in the raw header, and bytes per pixel for them
+PIXEL_FORMAT_RGBA_8888 = 1
+PIXEL_FORMAT_RGBX_8888 = 2
+PIXEL_FORMAT_RGB_888 = 3
+bytesPerPixel = {
+    PIXEL_FORMAT_RGBA_8888: 4,
+    PIXEL_FORMAT_RGBX_8888: 4,
+    PIXEL_FORMAT_RGB_888: 3
+}
+
+
+def ParseRawFrame(data):
+    """
+    Parses raw 'screencap' output (without -p). Output starts with width, height and pixel format
+    (newer Android versions also add color space) followed by pixels.
+    Returns (width, height, pixelFormat, pixels). Raises ValueError if frame can not be parsed
+    """
+    if len(data) < 12:
+        raise ValueError("Screencap returned %s bytes" % (len(data)))
+    width, height, pixelFormat = struct.unpack_from("<III", data, 0)
+    if pixelFormat not in bytesPerPixel:
+        raise ValueError("Unsupported pixel format %s" % (pixelFormat))
+    pixelsSize = width * height * bytesPerPixel[pixelFormat]
+    headerSize = len(data) - pixelsSize
+    if headerSize not in [12, 16]:
+        raise ValueError("Unexpected screencap frame size %s for %sx%s" % (len(data), width, height))
+    return width, height, pixelFormat, data[headerSize:]
+
+
+def EncodePngChunk(chunkType, data):
+    return struct.pack(">I", len(data)) + chunkType + data + struct.pack(">I", zlib.crc32(chunkType + data) & 0xffffffff)
+
+
+def EncodeFrameToPng(data, outputPath):
+    """
+    Encodes raw screencap frame to png file. Runs in encoding processes, so it must stay a module level function
+    """
+    width, height, pixelFormat, pixels = ParseRawFrame(data)
+    if pixelFormat == PIXEL_FORMAT_RGBX_8888:
+        # 'X' byte is undefined, make pixels opaque
+        pixels = bytearray(pixels)
+        pixels[3::4] = b"\xff" * (width * height)
+    colorType = 2 if pixelFormat == PIXEL_FORMAT_RGB_888 else 6
+    stride = width * bytesPerPixel[pixelFormat]
+    # every row starts with filter type 0 (none)
+    rows = b"".join(b"\x00" + bytes(pixels[y * stride:(y + 1) * stride]) for y in range(height))
+    with open(outputPath, mode="wb") as pngFile:
+        pngFile.write(b"\x89PNG\r\n\x1a\n")
+        pngFile.write(EncodePngChunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, colorType, 0, 0, 0)))
+        pngFile.write(EncodePngChunk(b"IDAT", zlib.compress(rows, 1)))
+        pngFile.write(EncodePngChunk(b"IEND", b""))
+    return outputPath
+
+
+async def CaptureFrames(engine, device, framesCount, rate, framesQueue):
+    """
+    Captures raw frames at the given rate (frames per second) and puts them into framesQueue
+    as (frameNumber, timestamp, data). None is put when capturing is finished
+    """
+    startTime = time.time()
+    # every failure is caught below, so the closing None always reaches the encoder
+    try:
+        interval = 1.0 / rate
+        for frameNumber in range(framesCount):
+            # if capture takes longer than interval, next frame is taken right away
+            delay = startTime + frameNumber * interval - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            timestamp = time.time()
+            returnCode, output, err = await engine.RunAdb(device.GetDeviceID(), ["exec-out", "screencap"])
+            if returnCode != 0:
+                PrintError("%s: frame %s was not captured: %s" % (device.GetPrintableDeviceName(), frameNumber, err.decode("utf-8", "replace").strip()))
+                continue
+            await framesQueue.put((frameNumber, timestamp, output))
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        PrintError("%s: capturing stopped: %s" % (device.GetPrintableDeviceName(), e))
+    await framesQueue.put(None)
+
+
+async def EncodeFrames(device, framesQueue, encodingPool, filePrefix):
+    """
+    Takes frames from framesQueue and encodes them in encodingPool. Returns list of (frameNumber, timestamp, filePath)
+    """
+    loop = asyncio.get_event_loop()
+    encodedFrames = []
+    while True:
+        frame = await framesQueue.get()
+        if frame is None:
+            return encodedFrames
+        frameNumber, timestamp, data = frame
+        framePath = "%s_%04d.png" % (filePrefix, frameNumber)
+        # any failure (broken frame, full disk, crashed encoding process) costs only this frame,
+        # so the queue keeps being drained and capturing does not block on it
+        try:
+            await loop.run_in_executor(encodingPool, EncodeFrameToPng, data, framePath)
+            encodedFrames.append((frameNumber, timestamp, framePath))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            PrintError("%s: frame %s was not encoded: %s" % (device.GetPrintableDeviceName(), frameNumber, e))
+
+
+def CaptureBurst(devices, screenshotName, saveLocation, framesCount, rate):
+    """
+    Captures framesCount frames from every device at the given rate (frames per second).
+    Frames are taken as raw framebuffer (device does not encode them) and encoded to png on the host
+    by a pool of processes. Frames are saved as 'name_deviceSerial_frameNumber.png' and
+    their capture timestamps are written to 'name_deviceSerial_frames.csv'
+    """
+    encodingPool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+
+    async def Burst(engine, device):
+        filePrefix = device.GetScreenshotPath(screenshotName, saveLocation)[:-len(".png")]
+        framesQueue = asyncio.Queue(maxsize=framesQueueSize)
+        startTime = time.time()
+        capturing = asyncio.ensure_future(CaptureFrames(engine, device, framesCount, rate, framesQueue))
+        try:
+            encodedFrames = await EncodeFrames(device, framesQueue, encodingPool, filePrefix)
+            await capturing
+        finally:
+            capturing.cancel()
+        with open(filePrefix + "_frames.csv", mode="w") as timestampsFile:
+            timestampsFile.write("frame,timestamp,offset_ms,file\n")
+            for frameNumber, timestamp, framePath in encodedFrames:
+                timestampsFile.write("%d,%.3f,%d,%s\n" % (frameNumber, timestamp, (timestamp - startTime) * 1000, os.path.basename(framePath)))
+        print("%s frames of %s saved as: %s_*.png" % (len(encodedFrames), device.GetPrintableDeviceName(), filePrefix))
+
+    try:
+        RunOnDevices(devices, Burst)
+    finally:
+        encodingPool.shutdown(wait=True)
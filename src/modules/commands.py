@@ -1,13 +1,15 @@
 from subprocess import Popen, PIPE
-from os import path, listdir
+from os import path
 from platform import system
 import re
-import pyperclip
-import threading
-from modules.device import DeviceData
+import time
+from modules.device import DeviceData, DecodeOutput
+from modules.executionEngine import RunOnDevices, GetLimitFromConfig
+from modules.adbclient import GetNativeClient, AdbError
 from modules.configs import ConfigDataFields, GetFieldData
-from modules.deviceInfoFormat import FormatEssentialDeviceInfo, FormatEssentialDeviceInfoInExcelFormat, PrintInfoTable
+from modules.deviceInfoFormat import FormatEssentialDeviceInfo, FormatEssentialDeviceInfoInExcelFormat, PrintInfoTable, PrintError
 from modules.deviceCacher import DeleteCachedDevice, DeleteCacheDir
+from modules.deadlines import CommunicateWithDeadline, CommandTimeoutError, GetCommandTimeout
 
 
 defaultWhitelistedApps = [
@@ -20,32 +22,76 @@ defaultWhitelistedApps = [
     "com.google.android.gsf.login" # To here
 ]
 
+# Set when commands are executed by the daemon, then devices are taken from it's live inventory
+deviceInventory = None
+
 class CopyDeviceInfoModes:
     minimal = 0
     standard = 1
     full = 2
 
 
+def SetDeviceInventory(inventory):
+    global deviceInventory
+    deviceInventory = inventory
+
+def GetInventoryDevices(isFullInfo):
+    """
+    Returns devices from the live inventory (see modules.deviceInventory). Devices there are already probed,
+    only battery data is read again
+    """
+    deviceInventory.WaitUntilReady()
+    unauthorized = False
+    for serial, state in deviceInventory.GetStates().items():
+        if state == "unauthorized":
+            print("Device " + serial + " unauthorized")
+            unauthorized = True
+    devices = deviceInventory.GetDevices()
+    if len(devices) == 0:
+        if not unauthorized:
+            print("There are no devices connected")
+        return None
+    if isFullInfo:
+        async def Refresh(engine, device):
+            await engine.RunBlocking(device.GetDeviceID(), device.RefreshBatteryData)
+        RunOnDevices(devices, Refresh)
+    return devices
+
 def GetConnectedDevices(isFullInfo):
     """
     Gets all connected devices. if isFullInfo is set to True it loads all additional device info as well.
     This is optional because sometimes you may not want to do that (for example when removing apps from device)
     """
-    proc = Popen(["adb", "devices"], stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    output, err = proc.communicate(input=None, timeout=None)
-    daemonStartMessage = "daemon not running; starting now"
-    if(err and daemonStartMessage not in err.decode("ascii")):
-        print(err)
-        return []
-    devices = []
+    if deviceInventory is not None:
+        return GetInventoryDevices(isFullInfo)
+    nativeClient = GetNativeClient()
+    if nativeClient is not None:
+        try:
+            output = nativeClient.GetDevicesListing()
+        except (OSError, AdbError) as e:
+            print(e)
+            return []
+    else:
+        proc = Popen(["adb", "devices"], stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        try:
+            output, err = CommunicateWithDeadline(proc, GetCommandTimeout(), "adb devices")
+        except CommandTimeoutError as e:
+            PrintError("adb server is not responding: %s" % (e))
+            return None
+        daemonStartMessage = "daemon not running; starting now"
+        if(err and daemonStartMessage not in err.decode("ascii")):
+            print(err)
+            return []
+        output = output.decode("ascii")
+    serials = []
     unauthorized = False
-    for line in (output.decode("ascii")).splitlines():
+    for line in output.splitlines():
         if "\tdevice" in line:
-            devData = DeviceData(line.split('\t')[0], isFullInfo)
-            devices.append(devData)
+            serials.append(line.split('\t')[0])
         if "\tunauthorized" in line:
             print("Device " + line.split('\t')[0] + " unauthorized")
             unauthorized = True
+    devices = ProbeDevices(serials, isFullInfo)
     if len(devices) == 0:
         if not unauthorized:
             print("There are no devices connected")
@@ -53,50 +99,24 @@ def GetConnectedDevices(isFullInfo):
         return None
     return devices
 
-def GetAPKDumpBadging(apkPath):
+def GetProbeWorkersCount():
     """
-    Returns dump from .apk file. This dump contains apk badging information - min/recommented OS versions,
-    main activity name, bundle id etc.
+    Returns how many devices can be probed at the same time (PROBE_WORKERS config field)
     """
-    try:
-        proc = Popen(["aapt", "dump", "badging", apkPath], stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        output, err = proc.communicate(input=None, timeout=None)
-        return output.decode("utf-8")
-    except FileNotFoundError:
-        sdkLocation = GetFieldData(ConfigDataFields.sdk_location)
-        if not sdkLocation:
-            print("'aapt' is not recognized command by your system. Here are solutions for this issue:")
-            print(" * Add 'aapt' path (usually located in AndroidSDK/build-tools/version/) to environmental PATH variable")
-            print(" * Add Android SDK path inside adbepy.config file (write it in '%s' line after equals sign)" % (ConfigDataFields.sdk_location))
-            return
-        buildToolsFolder = path.join(sdkLocation, "build-tools")
-        if not path.exists(buildToolsFolder):
-            print("Can't find build-tools folder")
-            return None
-        directories = listdir(buildToolsFolder)
-        directories.sort(reverse=True)
-        for btoolsVersion in directories:
-            aaptPath = path.join(buildToolsFolder, btoolsVersion + "/aapt")
-            if system() == "Windows":
-                # if user is on Windows OS
-                aaptPath = aaptPath + ".exe"
-            if path.isfile(aaptPath):
-                proc = Popen([aaptPath, "dump", "badging", apkPath], stdin=PIPE, stdout=PIPE, stderr=PIPE)
-                output, err = proc.communicate(input=None, timeout=None)
-                if err:
-                    print("Error occured: %s" % (err.decode("utf-8").rstrip()))
-                    return None
-                return output.decode("utf-8")
-        print("Can't find 'aapt'. Make sure you have Android build-tools installed.")
-        return None
-
-def GetBundleIDFromDump(dump):
-    matchObj = re.search(r"package: name='([\w.]*)'", dump, flags=0)
-    return matchObj.group(1)
+    return GetLimitFromConfig(ConfigDataFields.probe_workers)
 
-def GetLaunchableActivityFromDump(dump):
-    matchObj = re.search(r"launchable-activity: name='([\w.]*)'", dump, flags=0)
-    return matchObj.group(1)
+def ProbeDevices(serials, isFullInfo):
+    """
+    Creates DeviceData for every serial, at most PROBE_WORKERS devices at the same time. Each device is probed
+    with several blocking adb calls, so probing them side by side makes the total time depend on
+    the slowest device rather than on the amount of devices.
+    Returned list keeps the same order as given serials
+    """
+    async def Probe(engine, serial):
+        return await engine.RunBlocking(serial, DeviceData, serial, isFullInfo)
+    devices = RunOnDevices(serials, Probe, GetProbeWorkersCount())
+    # devices which failed to be probed are reported by RunOnDevices and skipped
+    return [device for device in devices if device is not None]
 
 def GetDevicesFromNameList(allDevices, neededDevices):
     """
@@ -143,11 +163,38 @@ def PrintDevicesInExcelFormat(args):
             deviceInfo += FormatEssentialDeviceInfoInExcelFormat(device, args.battery)
         print(deviceInfo)
 
-def SingleThread_Install(device, apkPath, shouldLaunch, bundleID, mainActivity):
-    isInstalled = device.InstallApk(apkPath)
-    if shouldLaunch and isInstalled:
+async def InstallOnDevice(engine, device, args, apkInfo):
+    """
+    Installs apk on a single device. Installation is skipped if the same build (versionCode and
+    apk digest) is already installed, unless --force is used.
+    Apk is pushed to the device once and installed from there with 'pm install'
+    (or streamed with 'adb install --incremental' if --incremental is used)
+    """
+    serial = device.GetDeviceID()
+    isInstalled = False
+    if not args.force and apkInfo["package"] and apkInfo["versionCode"]:
+        installedVersion, installedDigest = await engine.RunBlocking(serial, device.GetInstalledAppIdentity, apkInfo["package"])
+        if installedVersion == apkInfo["versionCode"] and installedDigest == apkInfo["digest"]:
+            print("%s already has this build installed, skipping" % (device.GetPrintableDeviceName()))
+            isInstalled = True
+
+    if not isInstalled and args.incremental:
+        returnCode, output, err = await engine.RunAdb(serial, ["install", "-r", "--incremental", args.apkPath], hasDeadline=False)
+        isInstalled = device.ReportInstallResult(DecodeOutput(output + err))
+    elif not isInstalled:
+        remotePath = "/data/local/tmp/adbe_%s.apk" % (apkInfo["digest"][:16])
+        returnCode, output, err = await engine.RunAdb(serial, ["push", args.apkPath, remotePath], hasDeadline=False)
+        if returnCode != 0:
+            PrintError("Failed pushing apk to %s: %s" % (device.GetPrintableDeviceName(), DecodeOutput(err or output)))
+            return False
+        returnCode, output, err = await engine.RunAdb(serial, ["shell", "pm", "install", "-r", remotePath], hasDeadline=False)
+        isInstalled = device.ReportInstallResult(DecodeOutput(output + err))
+        await engine.RunAdb(serial, ["shell", "rm", "-f", remotePath])
+
+    if not args.no_launch and isInstalled and apkInfo["launchableActivity"]:
         print("Launching installed application on %s" % (device.GetPrintableDeviceName()) )
-        device.LaunchApk(bundleID, mainActivity)
+        await engine.RunBlocking(serial, device.LaunchApk, apkInfo["package"], apkInfo["launchableActivity"])
+    return isInstalled
 
 def Install(args):
     """
@@ -170,33 +217,20 @@ def Install(args):
             print("Targeted device names are missing.")
             return
 
-    mainActivity = ""
-    bundleID = ""
-    if not args.no_launch:
-        dump = GetAPKDumpBadging(args.apkPath)
-        if not dump:
-            print("Due to mentioned problems, ADBEpy won't be able to run apk on connected devices...")
-            print("However, application will still be installed")
-            # "mentioned problems" are printed if any issues occure in GetAPKDumpBadging function
-        else:
-            bundleID = GetBundleIDFromDump(dump)
-            mainActivity = GetLaunchableActivityFromDump(dump)
+    from modules.apkInfo import GetAPKInfo
+    apkInfo = GetAPKInfo(args.apkPath)
+    if not apkInfo["package"]:
+        print("Due to mentioned problems, ADBEpy won't be able to run apk on connected devices or check installed versions...")
+        print("However, application will still be installed")
+        # "mentioned problems" are printed if any issues occure in GetAPKDumpBadging function
 
-    installThreads = []
-    installingOnDevices = []
     nOfDevices = len(connectedDevices)
-    for device in connectedDevices:
-        installThreads.append( threading.Thread(target=SingleThread_Install, 
-            args=[device, args.apkPath, not args.no_launch, bundleID, mainActivity]) )
-        installingOnDevices.append(device)
     print("Starting app installation process on %s devices:" % (nOfDevices))
     for i in range(nOfDevices):
-        installThreads[i].start()
-        print("%s: %s" % (i+1, installingOnDevices[i].GetPrintableDeviceName()))    
+        print("%s: %s" % (i+1, connectedDevices[i].GetPrintableDeviceName()))
 
-    print("Waiting for threads to finish assigned tasks\n")
-    for thrd in installThreads:
-        thrd.join()
+    print("Waiting for devices to finish assigned tasks\n")
+    RunOnDevices(connectedDevices, lambda engine, device: InstallOnDevice(engine, device, args, apkInfo))
 
 def ListApps(args):
     """
@@ -218,25 +252,45 @@ def ListApps(args):
             print("Targeted device names are missing.")
             return
 
+    async def GetApps(engine, device):
+        return await engine.RunBlocking(device.GetDeviceID(), device.GetThirdPartyApps)
+    appsPerDevice = RunOnDevices(connectedDevices, GetApps)
+
     print("Here are installed third party apps")
-    for device in connectedDevices:
+    for device, apps in zip(connectedDevices, appsPerDevice):
+        # devices which failed or did not respond are already reported
+        if apps is None:
+            continue
         print(device.GetPrintableDeviceName())
-        apps = device.GetThirdPartyApps()
-        for app in apps:
+        for app in apps or []:
             print(" * %s" % (app))
         print("")
 
-def SingleThread_PurgeApps(device):
-    apps = device.GetThirdPartyApps()
-    apps = [singleApp for singleApp in apps if singleApp not in defaultWhitelistedApps]
+def GetAppsToPurge(device, whitelist):
+    """
+    Returns third party apps installed on the device which are not in the whitelist (set of bundle ids)
+    """
+    return [singleApp for singleApp in device.GetThirdPartyApps() if singleApp not in whitelist]
+
+def PurgeAppsOnDevice(device, whitelist, isDryRun):
+    apps = GetAppsToPurge(device, whitelist)
+    if isDryRun:
+        print(" * %s - %s apps would be removed:" % (device.GetPrintableDeviceName(), len(apps)))
+        for app in apps:
+            print("    - %s" % (app))
+        return
+    results = device.RemoveApps(apps)
+    report = " * %s - Finished" % (device.GetPrintableDeviceName())
     for app in apps:
-        device.RemoveApp(app)
-    print(" * %s - Finished" % (device.GetPrintableDeviceName()))
+        report += "\n    - %s: %s" % (app, results[app])
+    print(report)
 
 def PurgeApps(args):
     """
     Purges all third party apps from the device
     This function contains white list and accepts additional bundle ids which will not be removed
+    All apps of a single device are removed with one batched command. With --dry-run apps which
+    would be removed are only printed
 
     deviceParam - accepts two parameters: -a for all devices and -s for specific device (with device names)
     lineWithNames - string line with devices which should be affected (separate with a single comma)
@@ -245,25 +299,23 @@ def PurgeApps(args):
     connectedDevices = GetConnectedDevices(False)
     if connectedDevices == None:
         return
+    whitelist = set(defaultWhitelistedApps)
     if args.whitelist:
-        defaultWhitelistedApps.extend(args.whitelist)
+        whitelist.update(args.whitelist)
     if args.devices:
         connectedDevices = GetDevicesFromNameList(connectedDevices, args.devices)
         if len(connectedDevices) == 0:
             print("Targeted device names are missing.")
             return
 
-    print("Removing third party apps from %s devices..." % (len(connectedDevices)))
-
-    purgeThreads = []
-    for device in connectedDevices:
-        purgeThreads.append( threading.Thread(target=SingleThread_PurgeApps, args=[device]) )
-
-    for i in range( len(purgeThreads) ):
-        purgeThreads[i].start()  
+    if args.dry_run:
+        print("Dry run. Nothing will be removed from %s devices" % (len(connectedDevices)))
+    else:
+        print("Removing third party apps from %s devices..." % (len(connectedDevices)))
 
-    for thrd in purgeThreads:
-        thrd.join()
+    async def Purge(engine, device):
+        await engine.RunBlocking(device.GetDeviceID(), PurgeAppsOnDevice, device, whitelist, args.dry_run)
+    RunOnDevices(connectedDevices, Purge)
 
 def TurnOff(args):
     """
@@ -282,8 +334,10 @@ def TurnOff(args):
             print("Targeted device names are missing.")
             return
 
-    for device in connectedDevices:
-        print(device.TurnOff())
+    async def TurnOffDevice(engine, device):
+        returnCode, output, err = await engine.RunAdb(device.GetDeviceID(), ["shell", "reboot", "-p"])
+        print(device.ReportTurnOffResult(DecodeOutput(output)))
+    RunOnDevices(connectedDevices, TurnOffDevice)
 
 def ClearDeviceCache(args):
     """
@@ -294,13 +348,24 @@ def ClearDeviceCache(args):
     """
     if args.serial:
         inp = input("You're attempting to delete " +  str(len(args.serial)) + " cached devices. Are you sure? (Y/N) ")
-        if inp.upper() == "Y":
-            for serial in args.serial:
-                print(DeleteCachedDevice(serial))
     else:
         inp = input("You're about to delete all cached devices. Are you sure? (Y/N) ")
-        if inp.upper() == "Y":
-            print(DeleteCacheDir())
+    if inp.upper() != "Y":
+        return
+    # running daemon keeps the cache open and devices probed, so it has to delete the cache itself
+    from modules.daemon import SendRequest
+    if SendRequest({"clearCache": args.serial or []}) is None:
+        DeleteDeviceCache(args.serial)
+
+def DeleteDeviceCache(serials):
+    """
+    Deletes given devices (all devices if serials is empty) from the device cache and prints the result
+    """
+    if serials:
+        for serial in serials:
+            print(DeleteCachedDevice(serial))
+    else:
+        print(DeleteCacheDir())
 
 def CopyDeviceInfo(args):
     mode = 0
@@ -352,21 +417,30 @@ def CopyDeviceInfo(args):
             stringForClipboard += devdata["fingerprint"]
         stringForClipboard += "\n"
         counter += 1
+    import pyperclip
     pyperclip.copy(stringForClipboard)
     print("Data for %s devices was copied" % (counter))
 
-def GetSavePath(saveLocation):
+def GetSavePath(saveLocation, defaultLocationField):
+    """
+    Returns path given with -o option or the default one from adbepy.config
+    """
+    if saveLocation is None:
+        return GetFieldData(defaultLocationField)
     if isinstance(saveLocation, list):
         return saveLocation[0]
     else:
         return saveLocation
 
 def TakeScreenshot(args):
+    if args.burst and args.rate <= 0:
+        print("Rate must be greater than 0.")
+        return
     connectedDevices = GetConnectedDevices(False)
     if connectedDevices == None:
         return
 
-    saveLocation = GetSavePath(args.saveLocation)
+    saveLocation = GetSavePath(args.saveLocation, ConfigDataFields.screenshot_location)
 
     if args.devices:
         connectedDevices = GetDevicesFromNameList(connectedDevices, args.devices)
@@ -374,8 +448,19 @@ def TakeScreenshot(args):
             print("Targeted device names are missing.")
             return
         
-    for device in connectedDevices:
-        print(device.TakeScreenshot(args.imageName, saveLocation))
+    if args.burst:
+        from modules.burstCapture import CaptureBurst
+        CaptureBurst(connectedDevices, args.imageName, saveLocation, args.burst, args.rate)
+        return
+
+    async def Screenshot(engine, device):
+        screenshotPath = device.GetScreenshotPath(args.imageName, saveLocation)
+        returnCode, err = await engine.RunAdbToFile(device.GetDeviceID(), ["exec-out", "screencap", "-p"], screenshotPath)
+        if returnCode != 0:
+            PrintError("Failed taking screenshot on %s: %s" % (device.GetPrintableDeviceName(), DecodeOutput(err)))
+        else:
+            print("Screenshot saved as: " + screenshotPath)
+    RunOnDevices(connectedDevices, Screenshot)
 
 def RecordVideo(args):
     connectedDevices = GetConnectedDevices(False)
@@ -386,15 +471,96 @@ def RecordVideo(args):
         if len(connectedDevices) == 0:
             print("Targeted device names are missing.")
             return
-    if len(connectedDevices) > 1:
-        print("More than one device selected. Recording is available only to one device at the time.")
-        return
-        
-    saveLocation = GetSavePath(args.saveLocation)
+
+    saveLocation = GetSavePath(args.saveLocation, ConfigDataFields.recorded_video_location)
     recordingResolution = "720x1280"
     if args.orientation[0] == "land":
         recordingResolution = "1280x720"
-    print(connectedDevices[0].RecordVideo(args.videoName, saveLocation, recordingResolution))
+    from modules.screenRecorder import RecordVideos
+    RecordVideos(connectedDevices, args.videoName, saveLocation, recordingResolution, args.device_file)
+
+def Monitor(args):
+    connectedDevices = GetConnectedDevices(False)
+    if connectedDevices == None:
+        return
+    if args.devices:
+        connectedDevices = GetDevicesFromNameList(connectedDevices, args.devices)
+        if len(connectedDevices) == 0:
+            print("Targeted device names are missing.")
+            return
+    if args.interval <= 0:
+        print("Interval must be greater than 0.")
+        return
+    from modules.telemetry import MonitorDevices
+    MonitorDevices(connectedDevices, args.interval, args.duration, args.output, max(1, args.buffer))
+
+def Perf(args):
+    if not re.match(r"^[\w.]+$", args.bundleID):
+        print("'%s' is not a valid bundle identifier." % (args.bundleID))
+        return
+    if args.interval <= 0:
+        print("Interval must be greater than 0.")
+        return
+    connectedDevices = GetConnectedDevices(False)
+    if connectedDevices == None:
+        return
+    if args.devices:
+        connectedDevices = GetDevicesFromNameList(connectedDevices, args.devices)
+        if len(connectedDevices) == 0:
+            print("Targeted device names are missing.")
+            return
+    from modules.appProfiler import ProfileApp
+    ProfileApp(connectedDevices, args.bundleID, args.interval, args.duration, args.output or ".")
+
+def Logcat(args):
+    from modules.logStreamer import IsValidFilterSpec, StreamLogs
+    for filterSpec in args.filters:
+        if not IsValidFilterSpec(filterSpec):
+            print("'%s' is not a valid filterspec. Expected 'tag:priority', where priority is one of V, D, I, W, E, F or S." % (filterSpec))
+            return
+    if args.max_size <= 0:
+        print("Maximum log file size must be greater than 0.")
+        return
+    connectedDevices = GetConnectedDevices(False)
+    if connectedDevices == None:
+        return
+    if args.devices:
+        connectedDevices = GetDevicesFromNameList(connectedDevices, args.devices)
+        if len(connectedDevices) == 0:
+            print("Targeted device names are missing.")
+            return
+    StreamLogs(connectedDevices, args.filters, args.buffers, args.duration, args.output,
+               int(args.max_size * 1024 * 1024), max(0, args.rotate), args.clear)
+
+def PrintInventoryEvent(event, serial, payload):
+    from modules.deviceInventory import InventoryEvents
+    timestamp = time.strftime("%H:%M:%S")
+    if event == InventoryEvents.attached:
+        print("[%s] + %s" % (timestamp, " | ".join(FormatEssentialDeviceInfo(payload, False))))
+    elif event == InventoryEvents.detached:
+        name = payload.GetPrintableDeviceName() if payload is not None else serial
+        print("[%s] - %s (%s)" % (timestamp, name, serial))
+    elif event == InventoryEvents.changed:
+        print("[%s] ! %s is %s" % (timestamp, serial, payload))
+    elif event == InventoryEvents.failed:
+        PrintError("[%s] %s: %s" % (timestamp, serial, payload))
+
+def Watch(args):
+    """
+    Prints devices as they are attached and detached until CTRL+C is pressed.
+    Devices are tracked with adb server's track-devices stream and probed only once, when they are attached
+    """
+    from modules.deviceInventory import DeviceInventory
+    inventory = DeviceInventory(PrintInventoryEvent, isFullInfo=True)
+    print("Watching devices. Press CTRL+C to stop.")
+    inventory.Start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        inventory.Stop()
 
 def OpenRootFolder(args):
     """
@@ -1,16 +1,21 @@
-from subprocess import Popen, PIPE
-import re
 import os
+import shutil
+import threading
 from platform import system
 
-resFolder = os.path.join(os.path.dirname(__file__), "../res/")
+# Folder with config, caches and downloaded databases. Can be moved with ADBEPY_RES_DIR environment variable
+# (ex. benchmarks use it to run with empty caches)
+resFolder = os.environ.get("ADBEPY_RES_DIR") or os.path.join(os.path.dirname(__file__), "../res/")
 configFileName = "adbepy.config"
 configFilePath = os.path.join(resFolder, configFileName)
 
 def GetDefaultSDKPath():
-    proc = Popen(["adb"], stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    output, err = proc.communicate(input=None, timeout=None)
-    if err.decode("UTF-8"):
+    """
+    Returns Android SDK folder of adb found in PATH (adb is located in SDK/platform-tools).
+    adb is only looked up, not started
+    """
+    adbPath = shutil.which("adb")
+    if adbPath is None:
         # if adb is not added to PATH env variables
         userPath = os.path.expanduser("~")
         pathToSDK = "Library/Android/sdk"
@@ -18,32 +23,183 @@ def GetDefaultSDKPath():
             pathToSDK = "AppData\\Local\\Android\\Sdk"
         return os.path.join(userPath, pathToSDK)
     else:
-        matchObj = re.search(r"Installed as (.+(?=\n))", output.decode("ascii"), flags=0)
-        return os.path.abspath(os.path.join(matchObj.group(1), "../../"))
-        
+        return os.path.abspath(os.path.join(os.path.realpath(adbPath), "../../"))
+
 
 
 class ConfigDataFields:
     sdk_location = "SDK_FOLDER"
     screenshot_location = "SCREENSHOT_LOC"
     recorded_video_location = "RECVID_LOC"
+    probe_workers = "PROBE_WORKERS"
+    native_adb = "NATIVE_ADB"
+    cpu_database_ttl = "CPU_DB_TTL"
+    shell_sessions = "SHELL_SESSIONS"
+    max_parallel_commands = "MAX_PARALLEL_COMMANDS"
+    max_commands_per_device = "MAX_COMMANDS_PER_DEVICE"
+    command_timeout = "COMMAND_TIMEOUT"
+    operation_timeout = "OPERATION_TIMEOUT"
+    retries = "RETRIES"
 
 defaultConfigValues = {
     ConfigDataFields.sdk_location:{
-        "value": GetDefaultSDKPath(),
+        # resolved only when it is needed, see GetDefaultValue
+        "value": GetDefaultSDKPath,
         "description": "SDK folder location"
     },
     ConfigDataFields.screenshot_location: {
-        "value": os.path.abspath(os.path.join(resFolder, "../../screenshots/")),
+        "value": os.path.abspath(os.path.join(os.path.dirname(__file__), "../../screenshots/")),
         "description": "Default screenshot location"
     },
     ConfigDataFields.recorded_video_location: {
-        "value": os.path.abspath(os.path.join(resFolder, "../../videos/")),
+        "value": os.path.abspath(os.path.join(os.path.dirname(__file__), "../../videos/")),
         "description": "Default path for recorded videos"
+    },
+    ConfigDataFields.probe_workers: {
+        "value": "8",
+        "description": "How many devices are probed for information at the same time"
+    },
+    ConfigDataFields.native_adb: {
+        "value": "false",
+        "description": "Talk to adb server directly instead of starting adb binary for every command (true/false)"
+    },
+    ConfigDataFields.cpu_database_ttl: {
+        "value": "168",
+        "description": "How many hours cached CPU hardware database is used before checking for updates"
+    },
+    ConfigDataFields.shell_sessions: {
+        "value": "true",
+        "description": "Keep one adb shell open per device and run all shell commands through it (true/false)"
+    },
+    ConfigDataFields.max_parallel_commands: {
+        "value": "16",
+        "description": "How many adb commands can run at the same time across all devices"
+    },
+    ConfigDataFields.max_commands_per_device: {
+        "value": "2",
+        "description": "How many adb commands can run at the same time on a single device"
+    },
+    ConfigDataFields.command_timeout: {
+        "value": "30",
+        "description": "Seconds a single adb command can take before it is killed and device is reported as not responding (0 - no limit)"
+    },
+    ConfigDataFields.operation_timeout: {
+        "value": "600",
+        "description": "Seconds a whole operation on one device (probing, installing...) can take before the device is dropped (0 - no limit)"
+    },
+    ConfigDataFields.retries: {
+        "value": "2",
+        "description": "How many times adb command is retried after transient failure (device offline, connection closed...)"
     }
 }
 
 
+def GetDefaultValue(field):
+    """
+    Returns default value of the field. Defaults which are expensive to find (SDK folder)
+    are stored as functions and resolved on the first use
+    """
+    value = defaultConfigValues[field]["value"]
+    if callable(value):
+        value = value()
+        defaultConfigValues[field]["value"] = value
+    return value
+
+class Config:
+    """
+    adbepy.config parsed once and kept in memory. File is checked with a single stat call on every
+    read and parsed again only when it's modification time changes. Typed values (see GetInt, GetFloat
+    and GetBool) are memoized until then as well. Use module level `config` object
+    """
+
+    def __init__(self, filePath):
+        self.__filePath = filePath
+        self.__modificationTime = None
+        self.__values = {}
+        self.__typedValues = {}
+        self.__lock = threading.Lock()
+
+    def __Reload(self):
+        try:
+            fileStat = os.stat(self.__filePath)
+        except FileNotFoundError:
+            GenerateConfigFile("")
+            fileStat = os.stat(self.__filePath)
+        modificationTime = (fileStat.st_mtime_ns, fileStat.st_size)
+        if modificationTime == self.__modificationTime:
+            return
+        values = {}
+        with open(self.__filePath, mode="r") as configFile:
+            for line in configFile:
+                line = line.strip()
+                if not line or line[0] == "#" or "=" not in line:
+                    continue
+                key, value = line.split("=", 1)
+                values[key.strip()] = value.strip()
+        self.__values = values
+        self.__typedValues = {}
+        self.__modificationTime = modificationTime
+
+    def Get(self, field):
+        """
+        Returns value of the field as string. Empty or missing fields get their default value,
+        None is returned for unknown fields without a value
+        """
+        with self.__lock:
+            self.__Reload()
+            value = self.__values.get(field, "")
+        if value:
+            return value
+        if field in defaultConfigValues:
+            return GetDefaultValue(field)
+        return None
+
+    def __GetTyped(self, field, valueType, convert):
+        key = (field, valueType)
+        with self.__lock:
+            self.__Reload()
+            if key in self.__typedValues:
+                return self.__typedValues[key]
+        try:
+            value = convert(self.Get(field))
+        except (TypeError, ValueError):
+            value = None
+        with self.__lock:
+            self.__typedValues[key] = value
+        return value
+
+    def GetInt(self, field):
+        """
+        Returns value of the field as int or None if it is not a number
+        """
+        return self.__GetTyped(field, "int", int)
+
+    def GetFloat(self, field):
+        """
+        Returns value of the field as float or None if it is not a number
+        """
+        return self.__GetTyped(field, "float", float)
+
+    def GetBool(self, field):
+        return self.__GetTyped(field, "bool", lambda value: value.strip().lower() in ["true", "yes", "1"])
+
+    def GetAll(self):
+        """
+        Returns dictionary of all fields in the file together with default values of the missing ones
+        """
+        output = {}
+        for field in defaultConfigValues:
+            output[field] = self.Get(field)
+        with self.__lock:
+            self.__Reload()
+            fields = list(self.__values)
+        for field in fields:
+            output[field] = self.Get(field)
+        return output
+
+
+config = Config(configFilePath)
+
 def GetFieldData(field):
     """
     field - expected any field from ConfigDataFields class. You can send a simple
@@ -51,39 +207,14 @@ def GetFieldData(field):
     fields) but it is highly recommended to use ConfigDataFields in order to
     prevent mistakes and stay consistent
     """
-    try:
-        f = open(configFilePath, mode='r', buffering=-1)
-    except FileNotFoundError:
-        GenerateConfigFile("")
-        return defaultConfigValues[field]["value"]
-    for line in f:
-        if line[0] == "#": continue
-        if field in line: 
-            value = line.split('=', 1)[1].rstrip()
-            if not value: return defaultConfigValues[field]["value"]
-            else: return value
+    return config.Get(field)
 
 def GetConfigs():
     """
     Returns whole config file as a dictionary. Use ConfigDataFields variables
     as keys for returned dictionary
     """
-    output = {}
-    try:
-        f = open(configFilePath, mode='r', buffering=-1)
-        # if file is found
-        for line in f:
-            if line[0] == "#": continue
-            if "=" in line: 
-                configProps = line.split('=', 1)
-                output[configProps[0]] = configProps[1].rstrip()
-                if not output[configProps[0]]:
-                    output[configProps[0]] = defaultConfigValues[configProps[0]]["value"]
-    except FileNotFoundError:
-        GenerateConfigFile("")
-        for defKey in defaultConfigValues:
-            output[defKey] = defaultConfigValues[defKey]["value"]
-    return output
+    return config.GetAll()
 
 def GenerateConfigFile(args):
     """
@@ -91,8 +222,8 @@ def GenerateConfigFile(args):
     """
     if not os.path.exists(resFolder):
         os.mkdir(resFolder)
-    f = open(configFilePath, mode='w')
-    for defKey in defaultConfigValues:
-        f.write("# " + defaultConfigValues[defKey]["description"] + "\n")
-        f.write(defKey + "=" + defaultConfigValues[defKey]["value"] + "\n")
+    with open(configFilePath, mode='w') as f:
+        for defKey in defaultConfigValues:
+            f.write("# " + defaultConfigValues[defKey]["description"] + "\n")
+            f.write(defKey + "=" + GetDefaultValue(defKey) + "\n")
     print("New adbepy.config file has been generated. Path: %s" % (os.path.abspath(configFilePath)))
@@ -0,0 +1,293 @@
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+# Commands which need the terminal (they run until CTRL+C or ask for confirmation), user's desktop session
+# (clipboard, file manager) or manage the daemon always run in the calling process
+inProcessCommands = [
+    "record-video", "record",
+    "clear-device-cache", "clear-cache", "clear", "cc",
+    "copy-devices", "dc", "dce",
+    "open-dir", "opendir",
+    "watch",
+    "monitor",
+    "perf",
+    "logcat",
+    "daemon",
+    "version", "v"
+]
+
+# How long client waits for the daemon to accept connection before running the command by itself
+connectTimeout = 0.5
+# How long 'daemon start' waits for the daemon to start listening
+startTimeout = 10
+# Commands print from engine's worker threads, messages must not be interleaved inside one json line
+sendLock = threading.Lock()
+
+
+def GetDaemonSocketPath():
+    """
+    Returns path of daemon's Unix socket. Can be overridden with ADBEPY_DAEMON_SOCKET environment variable
+    """
+    if os.environ.get("ADBEPY_DAEMON_SOCKET"):
+        return os.environ["ADBEPY_DAEMON_SOCKET"]
+    user = os.getuid() if hasattr(os, "getuid") else os.environ.get("USERNAME", "user")
+    return os.path.join(tempfile.gettempdir(), "adbepy-%s.sock" % (user))
+
+
+def IsDaemonSupported():
+    return hasattr(socket, "AF_UNIX")
+
+
+def SendMessage(connection, message):
+    data = json.dumps(message).encode("utf-8") + b"\n"
+    with sendLock:
+        connection.sendall(data)
+
+
+def ReadMessages(connection):
+    """
+    Yields messages (one json object per line) until connection is closed
+    """
+    with connection.makefile(mode="rb") as stream:
+        for line in stream:
+            yield json.loads(line.decode("utf-8"))
+
+
+def ConnectToDaemon():
+    """
+    Returns connected socket or None if daemon is not running
+    """
+    if not IsDaemonSupported():
+        return None
+    socketPath = GetDaemonSocketPath()
+    if not os.path.exists(socketPath):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(connectTimeout)
+    try:
+        connection.connect(socketPath)
+    except OSError:
+        connection.close()
+        return None
+    connection.settimeout(None)
+    return connection
+
+
+def SendRequest(request):
+    """
+    Sends request to the daemon and prints it's output as it comes.
+    Returns exit code of the request or None if daemon is not running
+    """
+    connection = ConnectToDaemon()
+    if connection is None:
+        return None
+    try:
+        SendMessage(connection, request)
+        for message in ReadMessages(connection):
+            if "out" in message:
+                sys.stdout.write(message["out"])
+                sys.stdout.flush()
+            elif "err" in message:
+                sys.stderr.write(message["err"])
+                sys.stderr.flush()
+            elif "exit" in message:
+                return message["exit"]
+    finally:
+        connection.close()
+    # daemon was stopped while running the request
+    return 1
+
+
+def GetCommandName(argv):
+    """
+    Returns subcommand name from adbe arguments (without script name) or None.
+    Global options (--profile, --trace-file FILE) can be given before the subcommand
+    """
+    index = 0
+    while index < len(argv) and argv[index].startswith("-"):
+        if argv[index] == "--trace-file":
+            index += 1
+        index += 1
+    return argv[index] if index < len(argv) else None
+
+
+def ForwardToDaemon(argv):
+    """
+    Runs adbe command (argv without script name) in the daemon if it is running.
+    Returns command's exit code or None if command has to be executed in this process
+    """
+    commandName = GetCommandName(argv)
+    if commandName is None or commandName in inProcessCommands:
+        return None
+    try:
+        return SendRequest({"argv": argv, "cwd": os.getcwd()})
+    except KeyboardInterrupt:
+        # closed connection makes the daemon stop the command as soon as it prints anything
+        print("\nInterrupted, started commands were stopped.")
+        return 1
+
+
+class DaemonOutput:
+    """
+    File-like object which sends everything written to it to the client as {key: text} messages
+    """
+
+    def __init__(self, connection, key):
+        self.__connection = connection
+        self.__key = key
+
+    def write(self, text):
+        if text:
+            SendMessage(self.__connection, {self.__key: text})
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def RunInDaemon(connection, func, *args):
+    """
+    Calls func(*args) with it's output redirected to the client
+    """
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = DaemonOutput(connection, "out")
+    sys.stderr = DaemonOutput(connection, "err")
+    try:
+        func(*args)
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+
+def RunRequest(createParser, runCommand, request, connection):
+    """
+    Parses and runs forwarded command with it's output redirected to the client. Returns exit code
+    """
+    stdout, stderr = sys.stdout, sys.stderr
+    workingDirectory = os.getcwd()
+    sys.stdout = DaemonOutput(connection, "out")
+    sys.stderr = DaemonOutput(connection, "err")
+    try:
+        os.chdir(request["cwd"])
+        argv = request["argv"]
+        args = createParser(argv).parse_args(argv)
+        runCommand(args)
+        return 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    except OSError as e:
+        if isinstance(e, (BrokenPipeError, ConnectionResetError)):
+            # client went away (ex. CTRL+C was pressed)
+            return 1
+        print("Error: %s" % (e), file=sys.stderr)
+        return 1
+    except Exception as e:
+        print("Error: %s" % (e), file=sys.stderr)
+        return 1
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        os.chdir(workingDirectory)
+
+
+def RunDaemon(createParser, runCommand):
+    """
+    Runs the daemon in this process until it is stopped with 'daemon stop'. Daemon keeps live device
+    inventory, open shell sessions, loaded lookup indexes and caches in memory, so forwarded commands
+    skip everything a new process would have to load and probe. Commands are executed one at a time,
+    other clients wait for their turn
+    """
+    from modules.deviceInventory import DeviceInventory
+    from modules.commands import SetDeviceInventory
+
+    socketPath = GetDaemonSocketPath()
+    if ConnectToDaemon() is not None:
+        print("ADBEpy daemon is already running")
+        return
+    if os.path.exists(socketPath):
+        # left by daemon which was killed
+        os.remove(socketPath)
+    inventory = DeviceInventory(isFullInfo=True)
+    inventory.Start()
+    SetDeviceInventory(inventory)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(socketPath)
+        server.listen(16)
+        print("ADBEpy daemon is listening on %s" % (socketPath))
+        while True:
+            connection, address = server.accept()
+            with connection:
+                try:
+                    request = next(ReadMessages(connection), None)
+                    if request is None:
+                        continue
+                    if request.get("stop"):
+                        SendMessage(connection, {"exit": 0})
+                        break
+                    if "clearCache" in request:
+                        from modules.commands import DeleteDeviceCache
+                        RunInDaemon(connection, DeleteDeviceCache, request["clearCache"])
+                        # devices probed before were filled from the deleted cache
+                        inventory.Reprobe()
+                        SendMessage(connection, {"exit": 0})
+                        continue
+                    if request.get("status"):
+                        states = inventory.GetStates()
+                        SendMessage(connection, {"out": "ADBEpy daemon is running (pid %d), %d devices tracked\n" % (os.getpid(), len(states))})
+                        SendMessage(connection, {"exit": 0})
+                        continue
+                    SendMessage(connection, {"exit": RunRequest(createParser, runCommand, request, connection)})
+                except (OSError, ValueError):
+                    # client went away or sent broken request
+                    pass
+    finally:
+        SetDeviceInventory(None)
+        inventory.Stop()
+        server.close()
+        if os.path.exists(socketPath):
+            os.remove(socketPath)
+
+
+def StartDaemon(scriptPath):
+    """
+    Starts daemon as a detached background process and waits until it accepts connections
+    """
+    from subprocess import Popen, DEVNULL
+    if ConnectToDaemon() is not None:
+        print("ADBEpy daemon is already running")
+        return
+    options = {}
+    if os.name == "posix":
+        options["start_new_session"] = True
+    Popen([sys.executable, scriptPath, "daemon", "run"], stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL, **options)
+    deadline = time.time() + startTimeout
+    while time.time() < deadline:
+        connection = ConnectToDaemon()
+        if connection is not None:
+            connection.close()
+            print("ADBEpy daemon started")
+            return
+        time.sleep(0.05)
+    print("ADBEpy daemon did not start in %s seconds" % (startTimeout))
+
+
+def StopDaemon():
+    if SendRequest({"stop": True}) is None:
+        print("ADBEpy daemon is not running")
+    else:
+        print("ADBEpy daemon stopped")
+
+
+def PrintDaemonStatus():
+    if SendRequest({"status": True}) is None:
+        print("ADBEpy daemon is not running")
@@ -0,0 +1,152 @@
+import os
+import signal
+import threading
+import time
+from subprocess import Popen, TimeoutExpired
+
+from modules.configs import ConfigDataFields, config
+
+# adb errors after which the same command usually succeeds if it is sent again a bit later
+transientErrors = [
+    "error: closed",
+    "error: protocol fault",
+    "device offline",
+    "device still connecting",
+    "device still authorizing",
+    "Connection reset by peer",
+    "cannot connect to daemon"
+]
+# Retry delays grow from retryBaseDelay twice every attempt, but never over retryMaxDelay (seconds)
+retryBaseDelay = 0.5
+retryMaxDelay = 4
+# How long to wait for killed process to exit
+processExitTimeout = 2
+# How often process is checked for being killed while waiting for it's output
+processPollInterval = 1
+
+# adb processes started from blocking code (DeviceData, shell sessions) by device serial, so they can be killed
+# when device's operation runs out of time. Dropped devices get no new processes until they are restored
+deviceProcesses = {}
+droppedDevices = set()
+deviceProcessesLock = threading.Lock()
+
+
+class CommandTimeoutError(Exception):
+    """
+    Raised when a command does not finish before it's deadline. Usually it means that device
+    (or it's USB connection) stopped responding
+    """
+    pass
+
+
+def GetTimeoutFromConfig(field):
+    """
+    Returns timeout in seconds or None if the field is 0 (no limit)
+    """
+    value = config.GetFloat(field)
+    if value is None or value <= 0:
+        return None
+    return value
+
+
+def GetCommandTimeout():
+    return GetTimeoutFromConfig(ConfigDataFields.command_timeout)
+
+
+def GetOperationTimeout():
+    return GetTimeoutFromConfig(ConfigDataFields.operation_timeout)
+
+
+def GetRetries():
+    value = config.GetInt(ConfigDataFields.retries)
+    if value is None:
+        return 0
+    return max(0, value)
+
+
+def GetRetryDelay(attempt):
+    """
+    Returns how many seconds to wait before retry number `attempt` (starting from 0)
+    """
+    return min(retryMaxDelay, retryBaseDelay * 2 ** attempt)
+
+
+def IsTransientError(output):
+    """
+    Checks adb output (bytes or str) for errors which are worth retrying
+    """
+    if isinstance(output, bytes):
+        output = output.decode("utf-8", "replace")
+    return any(error in output for error in transientErrors)
+
+
+def CommunicateWithDeadline(proc, timeout, description):
+    """
+    proc.communicate() which kills the process if it does not finish in `timeout` seconds (None - no limit)
+    and raises CommandTimeoutError. Returns (output, err)
+    """
+    endTime = None if timeout is None else time.monotonic() + timeout
+    while True:
+        waitTime = processPollInterval if endTime is None else min(processPollInterval, max(0, endTime - time.monotonic()))
+        try:
+            return proc.communicate(input=None, timeout=waitTime)
+        except TimeoutExpired:
+            if endTime is not None and time.monotonic() >= endTime:
+                break
+            # process was killed (see DropDevice), but it's children still hold the output open
+            if proc.poll() is not None and proc.returncode < 0:
+                raise CommandTimeoutError("'%s' was stopped, device is not responding" % (description))
+    proc.kill()
+    try:
+        proc.communicate(timeout=processExitTimeout)
+    except TimeoutExpired:
+        # pipes are still held by process' children, they are left to the OS
+        pass
+    raise CommandTimeoutError("'%s' did not finish in %s seconds" % (description, timeout))
+
+
+def StartDeviceProcess(serial, command, **options):
+    """
+    Popen which remembers the process for the device (see DropDevice). FinishDeviceProcess has to be called
+    once the process is done. Raises CommandTimeoutError if device was dropped
+    """
+    with deviceProcessesLock:
+        if serial in droppedDevices:
+            raise CommandTimeoutError("%s was dropped after it stopped responding" % (serial))
+        proc = Popen(command, **options)
+        deviceProcesses.setdefault(serial, []).append(proc)
+    return proc
+
+
+def FinishDeviceProcess(serial, proc):
+    with deviceProcessesLock:
+        processes = deviceProcesses.get(serial, [])
+        if proc in processes:
+            processes.remove(proc)
+
+
+def DropDevice(serial):
+    """
+    Kills all adb processes of the device and makes further commands to it fail at once,
+    so threads waiting for the device are released
+    """
+    with deviceProcessesLock:
+        droppedDevices.add(serial)
+        processes = deviceProcesses.pop(serial, [])
+    for proc in processes:
+        try:
+            if os.name == "posix" and os.getpgid(proc.pid) == proc.pid:
+                # process has it's own group (ex. shell session), children it started are killed too
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+        except OSError:
+            pass
+
+
+def RestoreDevices(serials):
+    """
+    Gives previously dropped devices another chance (ex. when a new command is started for them)
+    """
+    with deviceProcessesLock:
+        droppedDevices.difference_update(serials)
@@ -1,17 +1,85 @@
 from subprocess import Popen, PIPE, signal
 import os
 import re
+import shlex
+import threading
 
 from modules.webrequests import GetCPUHardwareData, UpdateSupportedDevices
 from modules.deviceCacher import GetCachedDeviceData, CacheDevice
 from modules.deviceInfoFormat import PrintError
+from modules.adbclient import GetNativeClient
+from modules.shellSession import GetShellSession, ShellSessionError
+from modules.marketNames import FindMarketName, SupportedDevicesFileExists
+from modules.tracing import Span
+from modules.deadlines import CommunicateWithDeadline, GetCommandTimeout, GetRetries, GetRetryDelay, IsTransientError, StartDeviceProcess, FinishDeviceProcess
 
 CPUHardwareData = {}
+CPUHardwareDataLoaded = False
+# Devices are probed from several threads, shared resources are downloaded only once
+cpuDataLock = threading.Lock()
+supportedDevicesLock = threading.Lock()
+# Increased every time supported_devices.csv is downloaded, so devices looked up in the same list download it only once
+supportedDevicesVersion = 0
+
+
+def UpdateSupportedDevicesOnce(seenVersion, message=None):
+    """
+    Downloads supported_devices.csv unless it was already downloaded by another thread since seenVersion
+    (value of supportedDevicesVersion before the lookup). Has to be called with supportedDevicesLock held
+    """
+    global supportedDevicesVersion
+    if supportedDevicesVersion != seenVersion:
+        return False
+    if message:
+        print(message)
+    UpdateSupportedDevices(None)
+    supportedDevicesVersion += 1
+    return True
 
 
 def SetCPUHardwareData():
-    global CPUHardwareData
-    CPUHardwareData = GetCPUHardwareData()
+    global CPUHardwareData, CPUHardwareDataLoaded
+    with cpuDataLock:
+        if not CPUHardwareDataLoaded:
+            CPUHardwareData = GetCPUHardwareData()
+            CPUHardwareDataLoaded = True
+
+
+def DecodeOutput(output):
+    """
+    Decodes adb command output. Some devices print in local encodings, so a few are tried
+    """
+    try:
+        return output.decode("utf-8").rstrip()
+    except UnicodeDecodeError:
+        try:
+            return output.decode("windows-1258").rstrip()
+        except UnicodeDecodeError:
+            return output.decode("ibm866").rstrip()
+
+
+def CheckCommandErrors(output, err):
+    """
+    Raises if command failed with "Permission denied", returns the error if it reports "Failure"
+    and decoded output otherwise
+    """
+    if "Permission denied" in err.decode("utf-8"):
+        raise Exception("Permission denied", err.decode("utf-8"))
+    elif "Failure" in err.decode("utf-8"): # in case error is printed in err (most of the time it is printed in output too)
+        return err.decode("utf-8").rstrip()
+    return DecodeOutput(output)
+
+
+def ParseGetpropOutput(getpropOutput):
+    """
+    Parses full 'getprop' listing into a dictionary. Every line of the listing is expected
+    to be in '[key]: [value]' format (value may span several lines)
+    """
+    properties = {}
+    getpropOutput = getpropOutput.replace("\r\n", "\n")
+    for matchObj in re.finditer(r"^\[([^\]]*)\]: \[(.*?)\]$", getpropOutput, flags=re.MULTILINE | re.DOTALL):
+        properties[matchObj.group(1)] = matchObj.group(2)
+    return properties
 
 
 class Amazon:
@@ -55,34 +123,77 @@ class DeviceData:
     __cpu_abi = ""
     __cpu_soc = ""
     __cpu_hardware = ""
+    # Snapshot of all device properties, loaded with a single getprop call
+    __properties = None
 
 
-    def __ExecuteCommand(self, command):
-        proc = Popen(command, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        output, err = proc.communicate(input=None, timeout=None)
-
-        if "Permission denied" in err.decode("utf-8"):
-            raise Exception("Permission denied", err.decode("utf-8"))
-        elif "Failure" in err.decode("utf-8"): # in case error is printed in err (most of the time it is printed in output too)
-            return err.decode("utf-8").rstrip()
-        try:
-            return output.decode("utf-8").rstrip()
-        except UnicodeDecodeError:
-            try:
-                return output.decode("windows-1258").rstrip()
-            except UnicodeDecodeError:
-                return output.decode("ibm866").rstrip()
+    def __ExecuteCommand(self, command, hasDeadline=True):
+        """
+        Runs adb command and returns it's decoded output. Command is killed and CommandTimeoutError is raised
+        if it takes longer than COMMAND_TIMEOUT (unless hasDeadline is False, ex. for file transfers).
+        Transient adb errors (device offline, connection closed...) are retried up to RETRIES times
+        """
+        from time import sleep
+        timeout = GetCommandTimeout() if hasDeadline else None
+        retries = GetRetries()
+        attempt = 0
+        while True:
+            result = None
+            with Span("adb", " ".join(command[3:]), command[2]) as span:
+                nativeClient = GetNativeClient()
+                if nativeClient is not None:
+                    result = nativeClient.ExecuteCommand(command, hasDeadline)
+                if result is not None:
+                    output, err = result
+                else:
+                    proc = StartDeviceProcess(command[2], command, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+                    try:
+                        output, err = CommunicateWithDeadline(proc, timeout, " ".join(command[3:]))
+                    finally:
+                        FinishDeviceProcess(command[2], proc)
+                span.AddBytes(output)
+                span.AddBytes(err)
+            if attempt >= retries or not IsTransientError(err):
+                break
+            sleep(GetRetryDelay(attempt))
+            attempt += 1
 
-    def __ExecuteCommandInterruptible(self, command):
-        proc = Popen(command, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        return CheckCommandErrors(output, err)
 
-        try:
-            proc.communicate(input=None, timeout=None)
-        except KeyboardInterrupt:
-            proc.terminate()
+    def __ExecuteShellCommand(self, arguments, hasDeadline=True):
+        """
+        Runs shell command through device's shell session, so no new adb process is started.
+        If session is disabled or broken, command is executed with a separate 'adb shell' call.
+        hasDeadline has to be False for commands which can take long on a healthy device (see __ExecuteCommand)
+        """
+        session = GetShellSession(self.__serial)
+        if session is not None:
+            try:
+                output, exitCode = session.Run(" ".join(arguments), GetCommandTimeout() if hasDeadline else None)
+                if exitCode != 0:
+                    # session merges stderr into output, so errors of failed commands are looked for in it
+                    return CheckCommandErrors(output, output)
+                return DecodeOutput(output)
+            except ShellSessionError:
+                pass
+        return self.__ExecuteCommand(["adb", "-s", self.__serial, "shell"] + arguments, hasDeadline)
+
+    def __LoadProperties(self):
+        self.__properties = ParseGetpropOutput(self.__ExecuteShellCommand(["getprop"]))
+
+    def __GetProperty(self, key):
+        """
+        Returns device property from the getprop snapshot. Snapshot is taken on the first call
+        """
+        if self.__properties is None:
+            self.__LoadProperties()
+        if len(self.__properties) == 0:
+            # snapshot could not be parsed, ask for the property directly
+            return self.__ExecuteShellCommand(["getprop", key])
+        return self.__properties.get(key, "").rstrip()
 
     def __SetGPU(self):
-        data = self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "dumpsys", "SurfaceFlinger"])
+        data = self.__ExecuteShellCommand(["dumpsys", "SurfaceFlinger"])
         matchObj = re.search(r"(GLES: )(.+ [\w+-]+ .\..)", data, flags=0)
         # Expected output: "GLES: Qualcomm, Adreno (TM) 540, OpenGL ES 3.2"
         # "GLES: " is in the first group, everything else belongs to second
@@ -92,8 +203,8 @@ class DeviceData:
         self.__gpu_gles = elements[2]
 
     def __SetCPUHardware(self):
-        getprop = self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "getprop", "ro.product.board"])
-        procCpuInfo = self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "cat", "/proc/cpuinfo"])
+        getprop = self.__GetProperty("ro.product.board")
+        procCpuInfo = self.__ExecuteShellCommand(["cat", "/proc/cpuinfo"])
         matchObj = re.search(r"Hardware.+ ([\w\-]+)", procCpuInfo, flags=0)
         hardwareLine = ""
         if matchObj:
@@ -107,7 +218,7 @@ class DeviceData:
         else:
             realBoard = getprop
         # if CPU Data is not set yet - download it
-        if len(CPUHardwareData) == 0:
+        if not CPUHardwareDataLoaded:
             SetCPUHardwareData()
         if realBoard.lower() in CPUHardwareData:
             self.__cpu_soc = CPUHardwareData[realBoard.lower()]["SoC"]
@@ -118,11 +229,11 @@ class DeviceData:
 
     def __SetCPU(self):
         self.__SetCPUHardware()
-        self.__cpu_abi = self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "getprop", "ro.product.cpu.abi"])
+        self.__cpu_abi = self.__GetProperty("ro.product.cpu.abi")
 
     def __SetDeviceNames(self):
-        self.__manuf = self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "getprop", "ro.product.manufacturer"]).title()
-        self.__model_code = self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "getprop", "ro.product.model"])
+        self.__manuf = self.__GetProperty("ro.product.manufacturer").title()
+        self.__model_code = self.__GetProperty("ro.product.model")
         if self.__manuf.lower() == 'amazon':
             try:
                 self.__market_name = Amazon.devices[self.__model_code]
@@ -131,49 +242,26 @@ class DeviceData:
                 self.__market_name = "UNKNOWN"
                 return
 
-        tProductName = self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "getprop", "ro.product.name"])
-        tProductDevice = self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "getprop", "ro.product.device"])
+        tProductName = self.__GetProperty("ro.product.name")
+        tProductDevice = self.__GetProperty("ro.product.device")
         
+        seenVersion = supportedDevicesVersion
         self.__SetMarketName(tProductName, tProductDevice)
         if(self.__market_name == "-"):
-            # If failed to set the name, update CSV file and check if it exists by then
-            print("Certain device name was not found, updating supported devices list")
-            UpdateSupportedDevices(None)
+            # If failed to set the name, update CSV file (unless other device already did) and check if it exists by then
+            with supportedDevicesLock:
+                UpdateSupportedDevicesOnce(seenVersion, "Certain device name was not found, updating supported devices list")
             self.__SetMarketName(tProductDevice, tProductDevice)
 
 
 
     def __SetMarketName(self, tProductName, tProductDevice):
-        supportedDevicesPth = "../res/supported_devices.csv"
-        scriptPath = os.path.dirname(__file__)
-        targetPath = os.path.join(scriptPath, supportedDevicesPth)
-        checkDeviceRange = False
-        try:
-            f = open(targetPath, mode='r', buffering=-1, encoding="UTF-16")
-        except FileNotFoundError:
-            from modules.webrequests import UpdateSupportedDevices
-            UpdateSupportedDevices("")
-            f = open(targetPath, mode='r', buffering=-1, encoding="UTF-16")
-        for line in f:
-            # Cache the line split since we use it a few times
-            splitLine = line.split(",")
-            tempName = '-'
-            if self.__manuf.lower() in splitLine[0].lower():
-                checkDeviceRange = True
-                if self.__model_code.lower() == splitLine[3].strip().lower():
-                    if(splitLine[1]):
-                        self.__market_name = splitLine[1]
-                        break
-                if self.__model_code.lower() in splitLine[3].lower():
-                    tempName = splitLine[1]
-                if tProductName.lower() in line.lower():
-                    tempName = splitLine[1]
-                if tProductDevice.lower() == splitLine[2].lower():
-                    tempName = splitLine[1]
-            if checkDeviceRange and not self.__manuf.lower() in splitLine[0].lower():
-                self.__market_name = tempName
-                break
-        f.close()
+        with Span("market-name", "%s %s" % (self.__manuf, self.__model_code), self.__serial or None):
+            if not SupportedDevicesFileExists():
+                with supportedDevicesLock:
+                    if not SupportedDevicesFileExists():
+                        UpdateSupportedDevicesOnce(supportedDevicesVersion)
+            self.__market_name = FindMarketName(self.__manuf, self.__model_code, tProductName, tProductDevice)
 
 
     def __SetDataFromDictionary(self, dictData):
@@ -197,8 +285,8 @@ class DeviceData:
         * Android OS version
         * Fingerprint
         """
-        os_ver = self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "getprop", "ro.build.version.release"])
-        fingerprint = self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "getprop", "ro.build.fingerprint"])
+        os_ver = self.__GetProperty("ro.build.version.release")
+        fingerprint = self.__GetProperty("ro.build.fingerprint")
         dataWasChanged = False
         if self.__os_ver != os_ver: 
             self.__os_ver = os_ver
@@ -212,7 +300,7 @@ class DeviceData:
 
 
     def __SetBatteryData(self):
-        batterydump = self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "dumpsys", "battery"])
+        batterydump = self.__ExecuteShellCommand(["dumpsys", "battery"])
         matchObj = re.search(r"level: (\d+)", batterydump, flags=0)
         self.__battery_level = matchObj.group(1)
         matchObj = re.search(r"temperature: (\d+)", batterydump, flags=0)
@@ -247,18 +335,24 @@ class DeviceData:
         # If device is not cached or cached version != isIndepthInfo
         self.__serial = deviceID
         self.__SetDeviceNames()
-        self.__os_ver = self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "getprop", "ro.build.version.release"])
+        self.__os_ver = self.__GetProperty("ro.build.version.release")
         if isIndepthInfo == True:
             self.__SetBatteryData()
             self.__SetGPU()
             self.__SetCPU()
-            self.__fingerprint = self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "getprop", "ro.build.fingerprint"])
+            self.__fingerprint = self.__GetProperty("ro.build.fingerprint")
         CacheDevice(self.GetFullDeviceData(), isIndepthInfo)
 
 
 # public methods
 
 
+    def RefreshBatteryData(self):
+        """
+        Reads battery level and temperature again. Used for devices which are kept alive between commands
+        """
+        self.__SetBatteryData()
+
     def GetFullDeviceData(self):
         """
         Returns dictionary with device's values. Dictionary keys:\n
@@ -294,14 +388,11 @@ class DeviceData:
             "battery_temp": self.__battery_temp
         }
 
-    def InstallApk(self, apkPath):
+    def ReportInstallResult(self, res):
         """
-        Installs an apk from apkPath on a device.
-        If installation fails, message with an error is printed and function returns "False"
-        otherwise, if installation succeeds - return "True"
+        Checks 'adb install' output. If installation failed, prints the reason and returns "False"
         """
         isInstalled = True
-        res = self.__ExecuteCommand(["adb", "-s", self.__serial, "install", "-r", apkPath])
         matchObj = re.search(r"Failure ([*[A-Z_0-9]+])", res, flags=0)
         if matchObj is not None:
             # If an error occured - print it to the user
@@ -312,11 +403,33 @@ class DeviceData:
             isInstalled = False
         return isInstalled
 
+    def GetInstalledAppIdentity(self, bundleID):
+        """
+        Returns (versionCode, sha256 digest of installed apk) of the application.
+        Values are empty strings if the app is not installed or they can not be read
+        (ex. app is installed as split apks or device has no sha256sum)
+        """
+        # bundle id comes from the apk, so it is quoted before it is put into the shell script
+        output = self.__ExecuteShellCommand(["dumpsys package %s | grep versionCode=; for apk in $(pm path %s); do sha256sum ${apk#package:}; done"
+            % (shlex.quote(bundleID), shlex.quote(bundleID))])
+        versionCode = ""
+        digests = []
+        for line in output.splitlines():
+            matchObj = re.search(r"versionCode=(\d+)", line, flags=0)
+            if matchObj is not None and not versionCode:
+                versionCode = matchObj.group(1)
+            matchObj = re.match(r"([0-9a-f]{64})\s", line.strip() + " ", flags=0)
+            if matchObj is not None:
+                digests.append(matchObj.group(1))
+        if len(digests) != 1:
+            return versionCode, ""
+        return versionCode, digests[0]
+
     def LaunchApk(self, bundleID, mainActivity):
-        self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "am", "start", "-n", bundleID + "/" + mainActivity])
+        self.__ExecuteShellCommand(["am", "start", "-n", shlex.quote(bundleID + "/" + mainActivity)])
 
     def GetThirdPartyApps(self):
-        apps = self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "pm", "list", "packages", "-3"]).split("package:")
+        apps = self.__ExecuteShellCommand(["pm", "list", "packages", "-3"]).split("package:")
         del apps[0]
         output = []
         for app in apps:
@@ -324,25 +437,37 @@ class DeviceData:
         return output
 
     def TurnOff(self):
+        return self.ReportTurnOffResult(self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "reboot", "-p"]))
+
+    def ReportTurnOffResult(self, output):
         cachedName = self.GetPrintableDeviceName()
-        output = self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "reboot", "-p"])
         if "reboot" in output:
             return "Failed to turn off " + cachedName
         else:
             return cachedName + " turned off"
 
-    def RemoveApp(self, appBundleID):
+    def RemoveApps(self, appBundleIDs):
         """
-        Uninstall specific application
+        Uninstalls all given applications with a single shell command ('pm uninstall' for each of them).
+        Returns dictionary where key is bundle id and value is 'pm uninstall' result (ex. "Success")
         """
-        self.__ExecuteCommand(["adb", "-s", self.__serial, "uninstall", appBundleID])
+        if len(appBundleIDs) == 0:
+            return {}
+        script = 'for app in %s; do echo "$app $(pm uninstall "$app" 2>&1)"; done' % (" ".join(shlex.quote(appBundleID) for appBundleID in appBundleIDs))
+        # uninstalling many apps takes long, the whole purge is still limited by OPERATION_TIMEOUT
+        output = self.__ExecuteShellCommand([script], hasDeadline=False)
+        results = {}
+        for line in output.splitlines():
+            lineParts = line.strip().split(" ", 1)
+            if lineParts[0] in appBundleIDs:
+                results[lineParts[0]] = lineParts[1].strip() if len(lineParts) > 1 else ""
+        for appBundleID in appBundleIDs:
+            results.setdefault(appBundleID, "No result")
+        return results
 
     def GetDeviceID(self):
         return self.__serial
 
-    def GetDeviceSerial(self):
-        return self.GetDeviceID()
-
     def GetDeviceName(self):
         return [self.__manuf, self.__market_name, self.__model_code]
 
@@ -354,28 +479,9 @@ class DeviceData:
             os.makedirs(saveLocation)
             print("Created folder " + os.path.abspath(saveLocation))
 
-    def TakeScreenshot(self, screenshotName, saveLocation):
-        self.__PathExists(saveLocation)
-
-        screenshotName = screenshotName + "_" + self.__serial + ".png"
-        self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "screencap", "-p", "/sdcard/screen.png"])
-        self.__ExecuteCommand(["adb", "-s", self.__serial, "pull", "/sdcard/screen.png", os.path.join(saveLocation, screenshotName)])
-        self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "rm", "/sdcard/screen.png"])
-        return "Screenshot saved as: " + os.path.abspath(os.path.join(saveLocation, screenshotName))
-
-    def RecordVideo(self, videoName, saveLocation, recordingResolution):
+    def GetScreenshotPath(self, screenshotName, saveLocation):
+        """
+        Returns path where device's screenshot should be saved. Creates saveLocation if it does not exist
+        """
         self.__PathExists(saveLocation)
-
-        # Xiaomi workaround. It doesn't like naming the files the same way every time.
-        import random
-        saveName = str(random.randrange(50))
-        
-        videoName = videoName + "_" + self.__serial + ".mp4"
-        print("\nRecording. Press CTRL+C to stop and save the video.\n")
-        self.__ExecuteCommandInterruptible(["adb", "-s", self.__serial, "shell", "screenrecord", "--bugreport", "--size " + recordingResolution, "/sdcard/" + saveName + ".mp4"])
-        print("Saving.. Please wait.")
-        from time import sleep
-        sleep(5)  # Sleeping before pulling is needed so that the video is created
-        self.__ExecuteCommand(["adb", "-s", self.__serial, "pull", "/sdcard/" + saveName +".mp4", os.path.join(saveLocation, videoName)])
-        self.__ExecuteCommand(["adb", "-s", self.__serial, "shell", "rm", "/sdcard/" + saveName + ".mp4"])
-        return "Video saved as: " + os.path.abspath(os.path.join(saveLocation, videoName))
+        return os.path.abspath(os.path.join(saveLocation, screenshotName + "_" + self.__serial + ".png"))
@@ -1,36 +1,87 @@
-import pickle
+import sqlite3
+import threading
 import os
 from os import path
 
-dcachePath = "../res/dcache/"
-scriptPath = path.dirname(__file__)
-dcachePath = path.join(scriptPath, dcachePath)
+from modules.configs import resFolder
+from modules.tracing import Span
+from modules.deviceInfoFormat import PrintError
+
+dcachePath = path.join(resFolder, "dcache.db")
+# Folder with one pickle file per device, used by older ADBEpy versions
+legacyDcachePath = path.join(resFolder, "dcache/")
+# Increase when SerializedDeviceData fields change. Store with other version is recreated
+schemaVersion = 1
+
 
 class SerializedDeviceData:
-    isFullData = False
-    serial = ""
-    # General
-    manuf = ""
-    model_code = ""
-    market_name = ""
-    os_ver = ""
-    fingerprint = ""
-    # GPU info
-    gpu_renderer = ""
-    gpu_manufacturer = ""
-    gpu_gles = ""
-    # CPU info
-    cpu_abi = ""
-    cpu_soc = ""
-    cpu_hardware = ""
-    
+    __slots__ = ("isFullData", "serial", "manuf", "model_code", "market_name", "os_ver", "fingerprint",
+                 "gpu_renderer", "gpu_manufacturer", "gpu_gles", "cpu_abi", "cpu_soc", "cpu_hardware")
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+
+    def ToRow(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+
+cacheConnection = None
+cachedDevices = None
+cacheLock = threading.RLock()
+
+
+def GetCacheConnection():
+    """
+    Opens device cache store (src/res/dcache.db) once per process. Store is created if it does not exist
+    """
+    global cacheConnection
+    if cacheConnection is None:
+        directory = path.dirname(dcachePath)
+        if not path.exists(directory):
+            os.makedirs(directory)
+        connection = sqlite3.connect(dcachePath, check_same_thread=False)
+        if connection.execute("PRAGMA user_version").fetchone()[0] != schemaVersion:
+            with connection:
+                connection.execute("DROP TABLE IF EXISTS devices")
+                connection.execute("CREATE TABLE devices (isFullData INTEGER, serial TEXT PRIMARY KEY, manuf TEXT, "
+                                   "model_code TEXT, market_name TEXT, os_ver TEXT, fingerprint TEXT, gpu_renderer TEXT, "
+                                   "gpu_manufacturer TEXT, gpu_gles TEXT, cpu_abi TEXT, cpu_soc TEXT, cpu_hardware TEXT)")
+                connection.execute("PRAGMA user_version = %d" % (schemaVersion))
+        cacheConnection = connection
+    return cacheConnection
+
+
+def LoadCachedDevices():
+    """
+    Loads all cached devices with a single read and keeps them in memory.
+    Returns dictionary where key is device serial and value is SerializedDeviceData
+    """
+    global cachedDevices
+    with cacheLock:
+        if cachedDevices is None:
+            with Span("cache", "read device cache"):
+                try:
+                    rows = GetCacheConnection().execute("SELECT * FROM devices").fetchall()
+                except sqlite3.Error:
+                    rows = []
+                cachedDevices = {row[1]: SerializedDeviceData(*row) for row in rows}
+        return cachedDevices
+
+
+def FindCachedDevices(serialPrefix):
+    """
+    Returns sorted serial numbers of cached devices which start with serialPrefix
+    """
+    return sorted(serial for serial in LoadCachedDevices() if serial.startswith(serialPrefix))
+
 
 def GetCachedDeviceData(fname):
     """
-    Gets cached device and returns as a deserialized dictionary with isFullData and actual device data (example is given below). 
-    All serialized data is expected to be saved inside /src/res/dcache/ folder (folder is created when saving first object). 
-    If object does not exist, this function returns `None`
-    fname - file name. by default, device names are device serial numbers (without any extension)
+    Gets cached device and returns as a deserialized dictionary with isFullData and actual device data (example is given below).
+    All devices are kept in a single store (/src/res/dcache.db) which is read once per process.
+    If device is not cached, this function returns `None`
+    fname - device serial number
 
     Example of returned device data:
     ```
@@ -44,69 +95,79 @@ def GetCachedDeviceData(fname):
     }
     ```
     """
-    try:
-        with open(path.join(dcachePath, fname), mode="rb") as binaryFile:
-            deserializedObj = pickle.load(binaryFile)
-            return {
-                "isFullData": deserializedObj.isFullData,
-                "deviceData": {
-                    "serial": deserializedObj.serial,
-                    "manufa": deserializedObj.manuf,
-                    "model_code": deserializedObj.model_code,
-                    "market_name": deserializedObj.market_name,
-                    "os": deserializedObj.os_ver,
-                    "fingerprint": deserializedObj.fingerprint,
-                    "gpu_renderer": deserializedObj.gpu_renderer,
-                    "gpu_manufa": deserializedObj.gpu_manufacturer,
-                    "gpu_gles": deserializedObj.gpu_gles,
-                    "cpu_abi": deserializedObj.cpu_abi,
-                    "cpu_soc": deserializedObj.cpu_soc,
-                    "cpu_hardware": deserializedObj.cpu_hardware
-                }
-            }
-    except IOError:
-        return None
-    except pickle.UnpicklingError:
+    deserializedObj = LoadCachedDevices().get(fname)
+    if deserializedObj is None:
         return None
+    return {
+        "isFullData": bool(deserializedObj.isFullData),
+        "deviceData": {
+            "serial": deserializedObj.serial,
+            "manufa": deserializedObj.manuf,
+            "model_code": deserializedObj.model_code,
+            "market_name": deserializedObj.market_name,
+            "os": deserializedObj.os_ver,
+            "fingerprint": deserializedObj.fingerprint,
+            "gpu_renderer": deserializedObj.gpu_renderer,
+            "gpu_manufa": deserializedObj.gpu_manufacturer,
+            "gpu_gles": deserializedObj.gpu_gles,
+            "cpu_abi": deserializedObj.cpu_abi,
+            "cpu_soc": deserializedObj.cpu_soc,
+            "cpu_hardware": deserializedObj.cpu_hardware
+        }
+    }
 
 
-def SaveCachedDevice(objToSerialize, fname):
+def SaveCachedDevice(objToSerialize):
     """
-    Saves `objToSerialize` with `fname` into /src/res/dcache/fname file
-    If folder does not exist - this function will create it
+    Saves `objToSerialize` into the device cache store. Each save is a separate transaction,
+    so the store never contains half written device. If the store can't be written (locked or corrupt),
+    error is printed and device is kept cached only in memory
     """
-    if not os.path.exists(dcachePath):
-        os.makedirs(dcachePath)
-    with open(path.join(dcachePath, fname), mode="wb") as dataFile:
-        dataFile = pickle.dump(objToSerialize, dataFile)
-    
+    with cacheLock, Span("cache", "write device cache", objToSerialize.serial):
+        try:
+            connection = GetCacheConnection()
+            with connection:
+                connection.execute("INSERT OR REPLACE INTO devices VALUES (%s)" % (", ".join("?" * len(SerializedDeviceData.__slots__))),
+                                   objToSerialize.ToRow())
+        except sqlite3.Error as e:
+            PrintError("Device %s was not saved to device cache %s: %s" % (objToSerialize.serial, dcachePath, e))
+        LoadCachedDevices()[objToSerialize.serial] = objToSerialize
 
-def DeleteCachedDevice(toDelete):
-    files = os.listdir(path.abspath(dcachePath))
-    filePath = path.abspath(path.join(dcachePath, toDelete))
 
-    for fileName in files:
-        if fileName.startswith(toDelete):
-            filePath = path.abspath(path.join(dcachePath, fileName))
-            os.remove(filePath)
-            return "Deleted " + fileName + " from the cache"
-    
-    return "File " + toDelete + " does not exist in cache directory so nothing was deleted."
+def DeleteCachedDevice(toDelete):
+    with cacheLock:
+        matchingSerials = FindCachedDevices(toDelete)
+        if len(matchingSerials) == 0:
+            return "Device " + toDelete + " does not exist in cache so nothing was deleted."
+        serial = matchingSerials[0]
+        connection = GetCacheConnection()
+        with connection:
+            connection.execute("DELETE FROM devices WHERE serial = ?", (serial,))
+        del LoadCachedDevices()[serial]
+        return "Deleted " + serial + " from the cache"
 
 
 def DeleteCacheDir():
     import shutil
-    cachePath = path.abspath(dcachePath)
-    if path.exists(cachePath):
-        shutil.rmtree(cachePath)
-        return "Deleted cache directory " + cachePath
-    else:
-        return "Directory " + cachePath + " does not exist so nothing was deleted."
+    global cacheConnection, cachedDevices
+    with cacheLock:
+        if cacheConnection is not None:
+            cacheConnection.close()
+            cacheConnection = None
+        cachedDevices = None
+        if path.exists(path.abspath(legacyDcachePath)):
+            shutil.rmtree(path.abspath(legacyDcachePath))
+        cachePath = path.abspath(dcachePath)
+        if path.exists(cachePath):
+            os.remove(cachePath)
+            return "Deleted device cache " + cachePath
+        else:
+            return "Device cache " + cachePath + " does not exist so nothing was deleted."
 
 
 def CacheDevice(deviceData, isFullData):
     """
-    Generates data to serialize and saves it as byte array in a file
+    Generates data to serialize and saves it in the device cache store
     deviceData - dictionary with device data (expected `DeviceData.GetFullDeviceData()`)
     isFullData - is data sent via deviceData variable full (all fields are written).
     """
@@ -125,5 +186,4 @@ def CacheDevice(deviceData, isFullData):
     dataToSerialize.cpu_abi = deviceData["cpu_abi"]
     dataToSerialize.cpu_soc = deviceData["cpu_soc"]
     dataToSerialize.cpu_hardware = deviceData["cpu_hardware"]
-    SaveCachedDevice(dataToSerialize, dataToSerialize.serial)
-
+    SaveCachedDevice(dataToSerialize)
@@ -1,5 +1,4 @@
 import sys
-from colorama import init, AnsiToWin32, Fore, Back, Style
 
 
 def FormatEssentialDeviceInfo(device, includeBatteryInfo):
@@ -67,6 +66,7 @@ def PrintInfoTable(deviceInfo, columnTitles):
                     infoEntry) + additionalSpace
             i += 1
 
+    from colorama import init, AnsiToWin32, Fore, Back, Style
     init(wrap=False)
     stream = AnsiToWin32(sys.stdout).stream
 
@@ -111,6 +111,7 @@ def PrintInfoTable(deviceInfo, columnTitles):
 
 
 def PrintError(message):
+    from colorama import init, AnsiToWin32, Fore
     init(wrap=False)
     stream = AnsiToWin32(sys.stdout).stream
     print("%s%s%s" % (Fore.RED, message, Fore.RESET), file=stream)
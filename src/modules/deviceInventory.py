@@ -0,0 +1,188 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import Popen, PIPE, DEVNULL
+
+from modules.device import DeviceData
+from modules.adbclient import GetNativeClient, AdbError, ParseDevicesListing
+from modules.shellSession import CloseShellSession
+from modules.executionEngine import GetLimitFromConfig
+from modules.configs import ConfigDataFields
+
+# How long to wait before reconnecting when adb server goes away
+reconnectDelay = 1
+
+
+class InventoryEvents:
+    attached = "attached"   # device is probed and ready, payload is DeviceData
+    detached = "detached"   # payload is DeviceData (None if device was not probed yet)
+    changed = "changed"     # device is connected but not usable (unauthorized, offline...), payload is state
+    failed = "failed"       # probing failed, payload is the exception
+
+
+class DeviceInventory:
+    """
+    Live list of connected devices kept up to date by adb server's track-devices stream, so devices
+    are discovered once instead of running 'adb devices' and probing them again for every command.
+    Newly attached devices are probed in the background (at most PROBE_WORKERS at the same time).
+    onEvent(event, serial, payload) is called for every InventoryEvents event from inventory threads
+    """
+
+    def __init__(self, onEvent=None, isFullInfo=True):
+        self.__onEvent = onEvent
+        self.__isFullInfo = isFullInfo
+        self.__condition = threading.Condition()
+        self.__states = {}
+        self.__devices = {}
+        self.__probes = {}
+        self.__isListed = False
+        self.__probePool = ThreadPoolExecutor(max_workers=GetLimitFromConfig(ConfigDataFields.probe_workers))
+        self.__stopEvent = threading.Event()
+        self.__closeStream = None
+        self.__trackThread = None
+
+    def Start(self):
+        self.__trackThread = threading.Thread(target=self.__Track, name="adbe-track-devices", daemon=True)
+        self.__trackThread.start()
+
+    def Stop(self):
+        self.__stopEvent.set()
+        closeStream = self.__closeStream
+        if closeStream is not None:
+            closeStream()
+        self.__probePool.shutdown(wait=False)
+
+    def GetDevices(self):
+        """
+        Returns probed devices in the order adb server lists them (same order as 'adb devices' prints),
+        not in the order their probing finished
+        """
+        with self.__condition:
+            return [self.__devices[serial] for serial in self.__states if serial in self.__devices]
+
+    def Reprobe(self):
+        """
+        Forgets probed devices and probes all connected devices again (ex. after device cache was cleared)
+        """
+        with self.__condition:
+            self.__devices.clear()
+            for serial, state in self.__states.items():
+                if state == "device":
+                    self.__StartProbe(serial)
+            self.__condition.notify_all()
+
+    def GetDevice(self, serial):
+        with self.__condition:
+            return self.__devices.get(serial)
+
+    def GetStates(self):
+        """
+        Returns dictionary of serial -> state (device, unauthorized, offline...) of everything adb server lists
+        """
+        with self.__condition:
+            return dict(self.__states)
+
+    def WaitUntilReady(self, timeout=None):
+        """
+        Waits until devices are listed and all attached devices are probed. Returns False on timeout
+        """
+        with self.__condition:
+            return self.__condition.wait_for(lambda: self.__isListed and not self.__probes, timeout)
+
+    def __Emit(self, event, serial, payload):
+        if self.__onEvent is not None:
+            self.__onEvent(event, serial, payload)
+
+    def __OpenStream(self):
+        """
+        Returns (readExactly, close) functions of track-devices stream. Native client is used if possible,
+        otherwise 'adb track-devices' which prints the same length prefixed stream
+        """
+        nativeClient = GetNativeClient()
+        if nativeClient is not None:
+            try:
+                connection = nativeClient.TrackDevices()
+                return connection.ReadExactly, connection.Close
+            except (OSError, AdbError):
+                pass
+        proc = Popen(["adb", "track-devices"], stdin=DEVNULL, stdout=PIPE, stderr=DEVNULL)
+
+        def ReadExactly(size):
+            data = proc.stdout.read(size)
+            if len(data) < size:
+                raise AdbError("'adb track-devices' was stopped")
+            return data
+
+        def Close():
+            proc.kill()
+            proc.wait()
+        return ReadExactly, Close
+
+    def __Track(self):
+        while not self.__stopEvent.is_set():
+            try:
+                readExactly, self.__closeStream = self.__OpenStream()
+                if self.__stopEvent.is_set():
+                    self.__closeStream()
+                    return
+                while True:
+                    length = int(readExactly(4), 16)
+                    self.__Update(ParseDevicesListing(readExactly(length).decode("utf-8", "replace")))
+            except (OSError, AdbError, ValueError):
+                if self.__stopEvent.is_set():
+                    return
+                # adb server was stopped, it's devices are gone until it lists them again
+                self.__Update([])
+                self.__stopEvent.wait(reconnectDelay)
+
+    def __Update(self, listing):
+        if self.__stopEvent.is_set():
+            return
+        states = dict(listing)
+        events = []
+        with self.__condition:
+            previousStates = self.__states
+            self.__states = states
+            self.__isListed = True
+            for serial in previousStates:
+                if serial not in states:
+                    self.__probes.pop(serial, None)
+                    events.append((InventoryEvents.detached, serial, self.__devices.pop(serial, None)))
+            for serial, state in states.items():
+                if previousStates.get(serial) == state:
+                    continue
+                if state == "device":
+                    self.__StartProbe(serial)
+                else:
+                    self.__probes.pop(serial, None)
+                    self.__devices.pop(serial, None)
+                    events.append((InventoryEvents.changed, serial, state))
+            self.__condition.notify_all()
+        for event, serial, payload in events:
+            if event == InventoryEvents.detached:
+                CloseShellSession(serial)
+            self.__Emit(event, serial, payload)
+
+    def __StartProbe(self, serial):
+        """
+        Probes device in the background. Has to be called with self.__condition held
+        """
+        future = self.__probePool.submit(DeviceData, serial, self.__isFullInfo)
+        self.__probes[serial] = future
+        future.add_done_callback(lambda future, serial=serial: self.__OnProbed(serial, future))
+
+    def __OnProbed(self, serial, future):
+        with self.__condition:
+            if self.__probes.get(serial) is not future:
+                # device was detached while it was probed
+                return
+            del self.__probes[serial]
+            error = None if future.cancelled() else future.exception()
+            if error is None and not future.cancelled():
+                self.__devices[serial] = future.result()
+            self.__condition.notify_all()
+        if future.cancelled():
+            return
+        if error is not None:
+            self.__Emit(InventoryEvents.failed, serial, error)
+        else:
+            self.__Emit(InventoryEvents.attached, serial, future.result())
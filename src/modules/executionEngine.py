@@ -0,0 +1,286 @@
+import asyncio
+import functools
+import os
+import signal
+from asyncio.subprocess import PIPE, DEVNULL
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.configs import ConfigDataFields, config
+from modules.shellSession import GetShellSession, ShellSessionError
+from modules.deviceInfoFormat import PrintError
+from modules.tracing import Span
+from modules.deadlines import CommandTimeoutError, GetCommandTimeout, GetOperationTimeout, GetRetries, GetRetryDelay, IsTransientError, DropDevice, RestoreDevices
+
+streamChunkSize = 64 * 1024
+# How long to wait for killed process to exit
+processExitTimeout = 2
+
+
+def GetLimitFromConfig(field):
+    value = config.GetInt(field)
+    if value is None:
+        return 1
+    return max(1, value)
+
+
+class ExecutionEngine:
+    """
+    Runs adb commands for many devices at once on a single asyncio loop.
+    maxParallel limits how many commands run at the same time in total and maxPerDevice
+    limits it for a single device (so one device is not flooded with commands).
+    Engine has to be created inside running event loop (RunOnDevices does that)
+    """
+
+    def __init__(self, maxParallel, maxPerDevice):
+        self.__globalLimit = asyncio.Semaphore(maxParallel)
+        self.__maxPerDevice = maxPerDevice
+        self.__deviceLimits = {}
+        # blocking calls (DeviceData methods) are run in a bounded pool instead of thread per device
+        self.__threadPool = ThreadPoolExecutor(max_workers=maxParallel)
+        self.__stopEvent = asyncio.Event()
+        self.__catchesInterrupt = False
+
+    def CatchInterrupt(self):
+        """
+        Makes CTRL+C set engine's stop flag (see WaitForStop) instead of cancelling all jobs, so long
+        running jobs can finish their work. Not supported on Windows, there CTRL+C still cancels jobs
+        """
+        try:
+            asyncio.get_event_loop().add_signal_handler(signal.SIGINT, self.__stopEvent.set)
+            self.__catchesInterrupt = True
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    def IsStopRequested(self):
+        return self.__stopEvent.is_set()
+
+    async def WaitForStop(self):
+        await self.__stopEvent.wait()
+
+    def __GetDeviceLimit(self, serial):
+        if serial not in self.__deviceLimits:
+            self.__deviceLimits[serial] = asyncio.Semaphore(self.__maxPerDevice)
+        return self.__deviceLimits[serial]
+
+    async def __StartAdb(self, serial, arguments):
+        options = {}
+        if self.__catchesInterrupt and os.name == "posix":
+            # keep CTRL+C away from adb processes, engine stops them itself
+            options["start_new_session"] = True
+        return await asyncio.create_subprocess_exec("adb", "-s", serial, *arguments, stdin=DEVNULL, stdout=PIPE, stderr=PIPE, **options)
+
+    async def RunAdb(self, serial, arguments, hasDeadline=True):
+        """
+        Runs 'adb -s serial arguments...' and returns (returnCode, output, err). Output and err are bytes.
+        If the task is cancelled (ex. CTRL+C was pressed) adb process is killed.
+        If command takes longer than COMMAND_TIMEOUT, adb is killed and CommandTimeoutError is raised. hasDeadline
+        has to be False for commands which can run long on a healthy device (file transfers, recordings).
+        Transient adb errors (device offline, connection closed...) are retried up to RETRIES times
+        """
+        timeout = GetCommandTimeout() if hasDeadline else None
+        retries = GetRetries()
+        attempt = 0
+        while True:
+            returnCode, output, err = await self.__RunAdbOnce(serial, arguments, timeout)
+            if returnCode == 0 or attempt >= retries or not IsTransientError(err):
+                return returnCode, output, err
+            # limits are not held while waiting, so other commands can run meanwhile
+            await asyncio.sleep(GetRetryDelay(attempt))
+            attempt += 1
+
+    async def __RunAdbOnce(self, serial, arguments, timeout):
+        async with self.__globalLimit, self.__GetDeviceLimit(serial):
+            with Span("adb", " ".join(arguments), serial, isAsync=True) as span:
+                proc = await self.__StartAdb(serial, arguments)
+                try:
+                    output, err = await asyncio.wait_for(proc.communicate(), timeout)
+                except asyncio.TimeoutError:
+                    await StopProcess(proc)
+                    raise CommandTimeoutError("'%s' did not finish in %s seconds" % (" ".join(arguments), timeout))
+                except asyncio.CancelledError:
+                    await StopProcess(proc)
+                    raise
+                span.AddBytes(output)
+                span.AddBytes(err)
+                return proc.returncode, output, err
+
+    async def RunAdbToFile(self, serial, arguments, outputPath, keepPartialFile=False, hasDeadline=True):
+        """
+        Runs 'adb -s serial arguments...' and streams it's stdout straight into outputPath.
+        Returns (returnCode, err). Partially written file is removed if command fails or is cancelled,
+        unless keepPartialFile is True (ex. for recordings which are stopped by cancelling them).
+        Like RunAdb, raises CommandTimeoutError if command takes longer than COMMAND_TIMEOUT and hasDeadline is set
+        """
+        timeout = GetCommandTimeout() if hasDeadline else None
+        async with self.__globalLimit, self.__GetDeviceLimit(serial):
+            with Span("adb", " ".join(arguments), serial, isAsync=True) as span:
+                proc = await self.__StartAdb(serial, arguments)
+                isWritten = keepPartialFile
+
+                async def CopyOutput():
+                    # stderr is drained alongside stdout, otherwise adb blocks on a full stderr pipe
+                    errReading = asyncio.ensure_future(proc.stderr.read())
+                    try:
+                        with open(outputPath, mode="wb") as outputFile:
+                            while True:
+                                chunk = await proc.stdout.read(streamChunkSize)
+                                if not chunk:
+                                    break
+                                outputFile.write(chunk)
+                                span.AddBytes(chunk)
+                        err = await errReading
+                    finally:
+                        errReading.cancel()
+                    await proc.wait()
+                    return err
+
+                try:
+                    err = await asyncio.wait_for(CopyOutput(), timeout)
+                    isWritten = proc.returncode == 0
+                    return proc.returncode, err
+                except asyncio.TimeoutError:
+                    isWritten = False
+                    await StopProcess(proc)
+                    raise CommandTimeoutError("'%s' did not finish in %s seconds" % (" ".join(arguments), timeout))
+                except asyncio.CancelledError:
+                    await StopProcess(proc)
+                    raise
+                finally:
+                    if not isWritten and os.path.exists(outputPath):
+                        os.remove(outputPath)
+
+    async def RunAdbStream(self, serial, arguments, onOutput):
+        """
+        Runs 'adb -s serial arguments...' and awaits onOutput(chunk) for every chunk of it's stdout until adb exits.
+        adb is not read while onOutput is waiting, so slow consumer holds adb back instead of output piling up in memory.
+        Returns (returnCode, err). adb process is killed if the task is cancelled
+        """
+        async with self.__globalLimit, self.__GetDeviceLimit(serial):
+            with Span("adb", " ".join(arguments), serial, isAsync=True) as span:
+                proc = await self.__StartAdb(serial, arguments)
+                errReading = asyncio.ensure_future(proc.stderr.read())
+                try:
+                    while True:
+                        chunk = await proc.stdout.read(streamChunkSize)
+                        if not chunk:
+                            break
+                        span.AddBytes(chunk)
+                        await onOutput(chunk)
+                    err = await errReading
+                    await proc.wait()
+                    return proc.returncode, err
+                except asyncio.CancelledError:
+                    await StopProcess(proc)
+                    raise
+                finally:
+                    errReading.cancel()
+
+    async def RunShell(self, serial, command):
+        """
+        Runs shell command through device's shell session (see modules.shellSession), so repeated commands
+        do not start new adb processes. Falls back to 'adb shell' if sessions are disabled or broken.
+        Returns (exitCode, output). Output is bytes with stdout and stderr merged
+        """
+        session = await self.RunBlocking(serial, GetShellSession, serial)
+        if session is not None:
+            try:
+                output, exitCode = await self.RunBlocking(serial, session.Run, command, GetCommandTimeout())
+                return exitCode, output
+            except ShellSessionError:
+                pass
+        returnCode, output, err = await self.RunAdb(serial, ["shell", command])
+        return returnCode, output + err
+
+    async def RunBlocking(self, serial, func, *args):
+        """
+        Runs blocking function (ex. DeviceData method) in engine's thread pool and returns it's result
+        """
+        async with self.__globalLimit, self.__GetDeviceLimit(serial):
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.__threadPool, functools.partial(func, *args))
+
+    def Shutdown(self):
+        if self.__catchesInterrupt:
+            asyncio.get_event_loop().remove_signal_handler(signal.SIGINT)
+        self.__threadPool.shutdown(wait=False)
+
+
+def KillProcess(proc):
+    if proc.returncode is None:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+
+
+async def StopProcess(proc):
+    """
+    Kills the process and waits until it exits, so it is not left behind after event loop is closed
+    """
+    KillProcess(proc)
+    try:
+        await asyncio.wait_for(proc.wait(), processExitTimeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+def GetTargetSerial(target):
+    return target.GetDeviceID() if hasattr(target, "GetDeviceID") else str(target)
+
+
+async def RunJob(engine, job, target, timeout):
+    """
+    Runs the job for one target. If the job fails or does not finish in `timeout` seconds (None - no limit),
+    error is printed and None is returned, so results of other targets are still delivered
+    """
+    serial = GetTargetSerial(target)
+    name = target.GetPrintableDeviceName() if hasattr(target, "GetPrintableDeviceName") else str(target)
+    try:
+        with Span("job", getattr(job, "__name__", "job"), serial, isAsync=True):
+            return await asyncio.wait_for(job(engine, target), timeout)
+    except asyncio.CancelledError:
+        raise
+    except asyncio.TimeoutError:
+        # blocking calls of the job can't be cancelled, killing device's adb processes releases them
+        DropDevice(serial)
+        PrintError("%s: device did not respond in %s seconds and was skipped" % (name, timeout))
+        return None
+    except CommandTimeoutError as e:
+        PrintError("%s: device is not responding and was skipped (%s)" % (name, e))
+        return None
+    except Exception as e:
+        PrintError("%s: %s" % (name, e))
+        return None
+
+
+def RunOnDevices(targets, job, maxParallel=None, catchInterrupt=False, maxPerDevice=None):
+    """
+    Runs `job(engine, target)` coroutine for every target (DeviceData object or serial) concurrently
+    and returns list of results in the same order as targets.
+    If job fails for a target, error is printed and result for that target is None.
+    CTRL+C cancels all jobs and kills started adb processes, then KeyboardInterrupt is raised.
+    If catchInterrupt is True, CTRL+C only sets engine's stop flag and jobs are expected to finish by themselves.
+    Every job has to finish in OPERATION_TIMEOUT seconds, otherwise it is cancelled and the device is skipped.
+    Long running jobs (catchInterrupt) have no such limit.
+    maxParallel and maxPerDevice override MAX_PARALLEL_COMMANDS and MAX_COMMANDS_PER_DEVICE from adbepy.config
+    """
+    if maxParallel is None:
+        maxParallel = GetLimitFromConfig(ConfigDataFields.max_parallel_commands)
+    if maxPerDevice is None:
+        maxPerDevice = GetLimitFromConfig(ConfigDataFields.max_commands_per_device)
+    timeout = None if catchInterrupt else GetOperationTimeout()
+
+    RestoreDevices([GetTargetSerial(target) for target in targets])
+
+    async def RunAll():
+        engine = ExecutionEngine(maxParallel, maxPerDevice)
+        if catchInterrupt:
+            engine.CatchInterrupt()
+        try:
+            return await asyncio.gather(*[RunJob(engine, job, target, timeout) for target in targets])
+        finally:
+            engine.Shutdown()
+
+    if len(targets) == 0:
+        return []
+    return asyncio.run(RunAll())
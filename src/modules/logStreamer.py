@@ -0,0 +1,263 @@
+import asyncio
+import os
+import re
+import sys
+import time
+
+from modules.device import DecodeOutput
+from modules.executionEngine import RunOnDevices, GetLimitFromConfig
+from modules.configs import ConfigDataFields
+from modules.deviceInfoFormat import PrintInfoTable, PrintError
+
+# Every device can have at most this many unwritten output chunks (up to 64KB each) in memory.
+# When device's queue is full it's adb is not read until the writer catches up
+queueChunks = 8
+# Line without new line character is cut after this many bytes, so partial line can't grow without limit
+maxLineLength = 64 * 1024
+
+# Priorities understood by logcat filterspecs
+logPriorities = "VDIWEFS"
+
+
+def IsValidFilterSpec(filterSpec):
+    """
+    Checks logcat filterspec 'tag:priority' (ex. 'ActivityManager:I' or '*:S')
+    """
+    return re.match(r"^[^\s:]+:[%s]$" % (logPriorities), filterSpec) is not None
+
+
+def GetLogcatArguments(filterSpecs, buffers):
+    """
+    Filterspecs are applied by logcat on the device, so filtered out lines are never sent over USB
+    """
+    arguments = ["logcat", "-v", "threadtime"]
+    for buffer in buffers or []:
+        arguments += ["-b", buffer]
+    return arguments + list(filterSpecs or [])
+
+
+def GetLogFileName(serial):
+    # network devices have 'host:port' serials
+    return re.sub(r"[^\w.-]", "_", serial) + ".log"
+
+
+class InterleavedOutput:
+    """
+    Prints lines of all devices to stdout. Every line is prefixed with it's device serial
+    """
+
+    def __init__(self, serials):
+        width = max(len(serial) for serial in serials)
+        self.__prefixes = {serial: "%-*s | " % (width, serial) for serial in serials}
+
+    def Write(self, serial, data):
+        prefix = self.__prefixes[serial]
+        sys.stdout.write("".join(prefix + line + "\n" for line in DecodeOutput(data).splitlines()))
+        sys.stdout.flush()
+
+    def Close(self):
+        pass
+
+
+class RotatingLogFiles:
+    """
+    Writes lines of every device to it's own 'serial.log' file in outputFolder. When file grows over maxBytes
+    it is renamed to 'serial.log.1' (older ones are shifted up to 'serial.log.backupCount') and a new file is started
+    """
+
+    def __init__(self, outputFolder, maxBytes, backupCount):
+        self.__outputFolder = outputFolder
+        self.__maxBytes = maxBytes
+        self.__backupCount = backupCount
+        self.__files = {}
+        self.__sizes = {}
+
+    def GetFilePath(self, serial):
+        return os.path.join(self.__outputFolder, GetLogFileName(serial))
+
+    def Write(self, serial, data):
+        if serial not in self.__files:
+            self.__Open(serial)
+        if self.__sizes[serial] > 0 and self.__sizes[serial] + len(data) > self.__maxBytes:
+            self.__Rotate(serial)
+        self.__files[serial].write(data)
+        self.__files[serial].flush()
+        self.__sizes[serial] += len(data)
+
+    def Close(self):
+        for logFile in self.__files.values():
+            logFile.close()
+        self.__files = {}
+
+    def __Open(self, serial):
+        filePath = self.GetFilePath(serial)
+        self.__files[serial] = open(filePath, mode="ab")
+        self.__sizes[serial] = os.path.getsize(filePath)
+
+    def __Rotate(self, serial):
+        self.__files.pop(serial).close()
+        filePath = self.GetFilePath(serial)
+        if self.__backupCount > 0:
+            for index in range(self.__backupCount - 1, 0, -1):
+                backupPath = "%s.%d" % (filePath, index)
+                if os.path.exists(backupPath):
+                    os.replace(backupPath, "%s.%d" % (filePath, index + 1))
+            os.replace(filePath, filePath + ".1")
+        else:
+            os.remove(filePath)
+        self.__Open(serial)
+
+
+class LogMultiplexer:
+    """
+    Collects logcat output of many devices through bounded per-device queues and writes it with a single writer.
+    Writer takes one chunk from every device per round, so a chatty device can't hold the others back,
+    and a full queue stops reading that device's adb, so memory use is bounded by queueChunks per device.
+    Has to be used inside running event loop
+    """
+
+    def __init__(self, output):
+        self.__output = output
+        self.__queues = {}
+        self.__partialLines = {}
+        self.__stats = {}
+        self.__hasData = None
+        self.__writerTask = None
+        self.__isWriteFailed = False
+
+    def AddDevice(self, serial):
+        if self.__writerTask is None:
+            self.__hasData = asyncio.Event()
+            self.__writerTask = asyncio.ensure_future(self.__Write())
+        self.__queues[serial] = asyncio.Queue(maxsize=queueChunks)
+        self.__partialLines[serial] = b""
+        self.__stats[serial] = {"lines": 0, "bytes": 0, "waited": 0.0}
+
+    async def Put(self, serial, chunk):
+        """
+        Queues complete lines of the chunk. Waits while device's queue is full
+        """
+        data = self.__partialLines[serial] + chunk
+        end = data.rfind(b"\n") + 1
+        if end == 0 and len(data) > maxLineLength:
+            data += b"\n"
+            end = len(data)
+        self.__partialLines[serial] = data[end:]
+        if end > 0:
+            await self.__Enqueue(serial, data[:end])
+
+    async def Finish(self, serial):
+        """
+        Writes everything left of the device and removes it
+        """
+        partialLine = self.__partialLines.pop(serial, b"")
+        if partialLine:
+            await self.__Enqueue(serial, partialLine + b"\n")
+        await self.__queues[serial].join()
+        del self.__queues[serial]
+        if not self.__queues and self.__writerTask is not None:
+            self.__writerTask.cancel()
+            self.__writerTask = None
+
+    def GetStats(self, serial):
+        """
+        Returns dictionary with written lines, bytes and seconds device's reading waited for the writer
+        """
+        return self.__stats.get(serial, {"lines": 0, "bytes": 0, "waited": 0.0})
+
+    async def __Enqueue(self, serial, data):
+        queue = self.__queues[serial]
+        stats = self.__stats[serial]
+        stats["lines"] += data.count(b"\n")
+        stats["bytes"] += len(data)
+        if queue.full():
+            waitStartTime = time.monotonic()
+            await queue.put(data)
+            stats["waited"] += time.monotonic() - waitStartTime
+        else:
+            queue.put_nowait(data)
+        self.__hasData.set()
+
+    async def __Write(self):
+        while True:
+            self.__hasData.clear()
+            isWritten = False
+            for serial, queue in list(self.__queues.items()):
+                if queue.empty():
+                    continue
+                data = queue.get_nowait()
+                try:
+                    if not self.__isWriteFailed:
+                        self.__output.Write(serial, data)
+                except OSError as e:
+                    # output is dropped from now on, so devices are not blocked by the writer
+                    self.__isWriteFailed = True
+                    PrintError("Log output can't be written: %s" % (e))
+                finally:
+                    queue.task_done()
+                isWritten = True
+            if isWritten:
+                # let readers refill their queues before the next round
+                await asyncio.sleep(0)
+            else:
+                await self.__hasData.wait()
+
+
+def StreamLogs(devices, filterSpecs, buffers, duration, outputFolder, maxFileSize, backupCount, isClearing):
+    """
+    Streams logcat of all devices at the same time until CTRL+C is pressed or `duration` seconds pass.
+    Output is printed as one stream with device prefixed lines, or written to rotating per-device files
+    in outputFolder (if given). Summary of all devices is printed at the end
+    """
+    if outputFolder:
+        if not os.path.exists(outputFolder):
+            os.makedirs(outputFolder)
+        output = RotatingLogFiles(outputFolder, maxFileSize, backupCount)
+    else:
+        output = InterleavedOutput([device.GetDeviceID() for device in devices])
+    multiplexer = LogMultiplexer(output)
+    arguments = GetLogcatArguments(filterSpecs, buffers)
+    startTime = time.time()
+
+    async def Stream(engine, device):
+        serial = device.GetDeviceID()
+        if isClearing:
+            await engine.RunAdb(serial, ["logcat", "-c"])
+        multiplexer.AddDevice(serial)
+        try:
+            streaming = asyncio.ensure_future(engine.RunAdbStream(serial, arguments, lambda chunk: multiplexer.Put(serial, chunk)))
+            stopping = asyncio.ensure_future(engine.WaitForStop())
+            timeout = None if duration is None else max(0, startTime + duration - time.time())
+            done, pending = await asyncio.wait([streaming, stopping], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            if streaming in done:
+                returnCode, err = streaming.result()
+                if returnCode != 0 and not engine.IsStopRequested():
+                    PrintError("%s: logcat stopped: %s" % (device.GetPrintableDeviceName(), DecodeOutput(err)))
+        finally:
+            await multiplexer.Finish(serial)
+
+    if outputFolder:
+        print("Logs are written to %s" % (os.path.abspath(outputFolder)))
+    print("Streaming logcat of %s devices. Press CTRL+C to stop.\n" % (len(devices)))
+    # every device keeps one logcat running
+    maxParallel = max(GetLimitFromConfig(ConfigDataFields.max_parallel_commands), len(devices))
+    try:
+        RunOnDevices(devices, Stream, maxParallel=maxParallel, catchInterrupt=True)
+    finally:
+        output.Close()
+
+    rows = []
+    for device in devices:
+        stats = multiplexer.GetStats(device.GetDeviceID())
+        rows.append([
+            device.GetPrintableDeviceName(),
+            device.GetDeviceID(),
+            str(stats["lines"]),
+            "%.2f" % (stats["bytes"] / 1024 / 1024),
+            "%.1f" % (stats["waited"])
+        ])
+    print()
+    PrintInfoTable(rows, ["Device name", "Serial number", "Lines", "Size MB", "Waited for output s"])
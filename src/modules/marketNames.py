@@ -0,0 +1,141 @@
+import csv
+import os
+import pickle
+import threading
+from os import path
+
+from modules.configs import resFolder
+from modules.tracing import Span
+
+supportedDevicesPath = path.join(resFolder, "supported_devices.csv")
+indexPath = path.join(resFolder, "supported_devices.idx")
+# Increase when index layout changes, so old index files are rebuilt
+indexVersion = 2
+
+marketNameIndex = None
+indexLock = threading.Lock()
+
+
+def NormalizeKey(*parts):
+    return "\t".join(part.strip().lower() for part in parts)
+
+
+def SupportedDevicesFileExists():
+    return path.isfile(supportedDevicesPath)
+
+
+def BuildMarketNameIndex():
+    """
+    Reads supported_devices.csv once and saves lookup index next to it (supported_devices.idx).
+    Index contains:
+    manufacturers - set of known (normalized) retail brandings
+    byModel       - "manufacturer<TAB>model code" -> market name
+    byDevice      - "manufacturer<TAB>device codename" -> market name
+    rows          - (branding, market name, device, model, whole line) of named rows, lowercase,
+                    for the containment match when exact keys miss
+    Returns built index or None if csv file does not exist
+    """
+    global marketNameIndex
+    if not SupportedDevicesFileExists():
+        return None
+    index = {
+        "version": indexVersion,
+        "csvMtime": os.stat(supportedDevicesPath).st_mtime,
+        "manufacturers": set(),
+        "byModel": {},
+        "byDevice": {},
+        "rows": []
+    }
+    with Span("csv-scan", "supported_devices.csv"), \
+            open(supportedDevicesPath, mode='r', buffering=-1, encoding="UTF-16", newline="") as f:
+        reader = csv.reader(f)
+        next(reader, None)  # Retail Branding,Marketing Name,Device,Model
+        for row in reader:
+            if len(row) < 4:
+                continue
+            manuf, marketName, device, model = row[0], row[1].strip(), row[2], row[3]
+            index["manufacturers"].add(NormalizeKey(manuf))
+            if not marketName:
+                continue
+            # first listed name wins, same as the linear scan did
+            index["byModel"].setdefault(NormalizeKey(manuf, model), marketName)
+            index["byDevice"].setdefault(NormalizeKey(manuf, device), marketName)
+            index["rows"].append((manuf.strip().lower(), marketName, device.strip().lower(), model.strip().lower(), ",".join(row).lower()))
+    try:
+        with Span("cache", "write market name index"), open(indexPath, mode="wb") as indexFile:
+            pickle.dump(index, indexFile, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        # index still can be used for this run
+        pass
+    marketNameIndex = index
+    return index
+
+
+def LoadMarketNameIndex():
+    """
+    Returns market name index. It is loaded from supported_devices.idx on the first call and
+    rebuilt if it is missing, outdated or supported_devices.csv was changed since it was built
+    """
+    global marketNameIndex
+    with indexLock:
+        if marketNameIndex is not None and SupportedDevicesFileExists() \
+                and marketNameIndex["csvMtime"] == os.stat(supportedDevicesPath).st_mtime:
+            return marketNameIndex
+        try:
+            with Span("cache", "read market name index"), open(indexPath, mode="rb") as indexFile:
+                index = pickle.load(indexFile)
+            if index.get("version") == indexVersion and SupportedDevicesFileExists() \
+                    and index["csvMtime"] == os.stat(supportedDevicesPath).st_mtime:
+                marketNameIndex = index
+                return marketNameIndex
+        except (IOError, pickle.UnpicklingError, EOFError, AttributeError, KeyError):
+            pass
+        return BuildMarketNameIndex()
+
+
+def FindMarketNameByContainment(index, manufacturer, modelCode, productName, productDevice):
+    """
+    Linear match of the original csv scan: manufacturer is contained in the retail branding, model code
+    equals (preferred) or is contained in the model, product name is contained in the line or device equals
+    the device codename. Used only when exact index keys miss
+    """
+    manufacturer = manufacturer.strip().lower()
+    modelCode = modelCode.strip().lower()
+    productName = productName.strip().lower()
+    productDevice = productDevice.strip().lower()
+    if not manufacturer:
+        return ""
+    isKnown = False
+    candidate = None
+    for branding, marketName, device, model, line in index["rows"]:
+        if manufacturer not in branding:
+            continue
+        isKnown = True
+        if modelCode and modelCode == model:
+            return marketName
+        if candidate is None and ((modelCode and modelCode in model) or (productName and productName in line)
+                                  or (productDevice and productDevice == device)):
+            candidate = marketName
+    if candidate is not None:
+        return candidate
+    return "-" if isKnown else ""
+
+
+def FindMarketName(manufacturer, modelCode, productName, productDevice):
+    """
+    Returns market name of the device.
+    Empty string is returned if manufacturer is not listed at all and "-" if manufacturer is known,
+    but none of the device names matched
+    """
+    index = LoadMarketNameIndex()
+    if index is None:
+        return ""
+    if NormalizeKey(manufacturer) in index["manufacturers"]:
+        marketName = index["byModel"].get(NormalizeKey(manufacturer, modelCode))
+        if marketName is None:
+            marketName = index["byDevice"].get(NormalizeKey(manufacturer, productDevice))
+        if marketName is None:
+            marketName = index["byDevice"].get(NormalizeKey(manufacturer, productName))
+        if marketName is not None:
+            return marketName
+    return FindMarketNameByContainment(index, manufacturer, modelCode, productName, productDevice)
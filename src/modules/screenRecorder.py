@@ -0,0 +1,113 @@
+import asyncio
+import os
+import time
+import uuid
+
+from modules.executionEngine import RunOnDevices, GetLimitFromConfig
+from modules.configs import ConfigDataFields
+from modules.deviceInfoFormat import PrintError
+
+# How long to wait for screenrecord to finish writing the video after it was stopped
+finishTimeout = 30
+finishPollInterval = 0.2
+
+# Stops screenrecord same way as CTRL+C would, so it writes the end of mp4 file. Older devices have no pkill
+stopScreenrecordCommand = "pkill -INT screenrecord || kill -INT $(pidof screenrecord)"
+
+
+async def WaitForRecording(engine, recording):
+    """
+    Waits until recording finishes by itself (ex. screenrecord time limit is reached) or user presses CTRL+C.
+    Returns True if recording was stopped by the user
+    """
+    stopping = asyncio.ensure_future(engine.WaitForStop())
+    try:
+        await asyncio.wait([recording, stopping], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        stopping.cancel()
+    return not recording.done()
+
+
+async def WaitForScreenrecordExit(engine, serial):
+    """
+    Polls the device until screenrecord process is gone, which means the video file is finished
+    """
+    deadline = time.time() + finishTimeout
+    while time.time() < deadline:
+        returnCode, output, err = await engine.RunAdb(serial, ["shell", "pidof", "screenrecord"])
+        if not output.strip():
+            return True
+        await asyncio.sleep(finishPollInterval)
+    return False
+
+
+async def StreamVideo(engine, device, videoPath, recordingResolution):
+    """
+    Streams h264 video straight from screenrecord to videoPath. Nothing is written on the device.
+    Stopping the stream ends the recording, raw h264 file needs no finishing
+    """
+    arguments = ["exec-out", "screenrecord", "--output-format=h264", "--size", recordingResolution, "-"]
+    recording = asyncio.ensure_future(engine.RunAdbToFile(device.GetDeviceID(), arguments, videoPath, keepPartialFile=True, hasDeadline=False))
+    if await WaitForRecording(engine, recording):
+        recording.cancel()
+        try:
+            await recording
+        except asyncio.CancelledError:
+            pass
+        return
+    returnCode, err = recording.result()
+    if returnCode != 0:
+        raise Exception("recording failed: %s" % (err.decode("utf-8", "replace").strip()))
+
+
+async def RecordVideoToDeviceFile(engine, device, videoPath, recordingResolution):
+    """
+    Records mp4 video on the device and pulls it after recording is stopped
+    """
+    serial = device.GetDeviceID()
+    # Xiaomi workaround. It doesn't like naming the files the same way every time.
+    remotePath = "/sdcard/adbe_%s.mp4" % (uuid.uuid4().hex[:8])
+    arguments = ["shell", "screenrecord", "--bugreport", "--size", recordingResolution, remotePath]
+    recording = asyncio.ensure_future(engine.RunAdb(serial, arguments, hasDeadline=False))
+    try:
+        if await WaitForRecording(engine, recording):
+            await engine.RunAdb(serial, ["shell", stopScreenrecordCommand])
+            if not await WaitForScreenrecordExit(engine, serial):
+                PrintError("%s: screenrecord did not finish in %s seconds, video can be broken" % (device.GetPrintableDeviceName(), finishTimeout))
+        returnCode, output, err = await engine.RunAdb(serial, ["pull", remotePath, videoPath], hasDeadline=False)
+        if returnCode != 0:
+            raise Exception("video was not pulled: %s" % (err.decode("utf-8", "replace").strip()))
+    finally:
+        if not recording.done():
+            recording.cancel()
+            try:
+                await recording
+            except asyncio.CancelledError:
+                pass
+        await engine.RunAdb(serial, ["shell", "rm", "-f", remotePath])
+
+
+def RecordVideos(devices, videoName, saveLocation, recordingResolution, isDeviceFile):
+    """
+    Records video on all devices at once until CTRL+C is pressed. By default video is streamed as raw h264
+    and saved as 'name_deviceSerial.h264'. If isDeviceFile is True, mp4 video is recorded on the device
+    and pulled as 'name_deviceSerial.mp4' (screenrecord on older devices can't stream)
+    """
+    extension = ".mp4" if isDeviceFile else ".h264"
+    record = RecordVideoToDeviceFile if isDeviceFile else StreamVideo
+
+    async def Record(engine, device):
+        videoPath = os.path.abspath(os.path.join(saveLocation, videoName + "_" + device.GetDeviceID() + extension))
+        await record(engine, device, videoPath, recordingResolution)
+        if os.path.exists(videoPath):
+            print("Video saved as: " + videoPath)
+        else:
+            PrintError("%s: video was not saved" % (device.GetPrintableDeviceName()))
+
+    if not os.path.exists(saveLocation):
+        os.makedirs(saveLocation)
+    print("\nRecording. Press CTRL+C to stop and save the video.\n")
+    # every recording keeps one command running for the whole time, stopping it needs one more
+    maxParallel = max(GetLimitFromConfig(ConfigDataFields.max_parallel_commands), 2 * len(devices))
+    maxPerDevice = max(GetLimitFromConfig(ConfigDataFields.max_commands_per_device), 2)
+    RunOnDevices(devices, Record, maxParallel=maxParallel, catchInterrupt=True, maxPerDevice=maxPerDevice)
@@ -0,0 +1,158 @@
+import atexit
+import os
+import signal
+import threading
+import uuid
+from subprocess import PIPE, STDOUT
+
+from modules.configs import ConfigDataFields, config
+from modules.tracing import Span
+from modules.deadlines import CommandTimeoutError, StartDeviceProcess, FinishDeviceProcess
+
+
+class ShellSessionError(Exception):
+    """
+    Raised when the shell session is closed or it's output can not be read
+    """
+    pass
+
+
+class ShellSession:
+    """
+    Keeps one 'adb shell' open for a device and runs commands through it one after another.
+    After every command a unique marker with the exit code is printed, so output of each
+    command can be separated from the next one without starting a new shell
+    """
+
+    def __init__(self, serial):
+        self.serial = serial
+        with Span("adb", "shell (session)", serial):
+            # own process group lets a timed out command be killed together with everything adb has started
+            options = {"start_new_session": True} if os.name == "posix" else {}
+            self.__proc = StartDeviceProcess(serial, ["adb", "-s", serial, "shell"], stdin=PIPE, stdout=PIPE, stderr=STDOUT, bufsize=0, **options)
+        self.__lock = threading.Lock()
+        self.__marker = "ADBE_" + uuid.uuid4().hex
+        self.__counter = 0
+        self.__isExpired = False
+
+    def IsAlive(self):
+        return self.__proc.poll() is None
+
+    def Run(self, command, timeout=None):
+        """
+        Runs command in the session and returns (output, exitCode). Output is bytes with stdout and stderr merged.
+        If command does not finish in `timeout` seconds, session is killed and CommandTimeoutError is raised
+        """
+        with self.__lock, Span("shell", command, self.serial) as span:
+            if not self.IsAlive():
+                raise ShellSessionError("Shell session of %s is closed" % (self.serial))
+            # readline can't time out, so the session is killed instead, which ends the read
+            timer = None
+            self.__isExpired = False
+            if timeout is not None:
+                timer = threading.Timer(timeout, self.__Expire)
+                timer.daemon = True
+                timer.start()
+            try:
+                return self.__RunCommand(command, span)
+            except ShellSessionError:
+                if self.__isExpired:
+                    raise CommandTimeoutError("'%s' did not finish in %s seconds" % (command, timeout))
+                raise
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
+    def __Expire(self):
+        self.__isExpired = True
+        try:
+            if os.name == "posix":
+                os.killpg(self.__proc.pid, signal.SIGKILL)
+            else:
+                self.__proc.kill()
+        except OSError:
+            pass
+
+    def __RunCommand(self, command, span):
+        self.__counter += 1
+        marker = ("%s_%d" % (self.__marker, self.__counter)).encode("ascii")
+        # stdin is closed for the command itself, otherwise it could read the following commands
+        script = b"{ " + command.encode("utf-8") + b"\n} </dev/null 2>&1\nprintf '\\n%s %d\\n' " + marker + b" \"$?\"\n"
+        try:
+            self.__proc.stdin.write(script)
+            self.__proc.stdin.flush()
+        except OSError as e:
+            raise ShellSessionError("Can't write to shell session of %s: %s" % (self.serial, e))
+
+        lines = []
+        while True:
+            line = self.__proc.stdout.readline()
+            if not line:
+                raise ShellSessionError("Shell session of %s was closed while running '%s'" % (self.serial, command))
+            if line.startswith(marker + b" "):
+                break
+            lines.append(line.replace(b"\r\n", b"\n"))
+        output = b"".join(lines)
+        # drop new line which was printed before the marker
+        if output.endswith(b"\n"):
+            output = output[:-1]
+        try:
+            exitCode = int(line[len(marker):].strip())
+        except ValueError:
+            exitCode = -1
+        span.AddBytes(output)
+        return output, exitCode
+
+    def Close(self):
+        FinishDeviceProcess(self.serial, self.__proc)
+        if self.IsAlive():
+            try:
+                self.__proc.stdin.write(b"exit\n")
+                self.__proc.stdin.close()
+                self.__proc.wait(timeout=2)
+            except Exception:
+                self.__proc.kill()
+
+
+shellSessions = {}
+shellSessionsLock = threading.Lock()
+
+
+def AreShellSessionsEnabled():
+    return config.GetBool(ConfigDataFields.shell_sessions)
+
+
+def GetShellSession(serial):
+    """
+    Returns open shell session for the device (session is started on the first call).
+    Returns None if sessions are disabled in adbepy.config or session can not be started
+    """
+    if not AreShellSessionsEnabled():
+        return None
+    with shellSessionsLock:
+        session = shellSessions.get(serial)
+        if session is None or not session.IsAlive():
+            if session is not None:
+                session.Close()
+            try:
+                session = ShellSession(serial)
+            except OSError:
+                return None
+            shellSessions[serial] = session
+        return session
+
+
+def CloseShellSession(serial):
+    with shellSessionsLock:
+        session = shellSessions.pop(serial, None)
+    if session is not None:
+        session.Close()
+
+
+@atexit.register
+def CloseAllShellSessions():
+    with shellSessionsLock:
+        sessions = list(shellSessions.values())
+        shellSessions.clear()
+    for session in sessions:
+        session.Close()
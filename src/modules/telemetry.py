@@ -0,0 +1,177 @@
+import asyncio
+import collections
+import json
+import re
+import time
+
+from modules.device import DecodeOutput
+from modules.executionEngine import RunOnDevices, GetLimitFromConfig
+from modules.configs import ConfigDataFields
+from modules.deviceInfoFormat import PrintInfoTable, PrintError
+
+# Both readings are taken with one shell round trip. Only thermal status line is sent back from the device
+sampleCommand = "dumpsys battery; echo ADBE_THERMAL; dumpsys thermalservice 2>/dev/null | grep -m 1 'Thermal Status'"
+
+# BatteryManager.BATTERY_STATUS_CHARGING
+batteryStatusCharging = 2
+
+sampleFields = ["timestamp", "serial", "level", "temperature", "voltage", "charging", "plugged", "thermal_status"]
+
+
+def ParseBatteryDump(dump):
+    """
+    Parses 'dumpsys battery' output. Returns dictionary with level (%), temperature (°C), voltage (mV),
+    charging (bool) and plugged (ac, usb, wireless or empty string). Missing values are None
+    """
+    values = {}
+    for matchObj in re.finditer(r"^\s*([\w ]+): (.+)$", dump, flags=re.MULTILINE):
+        values[matchObj.group(1).strip()] = matchObj.group(2).strip()
+
+    def GetNumber(key):
+        try:
+            return int(values[key])
+        except (KeyError, ValueError):
+            return None
+
+    temperature = GetNumber("temperature")
+    plugged = ""
+    for source in ["AC", "USB", "Wireless"]:
+        if values.get(source + " powered") == "true":
+            plugged = source.lower()
+            break
+    return {
+        "level": GetNumber("level"),
+        "temperature": round(temperature * 0.1, 1) if temperature is not None else None,
+        "voltage": GetNumber("voltage"),
+        "charging": GetNumber("status") == batteryStatusCharging,
+        "plugged": plugged
+    }
+
+
+def ParseThermalStatus(output):
+    """
+    Returns thermal status (0 - none, 1 - light ... 6 - shutdown) or None if device does not report it (Android 9 and older)
+    """
+    matchObj = re.search(r"Thermal Status: (\d+)", output)
+    if matchObj is None:
+        return None
+    return int(matchObj.group(1))
+
+
+def ParseSample(output):
+    batteryDump, separator, thermalOutput = output.partition("ADBE_THERMAL")
+    sample = ParseBatteryDump(batteryDump)
+    sample["thermal_status"] = ParseThermalStatus(thermalOutput)
+    return sample
+
+
+class SampleWriter:
+    """
+    Streams samples to a file as they are taken. Format is chosen by file extension: .csv or json lines (anything else)
+    """
+
+    def __init__(self, filePath):
+        self.__file = open(filePath, mode="w", encoding="utf-8")
+        self.__isCSV = filePath.lower().endswith(".csv")
+        if self.__isCSV:
+            self.__file.write(",".join(sampleFields) + "\n")
+
+    def Write(self, sample):
+        if self.__isCSV:
+            values = ["" if sample[field] is None else str(sample[field]) for field in sampleFields]
+            self.__file.write(",".join(values) + "\n")
+        else:
+            self.__file.write(json.dumps(sample) + "\n")
+        self.__file.flush()
+
+    def Close(self):
+        self.__file.close()
+
+
+def FormatSample(device, sample):
+    temperature = "-" if sample["temperature"] is None else "%s°C" % (sample["temperature"])
+    thermal = "-" if sample["thermal_status"] is None else str(sample["thermal_status"])
+    charging = "charging" if sample["charging"] else "discharging"
+    return "[%s] %s: %s%% %s %s thermal %s" % (time.strftime("%H:%M:%S", time.localtime(sample["timestamp"])),
+                                               device.GetPrintableDeviceName(), sample["level"], temperature, charging, thermal)
+
+
+def SummarizeSamples(device, samples):
+    """
+    Returns summary row for PrintInfoTable from the samples left in device's ring buffer
+    """
+    levels = [sample["level"] for sample in samples if sample["level"] is not None]
+    temperatures = [sample["temperature"] for sample in samples if sample["temperature"] is not None]
+    thermalStatuses = [sample["thermal_status"] for sample in samples if sample["thermal_status"] is not None]
+    drainRate = "-"
+    hours = (samples[-1]["timestamp"] - samples[0]["timestamp"]) / 3600 if samples else 0
+    if len(levels) > 1 and hours > 0:
+        drainRate = "%.1f" % ((levels[0] - levels[-1]) / hours)
+    return [
+        device.GetPrintableDeviceName(),
+        device.GetDeviceID(),
+        str(len(samples)),
+        "%s -> %s" % (levels[0], levels[-1]) if levels else "-",
+        drainRate,
+        str(max(temperatures)) if temperatures else "-",
+        str(max(thermalStatuses)) if thermalStatuses else "-",
+        "yes" if samples and samples[-1]["charging"] else "no"
+    ]
+
+
+def MonitorDevices(devices, interval, duration, outputPath, bufferSize):
+    """
+    Samples battery and thermal state of all devices every `interval` seconds until CTRL+C is pressed
+    or `duration` seconds pass. Latest `bufferSize` samples of each device are kept in memory for the summary,
+    all samples are streamed to outputPath (if given) or printed
+    """
+    writer = SampleWriter(outputPath) if outputPath else None
+    buffers = {device.GetDeviceID(): collections.deque(maxlen=bufferSize) for device in devices}
+    startTime = time.time()
+
+    async def Monitor(engine, device):
+        serial = device.GetDeviceID()
+        sampleNumber = 0
+        while not engine.IsStopRequested():
+            # samples are scheduled from the start time, so slow samples do not shift the following ones
+            nextSampleTime = startTime + sampleNumber * interval
+            if duration is not None and nextSampleTime - startTime >= duration:
+                return
+            delay = nextSampleTime - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(engine.WaitForStop(), delay)
+                    return
+                except asyncio.TimeoutError:
+                    pass
+            sampleNumber += 1
+            timestamp = time.time()
+            try:
+                exitCode, output = await engine.RunShell(serial, sampleCommand)
+                values = ParseSample(DecodeOutput(output))
+            except Exception as e:
+                if not engine.IsStopRequested():
+                    PrintError("%s: sample was not taken: %s" % (device.GetPrintableDeviceName(), e))
+                continue
+            sample = {"timestamp": round(timestamp, 3), "serial": serial}
+            sample.update(values)
+            buffers[serial].append(sample)
+            if writer is not None:
+                writer.Write(sample)
+            else:
+                print(FormatSample(device, sample))
+
+    if outputPath:
+        print("Samples are written to %s" % (outputPath))
+    print("Monitoring %s devices every %s seconds. Press CTRL+C to stop.\n" % (len(devices), interval))
+    # every device keeps at most one sample command running
+    maxParallel = max(GetLimitFromConfig(ConfigDataFields.max_parallel_commands), len(devices))
+    try:
+        RunOnDevices(devices, Monitor, maxParallel=maxParallel, catchInterrupt=True)
+    finally:
+        if writer is not None:
+            writer.Close()
+
+    rows = [SummarizeSamples(device, list(buffers[device.GetDeviceID()])) for device in devices]
+    print()
+    PrintInfoTable(rows, ["Device name", "Serial number", "Samples", "Bat. %", "Drain %/h", "Max °C", "Max thermal", "Charging"])
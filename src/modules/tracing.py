@@ -0,0 +1,206 @@
+import json
+import os
+import threading
+import time
+
+# Phases which are time spent waiting for the device or tools, others (cache, market names...) are spent in adbe itself
+commandPhases = ["adb", "shell", "aapt"]
+
+activeTracer = None
+
+
+class Tracer:
+    """
+    Collects finished spans of one command. Spans can be recorded from any thread
+    """
+
+    def __init__(self):
+        self.startTime = time.perf_counter()
+        self.endTime = None
+        self.__records = []
+        self.__lock = threading.Lock()
+
+    def Record(self, span, startTime, endTime, isFailed):
+        record = {
+            "phase": span.phase,
+            "name": span.name,
+            "serial": span.serial,
+            "start": startTime - self.startTime,
+            "duration": endTime - startTime,
+            "bytes": span.bytes,
+            "thread": threading.current_thread().name,
+            "async": span.isAsync,
+            "failed": isFailed
+        }
+        with self.__lock:
+            self.__records.append(record)
+
+    def GetRecords(self):
+        with self.__lock:
+            return list(self.__records)
+
+    def GetDuration(self):
+        endTime = self.endTime if self.endTime is not None else time.perf_counter()
+        return endTime - self.startTime
+
+
+class Span:
+    """
+    Context manager which records start and end time of the block together with device serial,
+    command and amount of returned bytes (see AddBytes). Does nothing unless tracing is started.
+    isAsync has to be set for spans of coroutines, they overlap on the same thread
+    """
+
+    def __init__(self, phase, name, serial=None, isAsync=False):
+        self.phase = phase
+        self.name = name
+        self.serial = serial
+        self.isAsync = isAsync
+        self.bytes = 0
+        self.__tracer = None
+        self.__startTime = 0
+
+    def __enter__(self):
+        self.__tracer = activeTracer
+        if self.__tracer is not None:
+            self.__startTime = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if self.__tracer is not None:
+            self.__tracer.Record(self, self.__startTime, time.perf_counter(), excType is not None)
+        return False
+
+    def AddBytes(self, data):
+        """
+        Adds length of returned data (bytes or str) to the span
+        """
+        if data:
+            self.bytes += len(data)
+
+
+def StartTracing():
+    global activeTracer
+    activeTracer = Tracer()
+    return activeTracer
+
+
+def StopTracing():
+    global activeTracer
+    tracer = activeTracer
+    if tracer is not None:
+        tracer.endTime = time.perf_counter()
+    activeTracer = None
+    return tracer
+
+
+def SummarizeByPhase(records):
+    """
+    Returns table rows: phase, calls, total seconds, average and max milliseconds and KB returned.
+    Nested spans are counted in their parent's phase as well
+    """
+    phases = {}
+    for record in records:
+        phase = phases.setdefault(record["phase"], {"calls": 0, "total": 0.0, "max": 0.0, "bytes": 0, "failed": 0})
+        phase["calls"] += 1
+        phase["total"] += record["duration"]
+        phase["max"] = max(phase["max"], record["duration"])
+        phase["bytes"] += record["bytes"]
+        phase["failed"] += 1 if record["failed"] else 0
+    rows = []
+    for name, phase in sorted(phases.items(), key=lambda item: item[1]["total"], reverse=True):
+        rows.append([
+            name,
+            str(phase["calls"]),
+            str(phase["failed"]),
+            "%.3f" % (phase["total"]),
+            "%.1f" % (phase["total"] * 1000 / phase["calls"]),
+            "%.1f" % (phase["max"] * 1000),
+            "%.1f" % (phase["bytes"] / 1024)
+        ])
+    return rows
+
+
+def SummarizeByDevice(records):
+    """
+    Returns table rows: serial, commands sent to the device, time spent in them, KB returned
+    and the slowest command
+    """
+    devices = {}
+    for record in records:
+        if record["serial"] is None or record["phase"] not in commandPhases:
+            continue
+        device = devices.setdefault(record["serial"], {"calls": 0, "total": 0.0, "bytes": 0, "slowest": None})
+        device["calls"] += 1
+        device["total"] += record["duration"]
+        device["bytes"] += record["bytes"]
+        if device["slowest"] is None or record["duration"] > device["slowest"]["duration"]:
+            device["slowest"] = record
+    rows = []
+    for serial, device in sorted(devices.items(), key=lambda item: item[1]["total"], reverse=True):
+        slowest = device["slowest"]
+        rows.append([
+            serial,
+            str(device["calls"]),
+            "%.3f" % (device["total"]),
+            "%.1f" % (device["bytes"] / 1024),
+            "%s (%.1f ms)" % (slowest["name"][:40], slowest["duration"] * 1000)
+        ])
+    return rows
+
+
+def PrintTable(rows, columnTitles):
+    """
+    Prints rows as plain aligned columns, keeping their order
+    """
+    widths = [len(title) for title in columnTitles]
+    for row in rows:
+        widths = [max(width, len(value)) for width, value in zip(widths, row)]
+    for row in [columnTitles] + rows:
+        print("  ".join("%-*s" % (width, value) for width, value in zip(widths, row)).rstrip())
+
+
+def PrintProfile(tracer):
+    records = tracer.GetRecords()
+    print("\nProfile: command took %.3f s, %d spans recorded" % (tracer.GetDuration(), len(records)))
+    if len(records) == 0:
+        return
+    print("\nBy phase (time of nested phases is included in their parents):")
+    PrintTable(SummarizeByPhase(records), ["Phase", "Calls", "Failed", "Total s", "Avg ms", "Max ms", "KB"])
+    deviceRows = SummarizeByDevice(records)
+    if deviceRows:
+        print("\nBy device (%s):" % (", ".join(commandPhases)))
+        PrintTable(deviceRows, ["Serial number", "Commands", "Total s", "KB", "Slowest command"])
+
+
+def SaveChromeTrace(tracer, filePath):
+    """
+    Saves spans in Chrome trace event format (open with chrome://tracing or ui.perfetto.dev).
+    Spans of threads are complete events on their thread, spans of coroutines are async events, so they can overlap
+    """
+    processID = os.getpid()
+    events = []
+    threadIDs = {}
+    for record in tracer.GetRecords():
+        if record["thread"] not in threadIDs:
+            threadIDs[record["thread"]] = len(threadIDs) + 1
+            events.append({"name": "thread_name", "ph": "M", "pid": processID, "tid": threadIDs[record["thread"]],
+                           "args": {"name": record["thread"]}})
+        event = {
+            "name": record["name"],
+            "cat": record["phase"],
+            "pid": processID,
+            "tid": threadIDs[record["thread"]],
+            "ts": round(record["start"] * 1000000, 1),
+            "args": {"serial": record["serial"], "bytes": record["bytes"], "failed": record["failed"]}
+        }
+        if record["async"]:
+            asyncID = len(events)
+            endEvent = dict(event, ph="e", id=asyncID, ts=round((record["start"] + record["duration"]) * 1000000, 1))
+            events.append(dict(event, ph="b", id=asyncID))
+            events.append(endEvent)
+        else:
+            events.append(dict(event, ph="X", dur=round(record["duration"] * 1000000, 1)))
+    with open(filePath, mode="w", encoding="utf-8") as traceFile:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, traceFile)
+    print("Trace saved as: %s" % (os.path.abspath(filePath)))
@@ -1,28 +1,122 @@
+import os
+import time
 from os import path
-import urllib
-import urllib.error
-import urllib.request
 import json
-from modules.configs import ConfigDataFields, GetFieldData
+from modules.configs import ConfigDataFields, config, resFolder
+from modules.tracing import Span
 
 def UpdateSupportedDevices(args):
+    import urllib.error
+    import urllib.request
     url = "http://storage.googleapis.com/play_public/supported_devices.csv"
-    resPath = "../res/"
-    scriptPath = path.dirname(__file__)
-    targetPath = path.join(scriptPath, resPath)
+    targetPath = resFolder
     try:
-        urllib.request.urlretrieve(url, targetPath + "supported_devices.csv")
-    except FileNotFoundError:
-        import os
-        os.makedirs(targetPath)
-        urllib.request.urlretrieve(url, targetPath + "supported_devices.csv")
+        with Span("web", "supported_devices.csv"):
+            try:
+                urllib.request.urlretrieve(url, path.join(targetPath, "supported_devices.csv"))
+            except FileNotFoundError:
+                os.makedirs(targetPath)
+                urllib.request.urlretrieve(url, path.join(targetPath, "supported_devices.csv"))
     except urllib.error.URLError:
         print("Can't connect to supported_devices.csv source. Please, check internet connection.")
+        return
+    # Name lookups are served from prebuilt index, so it is rebuilt together with the csv file
+    from modules.marketNames import BuildMarketNameIndex
+    BuildMarketNameIndex()
             
-def GetCPUHardwareData():
+cpuDatabaseUrl = "https://raw.githubusercontent.com/xTheEc0/Android-Device-Hardware-Specs-Database/master/database.json"
+cpuDatabaseCachePath = path.join(resFolder, "cpu_database.json")
+# After failed download database is not requested again for this long (seconds), so offline runs stay fast
+cpuDatabaseRetryInterval = 3600
+
+
+def LoadCPUDatabaseCache(cachePath):
+    try:
+        with Span("cache", "read CPU database"), open(cachePath, mode="r", encoding="utf-8") as cacheFile:
+            cache = json.load(cacheFile)
+        if "fetched" in cache and "boards" in cache:
+            return cache
+    except (IOError, ValueError):
+        pass
+    return None
+
+
+def SaveCPUDatabaseCache(cache, cachePath):
+    directory = path.dirname(cachePath)
+    try:
+        if not path.exists(directory):
+            os.makedirs(directory)
+        # write to temporary file first, so other adbe processes never read half written cache
+        tempPath = cachePath + ".tmp"
+        with Span("cache", "write CPU database"), open(tempPath, mode="w", encoding="utf-8") as cacheFile:
+            json.dump(cache, cacheFile)
+        os.replace(tempPath, cachePath)
+    except OSError:
+        pass
+
+
+def GetCPUDatabaseTTL():
+    hours = config.GetFloat(ConfigDataFields.cpu_database_ttl)
+    if hours is None:
+        return 0
+    return hours * 3600
+
+
+def SaveFailedCPUDatabaseFetch(cache, cachePath):
+    """
+    Marks cache as fetched, so it is revalidated again in cpuDatabaseRetryInterval (or TTL if it is shorter)
+    instead of on every run. Returns cached boards
+    """
+    ttl = GetCPUDatabaseTTL()
+    if cache is None:
+        cache = {"boards": {}}
+    cache["fetched"] = time.time() - ttl + min(cpuDatabaseRetryInterval, ttl)
+    SaveCPUDatabaseCache(cache, cachePath)
+    return cache["boards"]
+
+
+def GetCPUHardwareData(url=cpuDatabaseUrl, cachePath=cpuDatabaseCachePath):
     """
-    Sends GET web request to seperate database and returns CPU hardware info.
+    Returns CPU hardware info from seperate database, keyed by lowercase board name.
     https://github.com/xTheEc0/Android-Device-Hardware-Specs-Database
+    Database is cached in res/cpu_database.json. Cached copy is used as is until CPU_DB_TTL hours pass,
+    then it is revalidated with a conditional request (ETag/Last-Modified). If database can not
+    be reached, cached copy is used regardless of it's age and download is retried after cpuDatabaseRetryInterval
     """
-    f = urllib.request.urlopen("https://raw.githubusercontent.com/xTheEc0/Android-Device-Hardware-Specs-Database/master/database.json")
-    return json.loads(f.read())
+    cache = LoadCPUDatabaseCache(cachePath)
+    if cache is not None and time.time() - cache["fetched"] < GetCPUDatabaseTTL():
+        return cache["boards"]
+
+    # urllib is slow to import, so it is loaded only when database has to be downloaded
+    import urllib.error
+    import urllib.request
+    request = urllib.request.Request(url)
+    if cache is not None:
+        if cache.get("etag"):
+            request.add_header("If-None-Match", cache["etag"])
+        if cache.get("lastModified"):
+            request.add_header("If-Modified-Since", cache["lastModified"])
+    try:
+        with Span("web", "CPU database") as span:
+            response = urllib.request.urlopen(request, timeout=30)
+            content = response.read()
+            span.AddBytes(content)
+        database = json.loads(content)
+        cache = {
+            "fetched": time.time(),
+            "etag": response.headers.get("ETag"),
+            "lastModified": response.headers.get("Last-Modified"),
+            "boards": {board.lower(): data for board, data in database.items()}
+        }
+    except urllib.error.HTTPError as e:
+        if e.code != 304 or cache is None:
+            print("Failed to download CPU hardware database: %s" % (e))
+            return SaveFailedCPUDatabaseFetch(cache, cachePath)
+        # not modified since last download
+        cache["fetched"] = time.time()
+    except (urllib.error.URLError, OSError, ValueError):
+        if cache is None:
+            print("Can't connect to CPU hardware database. Please, check internet connection.")
+        return SaveFailedCPUDatabaseFetch(cache, cachePath)
+    SaveCPUDatabaseCache(cache, cachePath)
+    return cache["boards"]
@@ -0,0 +1,67 @@
+import os
+import sys
+import tempfile
+import unittest
+
+rootFolder = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(rootFolder, "src"))
+sys.path.insert(0, os.path.join(rootFolder, "benchmarks"))
+
+from fakeadbserver import FakeAdbServer
+from modules.adbclient import AdbClient, AdbError
+
+
+class AdbClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeAdbServer([("S1", "device"), ("S2", "unauthorized")],
+                                    {"getprop ro.product.model": b"Pixel 3\n", "screencap": b"\x00\x01\x02"}).Start()
+        self.client = AdbClient("127.0.0.1", self.server.GetPort(), timeout=5)
+
+    def tearDown(self):
+        self.server.Stop()
+
+    def test_version(self):
+        self.assertEqual(self.client.GetVersion(), 41)
+
+    def test_devices(self):
+        self.assertEqual(self.client.GetDevices(), [("S1", "device"), ("S2", "unauthorized")])
+
+    def test_shell(self):
+        self.assertEqual(self.client.Shell("S1", "getprop ro.product.model"), b"Pixel 3\n")
+        self.assertEqual(self.client.ExecuteCommand(["adb", "-s", "S1", "shell", "getprop", "ro.product.model"]), (b"Pixel 3\n", b""))
+
+    def test_exec_out(self):
+        self.assertEqual(self.client.ExecOut("S1", "screencap"), b"\x00\x01\x02")
+
+    def test_missing_device(self):
+        with self.assertRaises(AdbError):
+            self.client.Shell("S3", "ls")
+        output, err = self.client.ExecuteCommand(["adb", "-s", "S3", "shell", "ls"])
+        self.assertIn(b"not found", err)
+
+    def test_push_and_pull(self):
+        # bigger than one sync chunk, so file is sent and received in several DATA packets
+        content = os.urandom(150 * 1024)
+        with tempfile.TemporaryDirectory() as folder:
+            localPath = os.path.join(folder, "local.bin")
+            pulledPath = os.path.join(folder, "pulled.bin")
+            with open(localPath, mode="wb") as localFile:
+                localFile.write(content)
+            self.client.Push("S1", localPath, "/sdcard/file.bin")
+            self.assertEqual(self.client.Stat("S1", "/sdcard/file.bin")[:2], (0o100644, len(content)))
+            self.client.Pull("S1", "/sdcard/file.bin", pulledPath)
+            with open(pulledPath, mode="rb") as pulledFile:
+                self.assertEqual(pulledFile.read(), content)
+
+    def test_pull_missing_file(self):
+        with tempfile.TemporaryDirectory() as folder:
+            localPath = os.path.join(folder, "missing.bin")
+            with self.assertRaises(AdbError):
+                self.client.Pull("S1", "/sdcard/missing.bin", localPath)
+            self.assertFalse(os.path.exists(localPath))
+        self.assertEqual(self.client.Stat("S1", "/sdcard/missing.bin")[0], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,242 @@
+import os
+import struct
+import sys
+import tempfile
+import unittest
+import zipfile
+
+rootFolder = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(rootFolder, "src"))
+
+from modules import apkReader
+from modules.apkReader import TYPE_INT_DEC, TYPE_REFERENCE, TYPE_STRING, noIndex
+
+
+def Pad(data):
+    return data + b"\x00" * (-len(data) % 4)
+
+
+def Chunk(chunkType, header, body):
+    """
+    header is everything after the common 8 byte chunk header
+    """
+    return struct.pack("<HHI", chunkType, 8 + len(header), 8 + len(header) + len(body)) + header + body
+
+
+def StringPool(strings, isUTF8):
+    data = b""
+    offsets = []
+    for string in strings:
+        offsets.append(len(data))
+        if isUTF8:
+            encoded = string.encode("utf-8")
+            for length in [len(string), len(encoded)]:
+                data += bytes([0x80 | (length >> 8), length & 0xff]) if length > 0x7f else bytes([length])
+            data += encoded + b"\x00"
+        else:
+            length = len(string)
+            data += struct.pack("<HH", 0x8000 | (length >> 16), length & 0xffff) if length > 0x7fff else struct.pack("<H", length)
+            data += string.encode("utf-16-le") + b"\x00\x00"
+    offsetsData = struct.pack("<%dI" % (len(offsets)), *offsets)
+    flags = (1 << 8) if isUTF8 else 0
+    header = struct.pack("<IIIII", len(strings), 0, flags, 28 + len(offsetsData), 0)
+    return Chunk(apkReader.RES_STRING_POOL_TYPE, header, offsetsData + Pad(data))
+
+
+class ManifestBuilder:
+    """
+    Builds binary AndroidManifest.xml. Attribute names listed in resourceIDs go first in the string pool,
+    so their indexes match the resource map
+    """
+
+    def __init__(self, resourceIDs, isUTF8=False):
+        self.resourceIDs = resourceIDs
+        self.strings = list(resourceIDs.keys())
+        self.isUTF8 = isUTF8
+        self.chunks = []
+
+    def Index(self, string):
+        if string not in self.strings:
+            self.strings.append(string)
+        return self.strings.index(string)
+
+    def Start(self, tag, attributes=None):
+        """
+        attributes - list of (name, dataType, value). String values are added to the string pool
+        """
+        attributesData = b""
+        for name, dataType, value in attributes or []:
+            rawValue = noIndex
+            if dataType == TYPE_STRING:
+                value = rawValue = self.Index(value)
+            attributesData += struct.pack("<IIIHBBI", noIndex, self.Index(name), rawValue, 8, 0, dataType, value)
+        extension = struct.pack("<IIHHHHHH", noIndex, self.Index(tag), 20, 20, len(attributes or []), 0, 0, 0)
+        self.chunks.append(Chunk(apkReader.RES_XML_START_ELEMENT_TYPE, struct.pack("<II", 1, noIndex), extension + attributesData))
+        return self
+
+    def End(self, tag):
+        self.chunks.append(Chunk(apkReader.RES_XML_END_ELEMENT_TYPE, struct.pack("<II", 1, noIndex), struct.pack("<II", noIndex, self.Index(tag))))
+        return self
+
+    def Build(self):
+        resourceMap = Chunk(apkReader.RES_XML_RESOURCE_MAP_TYPE, b"", struct.pack("<%dI" % (len(self.resourceIDs)), *self.resourceIDs.values()))
+        return Chunk(apkReader.RES_XML_TYPE, b"", StringPool(self.strings, self.isUTF8) + resourceMap + b"".join(self.chunks))
+
+
+def TypeChunk(typeID, entries, isSparse):
+    """
+    entries - {entry index: (dataType, value)}. Dense types list offsets for every index up to the biggest one
+    """
+    entriesData = b""
+    offsets = {}
+    for index, (dataType, value) in sorted(entries.items()):
+        offsets[index] = len(entriesData)
+        entriesData += struct.pack("<HHI", 8, 0, 0) + struct.pack("<HBBI", 8, 0, dataType, value)
+    if isSparse:
+        offsetsData = b"".join(struct.pack("<HH", index, offset // 4) for index, offset in sorted(offsets.items()))
+        entryCount = len(offsets)
+    else:
+        entryCount = max(offsets) + 1
+        offsetsData = b"".join(struct.pack("<I", offsets.get(index, noIndex)) for index in range(entryCount))
+    config = struct.pack("<I", 64) + b"\x00" * 60
+    headerSize = 20 + len(config)
+    header = struct.pack("<BBHII", typeID, 0x01 if isSparse else 0, 0, entryCount, headerSize + len(offsetsData)) + config
+    return Chunk(apkReader.RES_TABLE_TYPE_TYPE, header, offsetsData + entriesData)
+
+
+def ResourceTable(strings, types, packageID=0x7f):
+    packageName = "com.example.app".encode("utf-16-le").ljust(256, b"\x00")
+    packageHeader = struct.pack("<I", packageID) + packageName + struct.pack("<IIIII", 0, 0, 0, 0, 0)
+    package = Chunk(apkReader.RES_TABLE_PACKAGE_TYPE, packageHeader, b"".join(types))
+    return Chunk(apkReader.RES_TABLE_TYPE, struct.pack("<I", 1), StringPool(strings, isUTF8=True) + package)
+
+
+manifestAttributes = {"versionCode": 0x0101021b, "versionName": 0x0101021c, "minSdkVersion": 0x0101020c, "name": 0x01010003}
+
+
+class StringPoolTest(unittest.TestCase):
+
+    def test_utf8_and_utf16(self):
+        # long strings need two byte lengths in both encodings
+        strings = ["", "manifest", "ünïcödé", "x" * 300]
+        for isUTF8 in [True, False]:
+            self.assertEqual(apkReader.ReadStringPool(StringPool(strings, isUTF8), 0), strings)
+
+    def test_long_utf16(self):
+        strings = ["y" * 0x8001]
+        self.assertEqual(apkReader.ReadStringPool(b"pad!" + StringPool(strings, isUTF8=False), 4), strings)
+
+    def test_not_string_pool(self):
+        with self.assertRaises(apkReader.ApkReaderError):
+            apkReader.ReadStringPool(Chunk(apkReader.RES_XML_TYPE, b"\x00" * 20, b""), 0)
+
+
+class BinaryXmlTest(unittest.TestCase):
+
+    def test_events(self):
+        for isUTF8 in [True, False]:
+            manifest = ManifestBuilder(manifestAttributes, isUTF8) \
+                .Start("manifest", [("package", TYPE_STRING, "com.example.app"), ("versionCode", TYPE_INT_DEC, 7)]) \
+                .Start("uses-sdk", [("minSdkVersion", TYPE_INT_DEC, 21)]).End("uses-sdk") \
+                .End("manifest").Build()
+            self.assertEqual(list(apkReader.ParseBinaryXml(manifest)), [
+                ("start", "manifest", {"package": (TYPE_STRING, "com.example.app"), "versionCode": (TYPE_INT_DEC, 7)}),
+                ("start", "uses-sdk", {"minSdkVersion": (TYPE_INT_DEC, 21)}),
+                ("end", "uses-sdk", None),
+                ("end", "manifest", None)
+            ])
+
+    def test_not_binary_xml(self):
+        with self.assertRaises(apkReader.ApkReaderError):
+            list(apkReader.ParseBinaryXml(b"<?xml version='1.0'?>"))
+
+
+class ResourceTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = ResourceTable(["1.0", "2.0"], [
+            # @string: dense, entry 1 is missing
+            TypeChunk(0x02, {0: (TYPE_STRING, 0), 2: (TYPE_STRING, 1)}, isSparse=False),
+            # @integer: sparse
+            TypeChunk(0x03, {5: (TYPE_INT_DEC, 42), 9: (TYPE_INT_DEC, 43)}, isSparse=True)
+        ])
+
+    def test_dense(self):
+        self.assertEqual(apkReader.ResolveStringResource(self.table, 0x7f020000), "1.0")
+        self.assertEqual(apkReader.ResolveStringResource(self.table, 0x7f020002), "2.0")
+        self.assertIsNone(apkReader.ResolveStringResource(self.table, 0x7f020001))
+        self.assertIsNone(apkReader.ResolveStringResource(self.table, 0x7f020003))
+
+    def test_sparse(self):
+        self.assertEqual(apkReader.ResolveResource(self.table, 0x7f030005), (TYPE_INT_DEC, 42))
+        self.assertEqual(apkReader.ResolveResource(self.table, 0x7f030009), (TYPE_INT_DEC, 43))
+        self.assertIsNone(apkReader.ResolveResource(self.table, 0x7f030006))
+        # integers are not strings
+        self.assertIsNone(apkReader.ResolveStringResource(self.table, 0x7f030005))
+
+    def test_other_package(self):
+        self.assertIsNone(apkReader.ResolveResource(self.table, 0x01020000))
+
+
+class ReadAPKInfoTest(unittest.TestCase):
+
+    def WriteApk(self, folder, manifest, table=None):
+        apkPath = os.path.join(folder, "app.apk")
+        with zipfile.ZipFile(apkPath, mode="w") as apk:
+            apk.writestr("AndroidManifest.xml", manifest)
+            if table is not None:
+                apk.writestr("resources.arsc", table)
+            apk.writestr("lib/arm64-v8a/libapp.so", b"")
+            apk.writestr("lib/armeabi-v7a/libapp.so", b"")
+            apk.writestr("classes.dex", b"")
+        return apkPath
+
+    def BuildManifest(self, versionCode, versionName):
+        return ManifestBuilder(manifestAttributes) \
+            .Start("manifest", [("package", TYPE_STRING, "com.example.app"), ("versionCode",) + versionCode, ("versionName",) + versionName]) \
+            .Start("uses-sdk", [("minSdkVersion", TYPE_INT_DEC, 21)]).End("uses-sdk") \
+            .Start("application") \
+            .Start("activity", [("name", TYPE_STRING, ".SettingsActivity")]).End("activity") \
+            .Start("activity", [("name", TYPE_STRING, ".MainActivity")]) \
+            .Start("intent-filter") \
+            .Start("action", [("name", TYPE_STRING, "android.intent.action.MAIN")]).End("action") \
+            .Start("category", [("name", TYPE_STRING, "android.intent.category.LAUNCHER")]).End("category") \
+            .End("intent-filter") \
+            .End("activity") \
+            .End("application") \
+            .End("manifest").Build()
+
+    def test_plain_values(self):
+        with tempfile.TemporaryDirectory() as folder:
+            apkPath = self.WriteApk(folder, self.BuildManifest((TYPE_INT_DEC, 12), (TYPE_STRING, "1.2")))
+            self.assertEqual(apkReader.ReadAPKInfo(apkPath), {
+                "package": "com.example.app",
+                "versionCode": "12",
+                "versionName": "1.2",
+                "launchableActivity": "com.example.app.MainActivity",
+                "nativeAbis": ["arm64-v8a", "armeabi-v7a"],
+                "minSdk": "21"
+            })
+
+    def test_referenced_version(self):
+        table = ResourceTable(["3.1.4"], [
+            TypeChunk(0x02, {0: (TYPE_STRING, 0)}, isSparse=False),
+            TypeChunk(0x03, {5: (TYPE_INT_DEC, 314)}, isSparse=True)
+        ])
+        with tempfile.TemporaryDirectory() as folder:
+            apkPath = self.WriteApk(folder, self.BuildManifest((TYPE_REFERENCE, 0x7f030005), (TYPE_REFERENCE, 0x7f020000)), table)
+            info = apkReader.ReadAPKInfo(apkPath)
+        self.assertEqual(info["versionCode"], "314")
+        self.assertEqual(info["versionName"], "3.1.4")
+
+    def test_missing_manifest(self):
+        with tempfile.TemporaryDirectory() as folder:
+            apkPath = os.path.join(folder, "app.apk")
+            with zipfile.ZipFile(apkPath, mode="w") as apk:
+                apk.writestr("classes.dex", b"")
+            with self.assertRaises(apkReader.ApkReaderError):
+                apkReader.ReadAPKInfo(apkPath)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import sys
+import tempfile
+import unittest
+
+rootFolder = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(rootFolder, "src"))
+
+from modules import marketNames
+
+supportedDevices = """Retail Branding,Marketing Name,Device,Model
+Google,Pixel 3,blueline,Pixel 3
+Google,Pixel 3 XL,crosshatch,Pixel 3 XL
+Google,,sargo,Pixel 3a
+LGE,G7 ThinQ,judyln,LM-G710
+Samsung,Galaxy S10,beyond1,SM-G973F
+Samsung,Galaxy S10,beyond1,SM-G973U
+Samsung,Galaxy Tab A,gta8wifi,SM-X200
+Xiaomi,"Redmi Note 8, 2021",biloba,M1908C3JGG
+"""
+
+# (manufacturer, model code, product name, product device) -> market name
+cases = [
+    (("Google", "Pixel 3", "blueline", "blueline"), "Pixel 3"),
+    (("Google", "Pixel 3 XL", "crosshatch", "crosshatch"), "Pixel 3 XL"),
+    (("samsung", "SM-G973U", "beyond1ue", "beyond1"), "Galaxy S10"),
+    # device codename, when model code is not listed
+    (("samsung", "SM-G973X", "beyond1xx", "beyond1"), "Galaxy S10"),
+    # manufacturer is only contained in the retail branding
+    (("LG", "LM-G710", "judyln_lao_com", "judyln"), "G7 ThinQ"),
+    # model code is only contained in the listed model
+    (("samsung", "SM-X20", "gta8", "gta8"), "Galaxy Tab A"),
+    (("Xiaomi", "M1908C3JGG", "biloba", "biloba"), "Redmi Note 8, 2021"),
+    (("Google", "Pixel 9", "tokay", "tokay"), "-"),
+    (("Nokia", "TA-1234", "dragon", "dragon"), "")
+]
+
+
+def FindMarketNameByScan(csvPath, manufacturer, modelCode, productName, productDevice):
+    """
+    Linear scan over supported_devices.csv which was used before the index, kept as a reference
+    """
+    marketName = ""
+    checkDeviceRange = False
+    with open(csvPath, mode='r', buffering=-1, encoding="UTF-16") as f:
+        for line in f:
+            splitLine = line.split(",")
+            tempName = '-'
+            if manufacturer.lower() in splitLine[0].lower():
+                checkDeviceRange = True
+                if modelCode.lower() == splitLine[3].strip().lower():
+                    if(splitLine[1]):
+                        marketName = splitLine[1]
+                        break
+                if modelCode.lower() in splitLine[3].lower():
+                    tempName = splitLine[1]
+                if productName.lower() in line.lower():
+                    tempName = splitLine[1]
+                if productDevice.lower() == splitLine[2].lower():
+                    tempName = splitLine[1]
+            if checkDeviceRange and not manufacturer.lower() in splitLine[0].lower():
+                marketName = tempName
+                break
+    return marketName
+
+
+class MarketNameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.csvPath = os.path.join(self.folder.name, "supported_devices.csv")
+        with open(self.csvPath, mode="w", encoding="UTF-16", newline="") as csvFile:
+            csvFile.write(supportedDevices)
+        self.originalPaths = marketNames.supportedDevicesPath, marketNames.indexPath
+        marketNames.supportedDevicesPath = self.csvPath
+        marketNames.indexPath = os.path.join(self.folder.name, "supported_devices.idx")
+        marketNames.marketNameIndex = None
+
+    def tearDown(self):
+        marketNames.supportedDevicesPath, marketNames.indexPath = self.originalPaths
+        marketNames.marketNameIndex = None
+        self.folder.cleanup()
+
+    def test_market_names(self):
+        for device, marketName in cases:
+            with self.subTest(device=device):
+                self.assertEqual(marketNames.FindMarketName(*device), marketName)
+
+    def test_same_as_scan(self):
+        # every name the old scan found is still found
+        for device, marketName in cases:
+            scannedName = FindMarketNameByScan(self.csvPath, *device)
+            if scannedName not in ["", "-"]:
+                with self.subTest(device=device):
+                    self.assertEqual(marketNames.FindMarketName(*device), scannedName)
+
+    def test_saved_index(self):
+        marketNames.FindMarketName("Google", "Pixel 3", "blueline", "blueline")
+        self.assertTrue(os.path.isfile(marketNames.indexPath))
+        # next run loads the index from the file
+        marketNames.marketNameIndex = None
+        self.assertEqual(marketNames.FindMarketName("LG", "LM-G710", "judyln", "judyln"), "G7 ThinQ")
+
+
+if __name__ == "__main__":
+    unittest.main()
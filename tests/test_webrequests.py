@@ -0,0 +1,103 @@
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+rootFolder = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(rootFolder, "src"))
+
+from modules import webrequests
+
+databaseContent = json.dumps({"SDM845": {"SoC": "Snapdragon 845"}}).encode("utf-8")
+databaseETag = '"v1"'
+
+
+class DatabaseHandler(BaseHTTPRequestHandler):
+    """
+    Serves CPU database with an ETag and answers 304 when client already has it
+    """
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == databaseETag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", databaseETag)
+        self.send_header("Content-Length", str(len(databaseContent)))
+        self.end_headers()
+        self.wfile.write(databaseContent)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CPUDatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), DatabaseHandler)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:%d/database.json" % (self.server.server_address[1])
+        self.folder = tempfile.TemporaryDirectory()
+        self.cachePath = os.path.join(self.folder.name, "cpu_database.json")
+        # every test starts with expired cache, unless it writes a fresh one itself
+        self.originalTTL = webrequests.GetCPUDatabaseTTL
+        webrequests.GetCPUDatabaseTTL = lambda: 24 * 3600
+
+    def tearDown(self):
+        webrequests.GetCPUDatabaseTTL = self.originalTTL
+        self.server.shutdown()
+        self.server.server_close()
+        self.folder.cleanup()
+
+    def ReadCache(self):
+        with open(self.cachePath, mode="r", encoding="utf-8") as cacheFile:
+            return json.load(cacheFile)
+
+    def ExpireCache(self):
+        cache = self.ReadCache()
+        cache["fetched"] = 0
+        with open(self.cachePath, mode="w", encoding="utf-8") as cacheFile:
+            json.dump(cache, cacheFile)
+
+    def test_download_and_fresh_cache(self):
+        boards = webrequests.GetCPUHardwareData(self.url, self.cachePath)
+        self.assertEqual(boards, {"sdm845": {"SoC": "Snapdragon 845"}})
+        self.assertEqual(self.ReadCache()["etag"], databaseETag)
+        # fresh cache is used without any request
+        webrequests.GetCPUHardwareData(self.url, self.cachePath)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_not_modified(self):
+        webrequests.GetCPUHardwareData(self.url, self.cachePath)
+        self.ExpireCache()
+        boards = webrequests.GetCPUHardwareData(self.url, self.cachePath)
+        self.assertEqual(boards, {"sdm845": {"SoC": "Snapdragon 845"}})
+        self.assertEqual(self.server.requests[-1].get("If-None-Match"), databaseETag)
+        self.assertGreater(self.ReadCache()["fetched"], time.time() - 60)
+
+    def test_offline_backoff(self):
+        webrequests.GetCPUHardwareData(self.url, self.cachePath)
+        self.ExpireCache()
+        # nothing listens on the port anymore
+        with socket.socket() as unusedSocket:
+            unusedSocket.bind(("127.0.0.1", 0))
+            offlineUrl = "http://127.0.0.1:%d/database.json" % (unusedSocket.getsockname()[1])
+        boards = webrequests.GetCPUHardwareData(offlineUrl, self.cachePath)
+        self.assertEqual(boards, {"sdm845": {"SoC": "Snapdragon 845"}})
+        # next download is attempted after retry interval, not on the next run
+        expectedFetched = time.time() - webrequests.GetCPUDatabaseTTL() + webrequests.cpuDatabaseRetryInterval
+        self.assertAlmostEqual(self.ReadCache()["fetched"], expectedFetched, delta=60)
+        webrequests.GetCPUHardwareData(offlineUrl, self.cachePath)
+        self.assertEqual(len(self.server.requests), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()